@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Alignment of sampled signals onto the timestamps of another source.
+
+All sources log sorted timestamps, so every query is resolved with a binary
+search (np.searchsorted) instead of a scan over the whole reference log:
+aligning N query times against M samples is O(N log M).
+
+Modes:
+    "nearest"   the sample closest in time (ties and repeated timestamps
+                resolve to the earliest sample, like np.argmin)
+    "previous"  the last sample at or before the query time
+    "linear"    linear interpolation between the bracketing samples
+
+With max_gap set, a query is marked missing when the sample(s) it reads from
+lie more than max_gap seconds away.
+"""
+
+import numpy as np
+
+ALIGN_MODES = ("nearest", "previous", "linear")
+
+
+def _first_occurrence(times, idx):
+    """Moves indices inside a run of repeated timestamps to the start of the run."""
+    return np.searchsorted(times, times[idx], side="left")
+
+
+def align_indices(times, query, mode="nearest", max_gap=None):
+    """Index of the sample in sorted times used for each query time.
+
+    Returns (idx, valid).  idx is always a usable index; valid is False where
+    the query falls before the first sample in "previous" mode or where the
+    sample is more than max_gap away.
+    """
+    if mode not in ("nearest", "previous"):
+        raise ValueError(f"align_indices supports 'nearest' and 'previous', not {mode!r}")
+    times = np.asarray(times, dtype="float64")
+    query = np.asarray(query, dtype="float64")
+    if len(times) == 0:
+        raise ValueError("Cannot align against an empty time series")
+
+    if mode == "previous":
+        idx = np.searchsorted(times, query, side="right") - 1
+        valid = idx >= 0
+        idx = np.maximum(idx, 0)
+        gap = query - times[idx]
+    else:
+        right = np.clip(np.searchsorted(times, query, side="left"), 1, max(len(times) - 1, 1))
+        left = right - 1
+        if len(times) == 1:
+            idx = np.zeros(query.shape, dtype=np.intp)
+        else:
+            idx = np.where(query - times[left] <= times[right] - query, left, right)
+        idx = _first_occurrence(times, idx)
+        valid = np.ones(query.shape, dtype=bool)
+        gap = np.abs(query - times[idx])
+
+    if max_gap is not None:
+        valid &= gap <= max_gap
+    return idx, valid
+
+
+def align(times, values, query, mode="nearest", max_gap=None):
+    """Samples values (indexed along axis 0 by sorted times) at the query times.
+
+    Returns an array with len(query) rows; rows marked missing by the mode or by
+    max_gap are NaN.
+    """
+    if mode not in ALIGN_MODES:
+        raise ValueError(f"Unknown alignment mode {mode!r}, expected one of {ALIGN_MODES}")
+    times = np.asarray(times, dtype="float64")
+    values = np.asarray(values, dtype="float64")
+    query = np.asarray(query, dtype="float64")
+
+    if mode != "linear":
+        idx, valid = align_indices(times, query, mode, max_gap)
+        aligned = values[idx]
+    else:
+        # Bracketing samples, clamped at both ends like np.interp
+        right = np.clip(np.searchsorted(times, query, side="right"), 0, len(times) - 1)
+        left = np.clip(np.searchsorted(times, query, side="right") - 1, 0, len(times) - 1)
+        span = times[right] - times[left]
+        weight = np.divide(query - times[left], span, out=np.zeros_like(query), where=span > 0)
+        weight = np.clip(weight, 0, 1).reshape((-1,) + (1,) * (values.ndim - 1))
+        aligned = values[left] + weight * (values[right] - values[left])
+        valid = np.ones(query.shape, dtype=bool)
+        if max_gap is not None:
+            valid &= (np.abs(query - times[left]) <= max_gap) & (np.abs(times[right] - query) <= max_gap)
+
+    if not valid.all():
+        aligned = aligned.copy()
+        aligned[~valid] = np.nan
+    return aligned
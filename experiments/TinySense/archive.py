@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+Compact, time-indexed archive of a flight's raw logs.
+
+A CSV has to be parsed in full even to look at a few seconds of it.  An
+archive (one .tsa file per flight) stores the crazyflie, tinysense and mocap
+logs as typed columns, cut into chunks of chunk_rows rows that are
+compressed column by column:
+
+* float columns as float64 and integer columns (header.seq,
+  header.stamp.secs/nsecs) as int64 deltas, both byte-shuffled before zlib so
+  the slowly changing high bytes compress well,
+* text columns (header.frame_id) as codes into a per-column list of labels.
+
+The values are exactly those pandas parses from the CSV.  Next to the chunk
+offsets, the header keeps the smallest and largest timestamp of every chunk:
+a sparse time index, searched by binary search so that
+FlightArchive.read_window decompresses only the chunks (and columns) a time
+window needs.  A 10 s window of an hour-long flight reads a handful of
+chunks in milliseconds.
+
+File layout: the magic bytes, the compressed chunks, a JSON header
+describing the sources, columns, chunks and index, and a 16-byte footer
+holding the header offset and the magic bytes again.  Chunks are written as
+the CSVs are streamed, so converting needs memory for one chunk only.
+
+loaders.load_flight_log, and with it preprocess_data, the cache and the
+runner, accept an archive path in place of any of a flight's CSVs; a
+manifest can point cf, ts and mocap at the same .tsa file.  Convert every
+flight in data/exp* and inspect an archive from the experiments folder with:
+
+    python -m TinySense.archive convert --data-dir data --output-dir archives
+    python -m TinySense.archive info archives/exp1.tsa
+"""
+
+import argparse
+import json
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from TinySense.flight_log import FlightLog
+
+ARCHIVE_SUFFIX = ".tsa"
+ARCHIVE_VERSION = 1
+MAGIC = b"TSARCHV1"
+FOOTER = struct.Struct("<Q8s")
+DEFAULT_CHUNK_ROWS = 8192
+# Column types, each able to hold the values of the ones before it
+COLUMN_TYPES = ("int64", "float64", "text")
+
+
+def is_archive(path):
+    return str(path).endswith(ARCHIVE_SUFFIX)
+
+
+def _shuffle(values):
+    """Bytes of values grouped by byte position: all first bytes, then all second bytes, ..."""
+    return np.ascontiguousarray(values.view(np.uint8).reshape(len(values), values.itemsize).T).tobytes()
+
+
+def _unshuffle(buffer, dtype):
+    dtype = np.dtype(dtype)
+    planes = np.frombuffer(buffer, dtype=np.uint8).reshape(dtype.itemsize, -1)
+    return np.ascontiguousarray(planes.T).view(dtype).ravel()
+
+
+def _encode(values, column_type, level):
+    if column_type == "int64":
+        values = np.diff(values, prepend=np.int64(0))  # Wraps around like the cumsum undoing it
+    return zlib.compress(_shuffle(np.ascontiguousarray(values)), level)
+
+
+def _decode(buffer, column_type):
+    if column_type == "float64":
+        return _unshuffle(zlib.decompress(buffer), "float64")
+    return np.cumsum(_unshuffle(zlib.decompress(buffer), "int64"))
+
+
+def _column_types(path, block_rows):
+    """Type of every column of a CSV over all its rows: text, float64 or int64."""
+    types = {}
+    for block in pd.read_csv(path, chunksize=block_rows):
+        for name, dtype in block.dtypes.items():
+            kind = "text" if dtype.kind not in "iufb" else "int64" if dtype.kind in "iub" else "float64"
+            previous = types.get(name, kind)
+            types[name] = max(previous, kind, key=COLUMN_TYPES.index)
+    return types
+
+
+def _write_source(file, path, chunk_rows, level, columns):
+    """Appends the chunks of one CSV to file; returns the source's header entry."""
+    types = _column_types(path, chunk_rows)
+    names = [name for name in types if columns is None or name in columns or name == next(iter(types))]
+    time_column = names[0]
+    dtypes = {name: {"float64": "float64", "int64": "int64", "text": str}[types[name]] for name in names}
+    labels = {name: {} for name in names if types[name] == "text"}
+
+    chunks = {"offset": [], "sizes": [], "rows": []}
+    min_times, max_times = [], []
+    is_sorted, last_time = True, -np.inf
+    for block in pd.read_csv(path, usecols=names, dtype=dtypes, chunksize=chunk_rows):
+        times = block[time_column].to_numpy(dtype="float64")
+        is_sorted = is_sorted and times[0] >= last_time and bool(np.all(times[1:] >= times[:-1]))
+        last_time = times[-1]
+        min_times.append(float(np.min(times)))
+        max_times.append(float(np.max(times)))
+
+        chunks["offset"].append(file.tell())
+        sizes = []
+        for name in names:
+            if name in labels:
+                codes = labels[name]
+                local, uniques = pd.factorize(block[name], use_na_sentinel=False)
+                to_code = np.array([codes.setdefault(None if pd.isna(label) else label, len(codes))
+                                    for label in uniques], dtype="int64")
+                payload = _encode(to_code[local], "int64", level)
+            else:
+                payload = _encode(block[name].to_numpy(dtype=types[name]), types[name], level)
+            file.write(payload)
+            sizes.append(len(payload))
+        chunks["sizes"].append(sizes)
+        chunks["rows"].append(len(block))
+
+    columns = [{"name": name, "type": types[name]} for name in names]
+    for column in columns:
+        if column["name"] in labels:
+            column["labels"] = list(labels[column["name"]])
+    return {"path": os.path.abspath(path), "time_column": time_column, "rows": sum(chunks["rows"]),
+            "sorted": is_sorted, "columns": columns, "chunks": chunks,
+            "index": {"min_time": min_times, "max_time": max_times}}
+
+
+def write_archive(output, sources, chunk_rows=DEFAULT_CHUNK_ROWS, level=6, columns=None):
+    """Converts the CSVs of a flight into an archive at output.
+
+    sources maps source names ("crazyflie", "tinysense", "mocap") to CSV
+    paths; columns optionally maps source names to the columns to keep (the
+    time column, the first, is always kept).  Returns the output path.
+    """
+    if chunk_rows < 1:
+        raise ValueError("chunk_rows must be positive")
+    tmp_path = f"{output}.tmp-{os.getpid()}"
+    header = {"version": ARCHIVE_VERSION, "created": time.time(), "chunk_rows": chunk_rows, "sources": {}}
+    try:
+        with open(tmp_path, "wb") as file:
+            file.write(MAGIC)
+            for source, path in sources.items():
+                keep = None if columns is None else columns.get(source)
+                header["sources"][source] = _write_source(file, path, chunk_rows, level, keep)
+            header_offset = file.tell()
+            file.write(json.dumps(header).encode())
+            file.write(FOOTER.pack(header_offset, MAGIC))
+        os.replace(tmp_path, output)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return output
+
+
+class FlightArchive:
+    """Reader of an archive written by write_archive; see the module docstring.
+
+        with FlightArchive("archives/exp1.tsa") as archive:
+            mocap = archive.read_window("mocap", t0, t0 + 10, ["pose.position.z"])
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._file.seek(-FOOTER.size, os.SEEK_END)
+            header_offset, magic = FOOTER.unpack(self._file.read(FOOTER.size))
+            self._file.seek(0)
+            if magic != MAGIC or self._file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a flight archive")
+            self._file.seek(header_offset)
+            self.header = json.loads(self._file.read(os.path.getsize(path) - FOOTER.size - header_offset))
+        except Exception:
+            self._file.close()
+            raise
+        if self.header["version"] != ARCHIVE_VERSION:
+            self._file.close()
+            raise ValueError(f"{path} has archive version {self.header['version']}, expected {ARCHIVE_VERSION}")
+
+        # Per source: min/max time and column byte offsets of every chunk as arrays
+        self._index = {}
+        for source, meta in self.header["sources"].items():
+            sizes = np.array(meta["chunks"]["sizes"], dtype="int64").reshape(len(meta["chunks"]["rows"]),
+                                                                             len(meta["columns"]))
+            starts = np.array(meta["chunks"]["offset"], dtype="int64")[:, None] + np.cumsum(sizes, axis=1) - sizes
+            self._index[source] = {"min_time": np.array(meta["index"]["min_time"], dtype="float64"),
+                                   "max_time": np.array(meta["index"]["max_time"], dtype="float64"),
+                                   "starts": starts, "sizes": sizes,
+                                   "positions": {column["name"]: j for j, column in enumerate(meta["columns"])}}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    @property
+    def sources(self):
+        return list(self.header["sources"])
+
+    def _source(self, source):
+        if source not in self.header["sources"]:
+            raise KeyError(f"No {source} log in {self.path}; it has {self.sources}")
+        return self.header["sources"][source]
+
+    def columns(self, source):
+        """Names of the columns of a source, time column first."""
+        return [column["name"] for column in self._source(source)["columns"]]
+
+    def labels(self, source, column):
+        """Labels of a text column: read_window returns codes into this list."""
+        return list(self._source(source)["columns"][self._index[source]["positions"][column]]["labels"])
+
+    def _read(self, source, chunk, column):
+        """Values of one column of one chunk."""
+        meta, index = self._source(source), self._index[source]
+        j = index["positions"][column]
+        self._file.seek(index["starts"][chunk, j])
+        column_type = meta["columns"][j]["type"]
+        return _decode(self._file.read(index["sizes"][chunk, j]), "int64" if column_type == "text" else column_type)
+
+    def _chunks(self, source, t0, t1):
+        """Chunks holding rows with t0 < time <= t1: binary search on the index of sorted logs."""
+        index = self._index[source]
+        if self._source(source)["sorted"]:
+            return range(np.searchsorted(index["max_time"], t0, side="right"),
+                          np.searchsorted(index["min_time"], t1, side="right"))
+        return np.flatnonzero((index["max_time"] > t0) & (index["min_time"] <= t1))
+
+    def read_window(self, source, t0=-np.inf, t1=np.inf, columns=None):
+        """FlightLog of the rows of a source with t0 < time <= t1.
+
+        Its first column is the time column, named "timestamp" as in
+        loaders.load_flight_csv, followed by columns (default all) in the
+        given order.  Integer columns are widened to float64 and text columns
+        are returned as codes into labels(source, column).
+        """
+        meta = self._source(source)
+        time_column = meta["time_column"]
+        names = self._column_names(source, columns)
+
+        # Rows of every chunk in the window, from its decompressed timestamps
+        parts = []
+        for chunk in self._chunks(source, t0, t1):
+            times = self._read(source, chunk, time_column)
+            if meta["sorted"]:
+                rows = slice(np.searchsorted(times, t0, side="right"), np.searchsorted(times, t1, side="right"))
+            else:
+                rows = np.flatnonzero((times > t0) & (times <= t1))
+            parts.append((chunk, rows, times[rows]))
+        return self._assemble(source, parts, names)
+
+    def _column_names(self, source, columns):
+        """columns (default all) without the time column, checked against the source's."""
+        time_column = self._source(source)["time_column"]
+        names = [name for name in (self.columns(source) if columns is None else columns) if name != time_column]
+        missing = [name for name in names if name not in self._index[source]["positions"]]
+        if missing:
+            raise KeyError(f"No columns {missing} in the {source} log of {self.path}")
+        return names
+
+    def _assemble(self, source, parts, names):
+        """FlightLog of the given (chunk, rows, times) parts, decompressing each column of each chunk once."""
+        log = FlightLog.empty(sum(len(times) for _, _, times in parts), ["timestamp"] + names)
+        for j, name in enumerate(log.columns):
+            row = 0
+            for chunk, rows, times in parts:
+                log.data[row:row + len(times), j] = times if j == 0 else self._read(source, chunk, name)[rows]
+                row += len(times)
+        return log
+
+    def iter_blocks(self, source, columns=None):
+        """Yields the whole source as one FlightLog per chunk (see read_window for the columns)."""
+        names = self._column_names(source, columns)
+        time_column = self._source(source)["time_column"]
+        for chunk in range(len(self._source(source)["chunks"]["rows"])):
+            times = self._read(source, chunk, time_column)
+            yield self._assemble(source, [(chunk, slice(None), times)], names)
+
+
+def _info(path):
+    with FlightArchive(path) as archive:
+        print(f"{path}: {os.path.getsize(path) / 1e6:.2f} MB, chunks of {archive.header['chunk_rows']} rows")
+        for source, meta in archive.header["sources"].items():
+            compressed = sum(map(sum, meta["chunks"]["sizes"]))
+            raw = os.path.getsize(meta["path"]) if os.path.exists(meta["path"]) else None
+            ratio = f", CSV {raw / 1e6:.2f} MB ({raw / compressed:.1f}x)" if raw else ""
+            index = archive._index[source]
+            span = f"{index['min_time'][0]:.3f} .. {index['max_time'][-1]:.3f}" if meta["rows"] else "empty"
+            print(f"  {source}: {meta['rows']} rows in {len(meta['chunks']['rows'])} chunks, "
+                  f"{compressed / 1e6:.2f} MB{ratio}, time {span}")
+            print("    " + ", ".join(f"{column['name']} ({column['type']})" for column in meta["columns"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert flight CSVs to time-indexed archives or inspect one.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="archive every flight found in data_dir/exp*")
+    convert.add_argument("--data-dir", default="data")
+    convert.add_argument("--output-dir", default="archives")
+    convert.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    convert.add_argument("--level", type=int, default=6, help="zlib compression level")
+    info = commands.add_parser("info", help="describe an archive")
+    info.add_argument("archive")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        _info(args.archive)
+        return
+
+    from TinySense.runner import SOURCES, discover_experiments  # The runner imports the loaders, which import this
+    os.makedirs(args.output_dir, exist_ok=True)
+    for experiment in discover_experiments(args.data_dir, skip_incomplete=True):
+        output = os.path.join(args.output_dir, f"{experiment['name']}{ARCHIVE_SUFFIX}")
+        start = time.perf_counter()
+        write_archive(output, {source: experiment[key] for key, source in SOURCES.items()}, args.chunk_rows,
+                      args.level)
+        size = sum(os.path.getsize(experiment[key]) for key in SOURCES)
+        print(f"{output}: {size / 1e6:.2f} MB of CSV -> {os.path.getsize(output) / 1e6:.2f} MB "
+              f"in {time.perf_counter() - start:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of preprocessed experiments.
+
+load_experiment memoizes preprocess_data followed by interpolate_mocap.  Each
+entry is keyed on the SHA-256 of the three input CSVs, the preprocessing
+parameters and the source of the preprocessing code (code_digest), and stores every FlightLog as a .npy array that warm runs open as
+a copy-on-write memory map (no parsing and no copy until a value is written).
+The least recently used entries are evicted once the cache exceeds max_bytes.
+With chunked=True an entry is written block by block by TinySense.chunked
+instead, for logs too long to preprocess in memory.
+
+Inspect or clear the cache from the experiments folder with:
+
+    python -m TinySense.cache info
+    python -m TinySense.cache clear
+"""
+
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import re
+import shutil
+import sys
+import time
+
+import numpy as np
+
+from TinySense.chunked import DEFAULT_BLOCK_ROWS, write_chunked
+from TinySense.data_processing import preprocess_data, interpolate_mocap
+from TinySense.flight_log import FlightLog
+from TinySense.instrument import annotate, instrumented
+
+# Bump when the layout of entries changes; code changes are keyed by code_digest
+CACHE_VERSION = 2
+DEFAULT_CACHE_DIR = os.environ.get("TINYSENSE_CACHE_DIR", ".tinysense_cache")
+DEFAULT_MAX_BYTES = int(os.environ.get("TINYSENSE_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+FRAMES = ("cf", "ts", "mocap")
+PACKAGE = __name__.split(".")[0]
+
+# Lookups served from disk and recomputed in this process
+stats = {"hits": 0, "misses": 0}
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """SHA-256 of a file's content, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _package_module(value):
+    """Name of the TinySense module defining value (a module, function, class or instance), else None."""
+    name = value.__name__ if inspect.ismodule(value) else getattr(value, "__module__", None)
+    if isinstance(name, str) and (name == PACKAGE or name.startswith(f"{PACKAGE}.")) and name in sys.modules:
+        return name
+    return None
+
+
+def _module_source(name):
+    return inspect.getsource(sys.modules[name])
+
+
+def _reach(name, modules):
+    """Adds module name and every TinySense module its globals come from to modules."""
+    if name in modules:
+        return
+    modules.add(name)
+    for value in list(vars(sys.modules[name]).values()):
+        module = _package_module(value)
+        if module is not None:
+            _reach(module, modules)
+
+
+def _global_names(code):
+    """Global and attribute names used by code, including nested functions and comprehensions."""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= _global_names(const)
+    return names
+
+
+def code_digest(func):
+    """SHA-256 of the source of func and of every TinySense module it reaches.
+
+    A module is reached when func uses a function, class, instance or
+    submodule of it, or a constant assigned in it (such as RMS_COLUMNS),
+    and then through everything that module imports in turn.  Reached
+    modules are hashed whole, so editing a callee, a helper of it or a
+    module-level constant it reads changes the digest.
+    """
+    func = inspect.unwrap(func)
+    modules = set()
+    for name in _global_names(func.__code__):
+        if name not in func.__globals__:
+            continue
+        value = func.__globals__[name]
+        module = _package_module(value)
+        if module is not None:
+            _reach(module, modules)
+        elif not callable(value) and not inspect.ismodule(value):
+            # A constant: reach the module assigning it, not the ones importing it
+            assignment = re.compile(rf"^{re.escape(name)}\s*(:[^=\n]*)?=", re.MULTILINE)
+            for other in [other for other in sys.modules if _package_module(sys.modules[other])]:
+                if vars(sys.modules[other]).get(name) is value and assignment.search(_module_source(other)):
+                    _reach(other, modules)
+    digest = hashlib.sha256()
+    digest.update(f"{func.__module__}.{func.__qualname__}".encode())
+    digest.update(inspect.getsource(func).encode())
+    for module in sorted(modules):
+        digest.update(module.encode())
+        digest.update(_module_source(module).encode())
+    return digest.hexdigest()
+
+
+def preprocess_params(experiment_num, **params):
+    """All parameters that change the output of preprocess_data, defaults included."""
+    key_params = {name: parameter.default
+                  for name, parameter in inspect.signature(preprocess_data).parameters.items()
+                  if parameter.default is not inspect.Parameter.empty and name != "verbose"}
+    key_params.update(params)
+    key_params["experiment_num"] = experiment_num
+    return key_params
+
+
+def cache_key(paths, params, chunked=False):
+    """Key of a cache entry: input file contents, parameters, preprocessing code and cache version.
+
+    The code is the code_digest of preprocess_data and interpolate_mocap, plus
+    write_chunked for entries written out of core, which are keyed apart.
+    """
+    digest = hashlib.sha256(f"v{CACHE_VERSION}".encode())
+    for func in (preprocess_data, interpolate_mocap) + ((write_chunked,) if chunked else ()):
+        digest.update(code_digest(func).encode())
+    digest.update(f"chunked={bool(chunked)}".encode())
+    for path in paths:
+        digest.update(file_digest(path).encode())
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()[:32]
+
+
+def _entry_size(entry_dir):
+    return sum(entry.stat().st_size for entry in os.scandir(entry_dir) if entry.is_file())
+
+
+def _store(entry_dir, frames, params, paths):
+    """Writes the logs to a temporary directory and renames it into place."""
+    tmp_dir = f"{entry_dir}.tmp-{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    columns = {}
+    for name, frame in zip(FRAMES, frames):
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), frame.to_numpy(dtype="float64"))
+        columns[name] = list(frame.columns)
+    _commit(tmp_dir, entry_dir, columns, params, paths)
+
+
+def _commit(tmp_dir, entry_dir, columns, params, paths):
+    """Adds meta.json to the arrays in tmp_dir and renames it into place."""
+    meta = {"params": params, "sources": [os.path.abspath(p) for p in paths],
+            "created": time.time(), "columns": columns}
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as file:
+        json.dump(meta, file, indent=1)
+
+    try:
+        os.replace(tmp_dir, entry_dir)
+    except OSError:
+        # Another process stored the same entry first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _load(entry_dir):
+    """Opens a cache entry as FlightLogs backed by copy-on-write memory maps."""
+    meta_path = os.path.join(entry_dir, "meta.json")
+    with open(meta_path) as file:
+        meta = json.load(file)
+    os.utime(meta_path)  # Mark as recently used
+
+    frames = []
+    for name in FRAMES:
+        values = np.load(os.path.join(entry_dir, f"{name}.npy"), mmap_mode="c")
+        frames.append(FlightLog(values, meta["columns"][name]))
+    return tuple(frames)
+
+
+def list_entries(cache_dir=DEFAULT_CACHE_DIR):
+    """Cache entries as dicts of key, size, last use and parameters, oldest first."""
+    if not os.path.isdir(cache_dir):
+        return []
+    entries = []
+    for entry in os.scandir(cache_dir):
+        meta_path = os.path.join(entry.path, "meta.json")
+        if not entry.is_dir() or not os.path.exists(meta_path):
+            continue
+        with open(meta_path) as file:
+            meta = json.load(file)
+        entries.append({"key": entry.name, "path": entry.path, "bytes": _entry_size(entry.path),
+                        "last_used": os.path.getmtime(meta_path), "params": meta["params"],
+                        "sources": meta["sources"]})
+    return sorted(entries, key=lambda entry: entry["last_used"])
+
+
+def evict(cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, keep=()):
+    """Removes least recently used entries until the cache fits in max_bytes."""
+    entries = list_entries(cache_dir)
+    total = sum(entry["bytes"] for entry in entries)
+    for entry in entries:
+        if total <= max_bytes:
+            break
+        if entry["key"] in keep:
+            continue
+        shutil.rmtree(entry["path"], ignore_errors=True)
+        total -= entry["bytes"]
+    return total
+
+
+def clear(cache_dir=DEFAULT_CACHE_DIR):
+    """Deletes every cache entry."""
+    for entry in list_entries(cache_dir):
+        shutil.rmtree(entry["path"], ignore_errors=True)
+
+
+@instrumented()
+def load_experiment(cf_path, ts_path, mocap_path, experiment_num, cache_dir=DEFAULT_CACHE_DIR,
+                    max_bytes=DEFAULT_MAX_BYTES, chunked=False, block_rows=DEFAULT_BLOCK_ROWS, **params):
+    """Returns preprocess_data followed by interpolate_mocap, memoized on disk.
+
+    params are forwarded to preprocess_data.  Pass cache_dir=None to bypass the
+    cache.  chunked=True computes a missing entry out of core, block_rows rows
+    at a time, so memory stays bounded however long the logs are; it needs
+    the cache.
+    """
+    if cache_dir is None and chunked:
+        raise ValueError("chunked=True writes its results to the cache and needs a cache_dir")
+    if cache_dir is None:
+        annotate(cache="off")
+        cf_data, ts_data, mocap_data = preprocess_data(cf_path, ts_path, mocap_path, experiment_num, **params)
+        return cf_data, ts_data, interpolate_mocap(mocap_data)
+
+    paths = (cf_path, ts_path, mocap_path)
+    key_params = preprocess_params(experiment_num, **{k: v for k, v in params.items() if k != "verbose"})
+    key = cache_key(paths, key_params, chunked)
+    entry_dir = os.path.join(cache_dir, key)
+    if os.path.exists(os.path.join(entry_dir, "meta.json")):
+        stats["hits"] += 1
+        annotate(cache="hit")
+        return _load(entry_dir)
+
+    stats["misses"] += 1
+    annotate(cache="miss")
+    if chunked:
+        tmp_dir = f"{entry_dir}.tmp-{os.getpid()}"
+        columns = write_chunked(cf_path, ts_path, mocap_path, experiment_num, tmp_dir, block_rows,
+                                **{k: v for k, v in params.items() if k != "verbose"})
+        _commit(tmp_dir, entry_dir, columns, key_params, paths)
+        evict(cache_dir, max_bytes, keep=(key,))
+        return _load(entry_dir)
+    cf_data, ts_data, mocap_data = preprocess_data(cf_path, ts_path, mocap_path, experiment_num, **params)
+    mocap_data = interpolate_mocap(mocap_data)
+    os.makedirs(cache_dir, exist_ok=True)
+    _store(entry_dir, (cf_data, ts_data, mocap_data), key_params, paths)
+    evict(cache_dir, max_bytes, keep=(key,))
+    return cf_data, ts_data, mocap_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear the preprocessed experiment cache.")
+    parser.add_argument("command", choices=["info", "clear", "evict"])
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--max-bytes", type=int, default=DEFAULT_MAX_BYTES)
+    args = parser.parse_args()
+
+    if args.command == "clear":
+        clear(args.cache_dir)
+        print(f"Cleared {args.cache_dir}")
+    elif args.command == "evict":
+        total = evict(args.cache_dir, args.max_bytes)
+        print(f"{args.cache_dir}: {total / 1e6:.1f} MB after eviction")
+    else:
+        entries = list_entries(args.cache_dir)
+        for entry in entries:
+            last_used = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["last_used"]))
+            sources = ", ".join(os.path.basename(p) for p in entry["sources"])
+            print(f"{entry['key']}  {entry['bytes'] / 1e6:8.2f} MB  {last_used}  {sources}")
+        total = sum(entry["bytes"] for entry in entries)
+        print(f"{len(entries)} entries, {total / 1e6:.2f} MB of {args.max_bytes / 1e6:.0f} MB in {args.cache_dir}")
+
+
+if __name__ == "__main__":
+    main()
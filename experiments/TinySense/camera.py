@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""
+Host-side decoder and frame store for the CameraCapture sketch.
+
+src/sketches/CameraCapture/CameraCapture.ino streams PAG7920 frames at
+2 Mbaud in the ArduImageCapture protocol:
+
+* a command is 0x00, a length byte, the command byte (COMMAND_NEW_FRAME or
+  COMMAND_DEBUG_DATA), length - 1 argument bytes and their XOR checksum
+* COMMAND_NEW_FRAME is followed by width * height pixels of two bytes each,
+  the monochrome pixel spread over RGB565 with a parity bit forced into each
+  byte.  Pixel bytes are never zero, so a zero byte always starts a command
+
+Only the top five bits of a pixel survive the encoding (the rest are replaced
+by parity bits), so decoded pixels are multiples of 8.  FrameDecoder converts
+and parity-checks each frame with whole-array bit operations on a view of the
+receive buffer, and resynchronizes on the next command when bytes are lost.
+
+FrameStore appends decoded frames to a directory holding a fixed-stride raw
+frame file and a frame number/timestamp index, both read back as memory maps,
+so windows of a long recording are views that load nothing else.  Record a
+session from the experiments folder with:
+
+    python -m TinySense.camera record /dev/ttyACM0 camera_session --frames 500
+    python -m TinySense.camera info camera_session
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from TinySense.telemetry import open_serial
+
+FRAME_WIDTH = 160
+FRAME_HEIGHT = 120
+BAUDRATE = 2000000
+PIXEL_FORMAT = 0x01
+
+VERSION = 0x10
+COMMAND_NEW_FRAME = 0x01 | VERSION
+COMMAND_DEBUG_DATA = 0x03 | VERSION
+
+# Parity bits of the two pixel bytes, see formatRgbPixelByteH/L
+H_BYTE_PARITY_CHECK = 0b00100000
+H_BYTE_PARITY_INVERT = 0b00001000
+L_BYTE_PARITY_CHECK = 0b00001000
+L_BYTE_PARITY_INVERT = 0b00100000
+L_BYTE_PREVENT_ZERO = 0b00000001
+
+INDEX_DTYPE = np.dtype([("frame_num", "<u4"), ("timestamp", "<f8"), ("parity_errors", "<u4")])
+
+
+def encode_pixels(pixels):
+    """Pixel bytes the sketch sends for a uint8 frame (sendFrame), as an (..., 2) array."""
+    pixels = np.asarray(pixels, dtype=np.uint8)
+    high = (pixels & 0xF8) | (pixels >> 5)
+    low = ((pixels << 3) & 0xE0) | (pixels >> 3)
+    high = np.where(high & H_BYTE_PARITY_CHECK, high & (0xFF ^ H_BYTE_PARITY_INVERT), high | H_BYTE_PARITY_INVERT)
+    low = np.where(low & L_BYTE_PARITY_CHECK, low | L_BYTE_PARITY_INVERT, low & (0xFF ^ L_BYTE_PARITY_INVERT))
+    return np.stack([high, low | L_BYTE_PREVENT_ZERO], axis=-1).astype(np.uint8)
+
+
+def decode_pixels(raw):
+    """Pixels and per-pixel parity flags from (..., 2) or flat interleaved pixel bytes.
+
+    A pixel is flagged when either byte breaks its parity rule or the bits the
+    encoding repeats disagree.
+    """
+    raw = np.asarray(raw, dtype=np.uint8)
+    if raw.shape[-1] != 2:
+        raw = raw.reshape(raw.shape[:-1] + (-1, 2))
+    high, low = raw[..., 0], raw[..., 1]
+    pixels = (high & 0xF0) | ((low >> 3) & 0x08)
+
+    # H holds an odd number of set bits under its parity bits, L an even number
+    ok = (((high >> 5) ^ (high >> 3)) & 1) == 1
+    ok &= (((low >> 5) ^ (low >> 3)) & 1) == 0
+    ok &= (low & L_BYTE_PREVENT_ZERO) != 0
+    # Bits 7-5 of the pixel are repeated in H bits 2-0, bits 7-4 in L bits 4-1 and bit 4 in L bit 7
+    ok &= (high & 0x07) == (high >> 5)
+    ok &= ((low >> 1) & 0x0F) == (high >> 4)
+    ok &= (low >> 7) == ((high >> 4) & 1)
+    return pixels, ok
+
+
+def encode_command(command, arguments=b""):
+    """A command packet: 0x00, length, command byte, arguments and XOR checksum."""
+    body = bytes([command]) + bytes(arguments)
+    checksum = np.bitwise_xor.reduce(np.frombuffer(body, dtype=np.uint8))
+    return bytes([0x00, len(body)]) + body + bytes([checksum])
+
+
+def encode_frame(pixels):
+    """Bytes of one frame as sent by the sketch: new-frame command and pixel bytes."""
+    pixels = np.asarray(pixels, dtype=np.uint8)
+    height, width = pixels.shape
+    size_bits = ((width >> 8) & 0x03) | ((height >> 6) & 0x0C) | ((PIXEL_FORMAT << 4) & 0xF0)
+    header = encode_command(COMMAND_NEW_FRAME, [width & 0xFF, height & 0xFF, size_bits])
+    return header + encode_pixels(pixels).tobytes()
+
+
+def encode_debug(text):
+    """Bytes of a debug message (commandDebugPrint)."""
+    return encode_command(COMMAND_DEBUG_DATA, text.encode("ascii"))
+
+
+class FrameDecoder:
+    """Splits the CameraCapture byte stream into decoded frames and debug messages.
+
+    Frames are numbered like the sketch's frameNum, counting frames lost to
+    truncation, and stamped with the arrival time of the chunk completing them.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._frame = None  # (width, height) of the frame whose pixels are expected
+        self.frame_num = -1
+        self.dropped_frames = 0
+        self.skipped_bytes = 0  # Startup text and bytes lost between commands
+        self.messages = []
+
+    def feed(self, data, arrival_time):
+        """Returns a list of (frame_num, timestamp, pixels, parity_errors) completed by data."""
+        self._buffer += data
+        frames = []
+        position = self._parse(frames, arrival_time)
+        del self._buffer[:position]  # The buffer views of _parse are released by now
+        return frames
+
+    def _parse(self, frames, arrival_time):
+        """Decodes whole commands and frames from the buffer; returns the bytes consumed."""
+        position = 0
+        while True:
+            if self._frame is not None:
+                width, height = self._frame
+                size = 2 * width * height
+                raw = np.frombuffer(self._buffer, dtype=np.uint8, offset=position,
+                                    count=min(size, len(self._buffer) - position))
+                zeros = np.flatnonzero(raw == 0)
+                if len(zeros):
+                    # Bytes were lost and a command arrived early; drop the frame and resynchronize
+                    self.dropped_frames += 1
+                    position += int(zeros[0])
+                elif len(raw) < size:
+                    break  # Wait for the rest of the frame
+                else:
+                    pixels, ok = decode_pixels(raw)
+                    frames.append((self.frame_num, arrival_time, pixels.reshape(height, width),
+                                   int(ok.size - np.count_nonzero(ok))))
+                    position += size
+                self._frame = None
+                continue
+
+            start = self._buffer.find(0, position)
+            if start < 0:
+                self.skipped_bytes += len(self._buffer) - position
+                position = len(self._buffer)
+                break
+            self.skipped_bytes += start - position
+            if start + 2 > len(self._buffer):
+                position = start
+                break
+            length = self._buffer[start + 1]
+            end = start + 2 + length + 1
+            if end > len(self._buffer):
+                position = start
+                break
+            body = np.frombuffer(self._buffer, dtype=np.uint8, count=length, offset=start + 2)
+            if length == 0 or np.bitwise_xor.reduce(body) != self._buffer[end - 1]:
+                self.skipped_bytes += 1
+                position = start + 1
+                continue
+
+            command, arguments = body[0], body[1:]
+            if command == COMMAND_NEW_FRAME and len(arguments) == 3:
+                self.frame_num += 1
+                self._frame = (int(arguments[0]) | (int(arguments[2]) & 0x03) << 8,
+                               int(arguments[1]) | (int(arguments[2]) & 0x0C) << 6)
+            elif command == COMMAND_DEBUG_DATA:
+                self.messages.append((arrival_time, arguments.tobytes().decode("ascii", "replace")))
+            position = end
+        return position
+
+
+class FrameStore:
+    """Append-only recording of fixed-size uint8 frames with a frame number/timestamp index.
+
+    path is a directory holding meta.json, frames.u8 (frames back to back) and
+    index.bin (one INDEX_DTYPE record per frame).  frames and index are memory
+    maps that are reopened when frames are appended.
+    """
+
+    def __init__(self, path, width=FRAME_WIDTH, height=FRAME_HEIGHT):
+        """Opens the store at path, creating it for width x height frames if missing."""
+        self.path = path
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as file:
+                meta = json.load(file)
+            width, height = meta["width"], meta["height"]
+        else:
+            os.makedirs(path, exist_ok=True)
+            with open(meta_path, "w") as file:
+                json.dump({"width": width, "height": height, "created": time.time()}, file, indent=1)
+        self.width = width
+        self.height = height
+        self._frame_file = None
+        self._index_file = None
+        self._maps = None
+
+    @property
+    def frame_bytes(self):
+        return self.width * self.height
+
+    def __len__(self):
+        self.flush()
+        index_path = os.path.join(self.path, "index.bin")
+        records = os.path.getsize(index_path) // INDEX_DTYPE.itemsize if os.path.exists(index_path) else 0
+        frame_path = os.path.join(self.path, "frames.u8")
+        stored = os.path.getsize(frame_path) // self.frame_bytes if os.path.exists(frame_path) else 0
+        return min(records, stored)  # A frame is complete once both parts are written
+
+    def append(self, frame_num, timestamp, pixels, parity_errors=0):
+        """Appends one frame."""
+        pixels = np.asarray(pixels, dtype=np.uint8)
+        if pixels.size != self.frame_bytes:
+            raise ValueError(f"Expected {self.width}x{self.height} frame, got {pixels.size} pixels")
+        if self._frame_file is None:
+            self._frame_file = open(os.path.join(self.path, "frames.u8"), "ab")
+            self._index_file = open(os.path.join(self.path, "index.bin"), "ab")
+        self._frame_file.write(pixels.tobytes())
+        self._index_file.write(np.array((frame_num, timestamp, parity_errors), dtype=INDEX_DTYPE).tobytes())
+        self._maps = None
+
+    def extend(self, frames):
+        """Appends (frame_num, timestamp, pixels, parity_errors) tuples from FrameDecoder.feed."""
+        for frame in frames:
+            self.append(*frame)
+
+    def flush(self):
+        if self._frame_file is not None:
+            self._frame_file.flush()
+            self._index_file.flush()
+
+    def close(self):
+        if self._frame_file is not None:
+            self._frame_file.close()
+            self._index_file.close()
+            self._frame_file = self._index_file = None
+
+    def _open_maps(self):
+        self.flush()
+        n = len(self)
+        if self._maps is None or len(self._maps[1]) != n:
+            if n == 0:
+                frames = np.zeros((0, self.height, self.width), dtype=np.uint8)
+                index = np.zeros(0, dtype=INDEX_DTYPE)
+            else:
+                frames = np.memmap(os.path.join(self.path, "frames.u8"), dtype=np.uint8, mode="r",
+                                   shape=(n, self.height, self.width))
+                index = np.memmap(os.path.join(self.path, "index.bin"), dtype=INDEX_DTYPE, mode="r", shape=(n,))
+            self._maps = (frames, index)
+        return self._maps
+
+    @property
+    def frames(self):
+        """Read-only (N, height, width) memory map of all frames."""
+        return self._open_maps()[0]
+
+    @property
+    def index(self):
+        """Read-only memory map of the frame_num/timestamp/parity_errors records."""
+        return self._open_maps()[1]
+
+    def window(self, start, stop):
+        """Views of frames start:stop and their index records."""
+        frames, index = self._open_maps()
+        return frames[start:stop], index[start:stop]
+
+    def time_window(self, t_start, t_stop):
+        """Views of the frames stamped in [t_start, t_stop) and their index records."""
+        frames, index = self._open_maps()
+        start, stop = np.searchsorted(index["timestamp"], [t_start, t_stop])
+        return frames[start:stop], index[start:stop]
+
+
+def record(source, store, n_frames=None, duration=None, chunk_size=1 << 16, clock=time.time):
+    """Decodes a byte source into a FrameStore until n_frames, duration or end of stream.
+
+    source is anything with read(size) returning bytes, such as open_camera().
+    Returns the FrameDecoder for its drop and message counters.
+    """
+    decoder = FrameDecoder()
+    stored = 0
+    start = clock()
+    while n_frames is None or stored < n_frames:
+        if duration is not None and clock() - start >= duration:
+            break
+        data = source.read(chunk_size)
+        if not data:
+            if getattr(source, "timeout", None) is not None:
+                continue  # Serial read timed out
+            break
+        frames = decoder.feed(data, clock())
+        if n_frames is not None:
+            frames = frames[:n_frames - stored]
+        store.extend(frames)
+        stored += len(frames)
+    store.flush()
+    return decoder
+
+
+def open_camera(port, baudrate=BAUDRATE, timeout=0.1):
+    """Opens the serial port of a board running CameraCapture."""
+    return open_serial(port, baudrate, timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record or inspect CameraCapture sessions.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    record_parser = subparsers.add_parser("record", help="record frames from a serial port")
+    record_parser.add_argument("port")
+    record_parser.add_argument("output", help="frame store directory")
+    record_parser.add_argument("--frames", type=int)
+    record_parser.add_argument("--duration", type=float, help="seconds to record")
+    info_parser = subparsers.add_parser("info", help="summarize a frame store")
+    info_parser.add_argument("store")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        store = FrameStore(args.output)
+        with open_camera(args.port) as port:
+            decoder = record(port, store, args.frames, args.duration)
+        store.close()
+        print(f"Recorded {len(store)} frames to {args.output}, dropped {decoder.dropped_frames}")
+        for _, message in decoder.messages:
+            print(f"  debug: {message}")
+    else:
+        store = FrameStore(args.store)
+        index = store.index
+        print(f"{args.store}: {len(store)} frames of {store.width}x{store.height}")
+        if len(index):
+            span = index["timestamp"][-1] - index["timestamp"][0]
+            lost = int(index["frame_num"][-1] - index["frame_num"][0]) + 1 - len(index)
+            print(f"  {span:.2f} s, {(len(index) - 1) / span if span else 0:.1f} fps, "
+                  f"{lost} frames missing, {int(index['parity_errors'].sum())} parity errors")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Out-of-core preprocess_data and interpolate_mocap for multi-hour logs.
+
+The in-memory functions hold every log several times over: the loaded
+frames, the boolean-mask copies of the time window, the np.interp and
+filtfilt outputs.  write_chunked gives the same frames while streaming the
+CSVs in blocks of block_rows rows and writing the results straight to .npy
+files, so its peak memory depends on block_rows, not on the recording:
+
+1. a scan reads only the timestamps (plus the Crazyflie altitude and the
+   TinySense altitude of the first kept rows) to find the time window, the
+   rows every source keeps and the sample that becomes time zero;
+2. each source is streamed again; unit conversions, bias removal, windowing
+   and the time shift are applied per block, and the rows are written into
+   a preallocated memory-mapped .npy file;
+3. the mocap pose is interpolated onto the uniform grid block by block,
+   reading the bracketing raw samples back from disk, and smoothed with the
+   Butterworth filter as second-order sections.  The forward pass carries
+   the filter state from block to block and writes its output to disk; the
+   backward pass reads it back in reverse blocks, again carrying the state.
+   With filtfilt's odd extension at both ends this is the zero-phase filter
+   of the whole log, equal to filtfilt up to rounding rather than an
+   approximation stitched from overlapping blocks;
+4. the velocity is the gradient of the smoothed position, computed per block
+   with one sample of overlap on each side.
+
+The output directory has the layout of a TinySense.cache entry
+({cf,ts,mocap}.npy), which load_experiment(chunked=True) opens as memory-mapped
+FlightLogs.  sync needs the whole log and is not supported.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+from scipy import signal
+from scipy.spatial.transform import Rotation
+
+from TinySense.instrument import instrumented
+from TinySense.loaders import iter_flight_csv
+
+DEFAULT_BLOCK_ROWS = 100_000
+# Odd extension of filtfilt for the order-2 Butterworth filter: 3 * max(len(a), len(b))
+PADLEN = 9
+QUATERNION = ["pose.orientation.x", "pose.orientation.y", "pose.orientation.z", "pose.orientation.w"]
+
+
+def _head(path, source, rows=5):
+    """First rows of a log, read as preprocess_data reads them."""
+    return next(iter_flight_csv(path, source, rows))
+
+
+def _scan_max(path, block_rows, column="pz(m)"):
+    """(timestamp of the first maximum of column, last timestamp) of the Crazyflie log."""
+    best, max_time, last_time = -np.inf, None, None
+    for block in iter_flight_csv(path, "crazyflie", block_rows, columns=[column]):
+        values = block[column].to_numpy()
+        k = np.argmax(values)
+        if values[k] > best:
+            best, max_time = values[k], block["timestamp"].iloc[k]
+        last_time = block["timestamp"].iloc[-1]
+    return max_time, last_time
+
+
+def _scan_window(path, source, block_rows, lower, upper, time_shift, columns=()):
+    """Rows, first kept timestamp, zero time and first five kept rows of columns in (lower, upper]."""
+    scan = {"rows": 0, "total": 0, "first": None, "zero": None, "head": None}
+    best = np.inf
+    for block in iter_flight_csv(path, source, block_rows, columns=list(columns)):
+        scan["total"] += len(block)
+        times = block["timestamp"].to_numpy()
+        kept = block[(times > lower) & (times <= upper)]
+        if not len(kept):
+            continue
+        if scan["first"] is None:
+            scan["first"] = kept["timestamp"].iloc[0]
+            scan["head"] = kept.iloc[:5]
+        elif len(scan["head"]) < 5:
+            scan["head"] = pd.concat([scan["head"], kept.iloc[:5 - len(scan["head"])]])
+        scan["rows"] += len(kept)
+        shifted = kept["timestamp"].to_numpy() - scan["first"]
+        distance = np.abs(shifted - time_shift)
+        k = np.argmin(distance)
+        if distance[k] < best:  # Ties keep the earliest sample, like argmin
+            best, scan["zero"] = distance[k], shifted[k]
+    if scan["first"] is None:
+        raise ValueError(f"{path} has no samples in the time window ({lower}, {upper}]")
+    return scan
+
+
+def _write_source(path, source, block_rows, lower, upper, scan, out_path, convert):
+    """Streams one log through convert into a (rows, columns) .npy file; returns the columns."""
+    values = None
+    row = 0
+    for block in iter_flight_csv(path, source, block_rows):
+        times = block["timestamp"].to_numpy()
+        block = block[(times > lower) & (times <= upper)].copy()
+        if not len(block):
+            continue
+        # Same two subtractions as preprocess_data, so the timestamps are bit-identical
+        block["timestamp"] -= scan["first"]
+        block["timestamp"] -= scan["zero"]
+        block = convert(block)
+        if values is None:
+            values = open_memmap(out_path, mode="w+", dtype="float64", shape=(scan["rows"], block.shape[1]))
+        values[row:row + len(block)] = block.to_numpy(dtype="float64")
+        row += len(block)
+    values.flush()
+    return list(block.columns)
+
+
+def _grid(start, stop, n, i0, i1):
+    """Rows i0:i1 of np.linspace(start, stop, n), bit for bit."""
+    grid = np.arange(i0, i1, dtype="float64") * ((stop - start) / (n - 1)) + start
+    if i1 == n:
+        grid[-1] = stop
+    return grid
+
+
+def _smooth_blocks(values_at, n, block_rows, forward_path, sos):
+    """Yields (i0, i1, smoothed rows) of the zero-phase SOS filter of values_at(i0, i1), last block first.
+
+    values_at returns the (i1 - i0, channels) unfiltered rows.  The forward
+    output is kept in a temporary .npy file at forward_path.
+    """
+    zi = signal.sosfilt_zi(sos)[:, :, None]
+    blocks = [(i0, min(i0 + block_rows, n)) for i0 in range(0, n, block_rows)]
+    forward = None
+    tail = None
+    for i0, i1 in blocks:
+        x = values_at(i0, i1)
+        if forward is None:
+            forward = open_memmap(forward_path, mode="w+", dtype="float64", shape=(n, x.shape[1]))
+            left = 2 * x[0] - x[PADLEN:0:-1]
+            _, state = signal.sosfilt(sos, left, axis=0, zi=zi * left[0])
+        forward[i0:i1], state = signal.sosfilt(sos, x, axis=0, zi=state)
+        tail = x[-(PADLEN + 1):] if tail is None else np.concatenate([tail, x])[-(PADLEN + 1):]
+    right = 2 * tail[-1] - tail[-2::-1]
+    right_forward, _ = signal.sosfilt(sos, right, axis=0, zi=state)
+
+    _, state = signal.sosfilt(sos, right_forward[::-1], axis=0, zi=zi * right_forward[-1])
+    for i0, i1 in reversed(blocks):
+        backward, state = signal.sosfilt(sos, forward[i0:i1][::-1], axis=0, zi=state)
+        yield i0, i1, backward[::-1]
+    del forward
+    os.remove(forward_path)
+
+
+def _interpolate_chunked(raw_path, columns, out_path, block_rows):
+    """interpolate_mocap of the preprocessed mocap .npy at raw_path, written to out_path."""
+    raw = np.load(raw_path, mmap_mode="r")
+    t_raw = raw[:, 0]
+    n = len(raw)
+    if n <= PADLEN:
+        raise ValueError(f"The mocap log needs more than {PADLEN} samples to be smoothed, got {n}")
+    start, stop = t_raw[0], t_raw[-1]
+
+    # Unwrapped pitch of the raw samples, carried across blocks
+    pitch_path = out_path.replace(".npy", "_pitch.tmp.npy")
+    pitch = open_memmap(pitch_path, mode="w+", dtype="float64", shape=(n,))
+    quaternion = [columns.index(c) for c in QUATERNION]
+    previous = None
+    for i0 in range(0, n, block_rows):
+        theta = Rotation.from_quat(raw[i0:i0 + block_rows, quaternion]).as_euler("xyz")[:, 0]
+        theta = np.unwrap(theta) if previous is None else np.unwrap(np.concatenate([[previous], theta]))[1:]
+        previous = theta[-1]
+        pitch[i0:i0 + len(theta)] = theta
+    bias = pitch[0]
+
+    py, pz = columns.index("pose.position.y"), columns.index("pose.position.z")
+
+    def values_at(i0, i1):
+        grid = _grid(start, stop, n, i0, i1)
+        lo = max(np.searchsorted(t_raw, grid[0], side="right") - 1, 0)
+        hi = min(np.searchsorted(t_raw, grid[-1], side="left") + 1, n)
+        times = t_raw[lo:hi]
+        return np.stack([np.interp(grid, times, raw[lo:hi, py]),
+                         np.interp(grid, times, -pitch[lo:hi] + bias),
+                         np.interp(grid, times, raw[lo:hi, pz])], axis=-1)
+
+    # Columns timestamp, vx (smoothed position until the gradient pass), theta, z
+    out = open_memmap(out_path, mode="w+", dtype="float64", shape=(n, 4))
+    sos = signal.butter(2, 0.1, output="sos")  # As in interpolate_mocap
+    for i0, i1, smoothed in _smooth_blocks(values_at, n, block_rows, out_path.replace(".npy", "_forward.tmp.npy"), sos):
+        out[i0:i1, 0] = _grid(start, stop, n, i0, i1)
+        out[i0:i1, 1:] = smoothed
+
+    # Velocity from the smoothed position, with one sample of overlap on each side
+    previous = None
+    for i0 in range(0, n, block_rows):
+        i1 = min(i0 + block_rows, n)
+        lo = i0 - (previous is not None)
+        position = out[i0:min(i1 + 1, n), 1].copy()
+        if previous is not None:
+            position = np.concatenate([[previous], position])
+        previous = position[i1 - 1 - lo]
+        out[i0:i1, 1] = np.gradient(position, out[lo:lo + len(position), 0])[i0 - lo:i1 - lo]
+    out.flush()
+    del pitch, raw, out
+    os.remove(pitch_path)
+    return ["timestamp", "vx(m/s)", "theta", "z(m)"]
+
+
+@instrumented()
+def write_chunked(cf_path, ts_path, mocap_path, experiment_num, output_dir, block_rows=DEFAULT_BLOCK_ROWS,
+                  time_window=7, time_shift=0.5, optic_flow_scale=-1.2, sync=None):
+    """Writes preprocess_data followed by interpolate_mocap to output_dir block by block.
+
+    The parameters are those of preprocess_data.  Returns the columns of the
+    cf, ts and mocap arrays.
+    """
+    if sync is not None:
+        raise ValueError("sync needs the whole log and is not supported in chunked mode")
+    if block_rows <= PADLEN:
+        raise ValueError(f"block_rows must be larger than {PADLEN}")
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Biases from the first rows of the logs, converted as in preprocess_data
+    ts_head, cf_head = _head(ts_path, "tinysense"), _head(cf_path, "crazyflie")
+    z_bias = ts_head["z(m)"].mean()
+    gyro_bias_tiny = (-np.radians(ts_head["gyro(d/s)"])).mean()
+    gyro_bias_crazyflie = np.radians(cf_head["gyro_pitch_filtered(rad/s)"]).mean()
+
+    max_time, upper = _scan_max(cf_path, block_rows)
+    lower = max_time - time_window
+    scans = {"cf": _scan_window(cf_path, "crazyflie", block_rows, lower, upper, time_shift),
+             "ts": _scan_window(ts_path, "tinysense", block_rows, lower, upper, time_shift, ["z(m)"]),
+             "mocap": _scan_window(mocap_path, "mocap", block_rows, lower, upper, time_shift)}
+    print(f'TinySense data length: {scans["ts"]["total"]}')
+    print(f'Crazyflie data length: {scans["cf"]["total"]}')
+
+    # Adjust z bias for experiment 0
+    z_bias_ts = None
+    if experiment_num == 0:
+        z_bias_ts = (scans["ts"]["head"]["z(m)"] - z_bias).mean()
+
+    def convert_ts(block):
+        block["gyro(d/s)"] = -np.radians(block["gyro(d/s)"])
+        block["optic_flow(rad/s)"] *= optic_flow_scale
+        block["z(m)"] = block["z(m)"] - z_bias
+        block["gyro(d/s)"] = block["gyro(d/s)"] - gyro_bias_tiny
+        if z_bias_ts is not None:
+            block.loc[block["timestamp"] > 0, "z(m)"] = block.loc[block["timestamp"] > 0, "z(m)"] - z_bias_ts + 0.2
+        return block
+
+    def convert_cf(block):
+        block["gyro_pitch_filtered(rad/s)"] = np.radians(block["gyro_pitch_filtered(rad/s)"])
+        block["gyro_pitch_filtered(rad/s)"] = block["gyro_pitch_filtered(rad/s)"] - gyro_bias_crazyflie
+        return block
+
+    columns = {}
+    raw_path = os.path.join(output_dir, "mocap_raw.tmp.npy")
+    for name, path, source, convert, out_path in (
+            ("cf", cf_path, "crazyflie", convert_cf, os.path.join(output_dir, "cf.npy")),
+            ("ts", ts_path, "tinysense", convert_ts, os.path.join(output_dir, "ts.npy")),
+            ("mocap", mocap_path, "mocap", lambda block: block, raw_path)):
+        columns[name] = _write_source(path, source, block_rows, lower, upper, scans[name], out_path, convert)
+
+    columns["mocap"] = _interpolate_chunked(raw_path, columns["mocap"], os.path.join(output_dir, "mocap.npy"),
+                                            block_rows)
+    os.remove(raw_path)
+    return columns
@@ -5,112 +5,147 @@ Created on Sun Jun 23 00:29:13 2024
 @author: zhita
 """
 
-import pandas as pd
-from math import radians
 import numpy as np
 from scipy import signal
 from scipy.spatial.transform import Rotation
-import control
-from sklearn.metrics import root_mean_squared_error
+from TinySense.loaders import load_flight_log
+from TinySense.flight_log import FlightLog, as_flight_log
+from TinySense.gain_cache import steady_state_gain
+from TinySense.kalman_scan import fill_duplicate_timestamps, observer_scan
+from TinySense.instrument import instrumented
+from TinySense.sync import SYNC_MODES, apply_sync, estimate_sync
+
+# Kalman filter parameters used for the paper: G = diag(params[:3]),
+# Q = diag(params[3:6] ** 2) and R = diag(params[6:] ** 2)
+DEFAULT_KALMAN_PARAMS = np.array([1.00, 1.00, 1.00, 0.1008/1.06 * np.sqrt(0.017), 0.0093/1.06 * np.sqrt(0.017), 3 * np.sqrt(0.0055), np.sqrt(0.017), np.sqrt(0.0055)])
+MOCAP_QUATERNION = ["pose.orientation.x", "pose.orientation.y", "pose.orientation.z", "pose.orientation.w"]
 
 def find_max_pz_timestamp(df):
-    """Finds the timestamp where pz(m) reaches its maximum."""
-    max_idx = df["pz(m)"].idxmax()
-    max_timestamp = df.loc[max_idx, "timestamp"]
+    """Finds the timestamp where pz(m) reaches its maximum (in a DataFrame or FlightLog)."""
+    max_idx = np.nanargmax(np.asarray(df["pz(m)"]))
+    max_timestamp = np.asarray(df["timestamp"])[max_idx]
     return max_timestamp
 
-def preprocess_data(cf_path, ts_path, mocap_path, experiment_num):
-    """Preprocess data from Crazyflie, TinySense, and Mocap systems."""
+@instrumented()
+def preprocess_data(cf_path, ts_path, mocap_path, experiment_num, verbose=False,
+                    time_window=7, time_shift=0.5, optic_flow_scale=-1.2, sync=None):
+    """Preprocess data from Crazyflie, TinySense, and Mocap systems.
+
+    verbose prints the info of the loaded logs.  The data is cut to time_window seconds before the
+    Crazyflie's maximum pz and aligned to the approximate propeller start
+    time_shift seconds later.  sync="offset" then refines the TinySense and
+    Crazyflie timestamps onto the mocap clock by cross-correlation, and
+    sync="drift" corrects clock drift too (see TinySense.sync).
+
+    Returns FlightLogs (see TinySense.flight_log).  They are windows of the
+    loaded arrays, converted in place, so no stage copies a whole log.
+    """
+    if sync is not None and sync not in SYNC_MODES:
+        raise ValueError(f"Unknown sync mode {sync!r}, expected None or one of {SYNC_MODES}")
     # Load data
-    cf_data = pd.read_csv(cf_path, header=0)
-    ts_data = pd.read_csv(ts_path, header=0)
-    mocap_data = pd.read_csv(mocap_path, header=0)
+    cf_data = load_flight_log(cf_path, "crazyflie")
+    ts_data = load_flight_log(ts_path, "tinysense")
+    mocap_data = load_flight_log(mocap_path, "mocap")
 
     # Print data info
     print(f'TinySense data length: {len(ts_data)}')
-    print(f'TinySense info:\n{ts_data.info()}')
     print(f'Crazyflie data length: {len(cf_data)}')
-    print(f'Crazyflie info:\n{cf_data.info()}')
-
-    # Process mocap data
-    mocap_data.drop("header.frame_id", axis=1, inplace=True)
-    ts_data.rename(columns={ts_data.columns[0]: 'timestamp'}, inplace=True)
-    mocap_data.rename(columns={mocap_data.columns[0]: 'timestamp'}, inplace=True)
-
-    # Convert and scale units
-    ts_data["gyro(d/s)"] = ts_data.apply(lambda row: -radians(row["gyro(d/s)"]), axis=1)
-    cf_data["gyro_pitch_filtered(rad/s)"] = cf_data.apply(lambda row: radians(row["gyro_pitch_filtered(rad/s)"]), axis=1)
-    ts_data["optic_flow(rad/s)"] *= -1.2  # Apply scaling factor
+    if verbose:
+        print('TinySense info:')
+        ts_data.info()
+        print('Crazyflie info:')
+        cf_data.info()
+
+    # Convert and scale units, in place on the column views
+    gyro_tiny, gyro_crazyflie = ts_data["gyro(d/s)"], cf_data["gyro_pitch_filtered(rad/s)"]
+    np.negative(np.radians(gyro_tiny, out=gyro_tiny), out=gyro_tiny)
+    np.radians(gyro_crazyflie, out=gyro_crazyflie)
+    ts_data["optic_flow(rad/s)"] *= optic_flow_scale  # Apply scaling factor
 
     # Subtract z-bias for TinySense
-    z_bias = ts_data["z(m)"].iloc[:5].mean()
-    ts_data["z(m)"] = ts_data["z(m)"] - z_bias
+    z_bias = ts_data["z(m)"][:5].mean()
+    ts_data["z(m)"] -= z_bias
 
     # Subtract gyro bias for TinySense and Crazyflie
-    gyro_bias_tiny = ts_data["gyro(d/s)"].iloc[:5].mean()
-    ts_data["gyro(d/s)"] = ts_data["gyro(d/s)"] - gyro_bias_tiny
-    gyro_bias_crazyflie = cf_data["gyro_pitch_filtered(rad/s)"].iloc[:5].mean()
-    cf_data["gyro_pitch_filtered(rad/s)"] = cf_data["gyro_pitch_filtered(rad/s)"] - gyro_bias_crazyflie
+    gyro_tiny -= gyro_tiny[:5].mean()
+    gyro_crazyflie -= gyro_crazyflie[:5].mean()
 
     # Time filtering based on max pz timestamp
     max_time = find_max_pz_timestamp(cf_data)
-    TIME_LOWER_BOUND = max_time - 7
-    TIME_UPPER_BOUND = cf_data["timestamp"].iloc[-1]
-
-    # Filter data based on time range
-    ts_data = ts_data[(ts_data.timestamp > TIME_LOWER_BOUND) & (ts_data.timestamp <= TIME_UPPER_BOUND)]
-    cf_data = cf_data[(cf_data.timestamp > TIME_LOWER_BOUND) & (cf_data.timestamp <= TIME_UPPER_BOUND)]
-    mocap_data = mocap_data[(mocap_data.timestamp > TIME_LOWER_BOUND) & (mocap_data.timestamp <= TIME_UPPER_BOUND)]
-
-    # Shift the timestamps for all datasets
-    ts_data["timestamp"] -= ts_data["timestamp"].iloc[0]
-    cf_data["timestamp"] -= cf_data["timestamp"].iloc[0]
-    mocap_data["timestamp"] -= mocap_data["timestamp"].iloc[0]
-
-    # Further shift to align with propeller start time (approx. 0.5s)
-    time_shift = 0.5
-    ts_data["timestamp"] -= ts_data["timestamp"].iloc[(ts_data["timestamp"] - time_shift).abs().argmin()]
-    cf_data["timestamp"] -= cf_data["timestamp"].iloc[(cf_data["timestamp"] - time_shift).abs().argmin()]
-    mocap_data["timestamp"] -= mocap_data["timestamp"].iloc[(mocap_data["timestamp"] - time_shift).abs().argmin()]
+    TIME_LOWER_BOUND = max_time - time_window
+    TIME_UPPER_BOUND = cf_data["timestamp"][-1]
+
+    # Filter data based on time range: views of the sorted logs, found by binary search
+    ts_data = ts_data.window(TIME_LOWER_BOUND, TIME_UPPER_BOUND)
+    cf_data = cf_data.window(TIME_LOWER_BOUND, TIME_UPPER_BOUND)
+    mocap_data = mocap_data.window(TIME_LOWER_BOUND, TIME_UPPER_BOUND)
+
+    for data in (ts_data, cf_data, mocap_data):
+        times = data["timestamp"]
+        # Shift the timestamps for all datasets
+        times -= times[0]
+        # Further shift to align with propeller start time (approx. 0.5s)
+        times -= times[np.abs(times - time_shift).argmin()]
+
+    # Remove the residual offsets (and drift) to the mocap clock
+    if sync is not None:
+        offset, drift, peak = estimate_sync(ts_data, "ts", mocap_data, drift=sync == "drift")
+        ts_data = apply_sync(ts_data, offset, drift)
+        print(f'TinySense sync: offset {offset * 1e3:.1f} ms, drift {drift * 1e6:.0f} ppm, correlation {peak:.2f}')
+        offset, drift, peak = estimate_sync(cf_data, "cf", mocap_data, drift=sync == "drift")
+        cf_data = apply_sync(cf_data, offset, drift)
+        print(f'Crazyflie sync: offset {offset * 1e3:.1f} ms, drift {drift * 1e6:.0f} ppm, correlation {peak:.2f}')
 
     # Adjust z bias for experiment 0
     if experiment_num == 0:
-        z_bias_ts = ts_data["z(m)"].iloc[:5].mean()
-        ts_data.loc[ts_data["timestamp"] > 0, "z(m)"] = ts_data.loc[ts_data["timestamp"] > 0, "z(m)"] - z_bias_ts + 0.2
+        z_bias_ts = ts_data["z(m)"][:5].mean()
+        flying = ts_data["timestamp"] > 0
+        ts_data["z(m)"][flying] = ts_data["z(m)"][flying] - z_bias_ts + 0.2
 
     return cf_data, ts_data, mocap_data
 
+@instrumented()
 def interpolate_mocap(mocap_data):
-    """Interpolates mocap data to obtain velocity, angle, and altitude."""
-    mocap_interp_time = np.linspace(mocap_data.iloc[0]["timestamp"], mocap_data.iloc[-1]["timestamp"], len(mocap_data))
-    mocap_interp_px = np.interp(mocap_interp_time, mocap_data["timestamp"], mocap_data["pose.position.y"])
+    """Interpolates mocap data to obtain velocity, angle, and altitude.
+
+    Takes a preprocessed mocap FlightLog (or DataFrame) and returns a
+    FlightLog of timestamp, vx(m/s), theta and z(m), filled column by column.
+    """
+    # Calculate pitch angle (theta) first: the quaternions are the largest temporaries
+    quats = np.asarray(mocap_data[MOCAP_QUATERNION], dtype="float64")
+    mocap_theta = np.unwrap(Rotation.from_quat(quats).as_euler("xyz")[:, 0])  # Unwrap so long flights do not jump by 2*pi
+    del quats
+
+    interp = FlightLog.empty(len(mocap_data), ["timestamp", "vx(m/s)", "theta", "z(m)"])
+    mocap_times = np.asarray(mocap_data["timestamp"], dtype="float64")
+    mocap_interp_time = interp["timestamp"]
+    mocap_interp_time[:] = np.linspace(mocap_times[0], mocap_times[-1], len(mocap_data))
+    mocap_interp_px = np.interp(mocap_interp_time, mocap_times, mocap_data["pose.position.y"])
 
     # Apply a low-pass filter to the interpolated position data
     b, a = signal.butter(2, 0.1)
     mocap_interp_px = signal.filtfilt(b, a, mocap_interp_px)
 
     # Calculate velocity (vx)
-    mocap_interp_vx = np.gradient(mocap_interp_px, mocap_interp_time)
+    interp["vx(m/s)"] = np.gradient(mocap_interp_px, mocap_interp_time)
+    del mocap_interp_px
 
-    # Calculate pitch angle (theta)
-    quats = [Rotation.from_quat([row["pose.orientation.x"], row["pose.orientation.y"], row["pose.orientation.z"], row["pose.orientation.w"]]) for _, row in mocap_data.iterrows()]
-    bias = quats[0].as_euler("xyz")[0]
-    mocap_interp_theta = np.interp(mocap_interp_time, mocap_data["timestamp"], [-q.as_euler("xyz")[0] + bias for q in quats])
-    mocap_interp_theta = signal.filtfilt(b, a, mocap_interp_theta)
+    bias = mocap_theta[0]
+    mocap_interp_theta = np.interp(mocap_interp_time, mocap_times, -mocap_theta + bias)
+    interp["theta"] = signal.filtfilt(b, a, mocap_interp_theta)
 
     # Interpolate altitude (z)
-    mocap_interp_z = np.interp(mocap_interp_time, mocap_data["timestamp"], mocap_data["pose.position.z"])
-    mocap_interp_z = signal.filtfilt(b, a, mocap_interp_z)
+    mocap_interp_z = np.interp(mocap_interp_time, mocap_times, mocap_data["pose.position.z"])
+    interp["z(m)"] = signal.filtfilt(b, a, mocap_interp_z)
 
-    return pd.DataFrame({"timestamp": mocap_interp_time, "vx(m/s)": mocap_interp_vx, "theta": mocap_interp_theta, "z(m)": mocap_interp_z})
+    return interp
 
 
-def kalman_filter_from_1cm_optic(cf_data_df, ts_data_df, mocap_data_df):
-    """Performs Kalman filtering with z set to 0.01m and optic flow to 0 before 1.8 seconds."""
-    b = 13.2e-3
-    m = 0.3
-    zd = 1  # Desired altitude
+def state_space_model(b=13.2e-3, m=0.3, zd=1):
+    """Returns the A, B, C, D matrices of the pitch/velocity/altitude observer model.
 
+    b is the drag coefficient, m the mass and zd the desired altitude.
+    """
     A = np.array([[0, 0, 0],
                   [-9.81, -b/m, 0],
                   [0, 0, 0]])
@@ -120,6 +155,29 @@ def kalman_filter_from_1cm_optic(cf_data_df, ts_data_df, mocap_data_df):
                   [0, 0, 1]])
     D = np.array([[1, 0]]).T
 
+    return A, B, C, D
+
+
+def params_to_weights(params):
+    """Converts (..., 8) params vectors into stacked G, Q and R matrices."""
+    params = np.asarray(params, dtype="float64")
+    G = params[..., None, :3] * np.eye(3)
+    Q = params[..., None, 3:6] ** 2 * np.eye(3)
+    R = params[..., None, 6:] ** 2 * np.eye(2)
+    return G, Q, R
+
+
+@instrumented()
+def kalman_filter_from_1cm_optic(cf_data_df, ts_data_df, mocap_data_df, engine="loop", params=DEFAULT_KALMAN_PARAMS):
+    """Performs Kalman filtering with z set to 0.01m and optic flow to 0 before 1.8 seconds.
+
+    The logs are FlightLogs or DataFrames; they are left unchanged and the
+    filter works on its own copy of the TinySense log.  engine selects the
+    sequential "loop" or the parallel-in-time "scan" observer; params is the
+    8-entry G/Q/R vector (see DEFAULT_KALMAN_PARAMS).
+    """
+    A, B, C, D = state_space_model()
+
     # Parameters for Kalman filter
     # params = np.array([0.72, 0.10, 20.00, 0.14, 0.093, 0.08, 1.06, 0.20])
     # params = np.array([1.00, 1.00, 1.00, 0.1008, 0.0093, 1.60, 1.06, 0.20])
@@ -155,27 +213,27 @@ def kalman_filter_from_1cm_optic(cf_data_df, ts_data_df, mocap_data_df):
     
     
     
-    params = np.array([1.00, 1.00, 1.00, 0.1008/1.06 * np.sqrt(0.017), 0.0093/1.06 * np.sqrt(0.017), 3 * np.sqrt(0.0055), np.sqrt(0.017), np.sqrt(0.0055)])
-    
     G = np.diag(params[:3])
     Q = np.diag(params[3:6] ** 2)
     R = np.diag(params[6:] ** 2)
 
-    L, _, _ = control.lqe(A, G, C, Q, R)
+    L, _, _ = steady_state_gain(A, G, C, Q, R)
 
     # # Ignore pressure sensor and optic flow data before 1.8s, we have determined that no need to do optic flow ignorance. 
     # ts_data_df.loc[ts_data_df["timestamp"] < 1.8, ["z(m)", "optic_flow(rad/s)"]] = [0.01, 0]
     
-    # Ignore pressure sensor before 1.8s
-    ts_data_df.loc[ts_data_df["timestamp"] < 1.8, ["z(m)"]] = [0.01]
+    ts_log = as_flight_log(ts_data_df).copy()
+    ts_data = ts_log.data
+    cf_data = as_flight_log(cf_data_df).to_numpy(dtype="float64")
+    mocap_data = as_flight_log(mocap_data_df).to_numpy(dtype="float64")
 
-    ts_data = ts_data_df.to_numpy(dtype="float64", copy=True)
-    cf_data = cf_data_df.to_numpy(dtype="float64")
-    mocap_data = mocap_data_df.to_numpy(dtype="float64")
+    # Ignore pressure sensor before 1.8s
+    ts_log["z(m)"][ts_log["timestamp"] < 1.8] = 0.01
 
     # Find indices for zero-time points
-    zero_idx_cf = np.where(cf_data[:, 0] == 0)[0][0]
-    zero_idx_ts = np.where(ts_data[:, 0] == 0)[0][0]
+    # First samples at or after time zero (exactly zero unless preprocess_data synced the clocks)
+    zero_idx_cf = np.searchsorted(cf_data[:, 0], 0)
+    zero_idx_ts = np.searchsorted(ts_data[:, 0], 0)
     zero_idx_mocap = np.argmin(np.abs(mocap_data[:, 0]))
 
     q_est = np.zeros([ts_data.shape[0], 3])
@@ -183,17 +241,23 @@ def kalman_filter_from_1cm_optic(cf_data_df, ts_data_df, mocap_data_df):
     
     q_est[zero_idx_ts] = [-cf_data[zero_idx_cf, 6], -cf_data[zero_idx_cf, 5], cf_data[zero_idx_cf, 3]]
 
-    for i in range(zero_idx_ts + 1, ts_data.shape[0]):
-        y = ts_data[i - 1, [1, 3]].reshape([2, 1])
-        u = ts_data[i - 1, 2].reshape([1, 1])
-
-        if ts_data[i, 0] == ts_data[i - 1, 0]:
-            ts_data[i, 0] = (ts_data[i - 1, 0] + ts_data[i + 1, 0]) / 2
-
-        dt = ts_data[i, 0] - ts_data[i - 1, 0]
-        qhat = q_est[i - 1, :].reshape([3, 1])
-        qdot = A @ qhat + B @ u + L @ (y - C @ qhat - D @ u)
-        q_est[i, :] = (qhat + dt * qdot).reshape([3,])
+    if engine == "scan":
+        fill_duplicate_timestamps(ts_data[:, 0], zero_idx_ts)
+        q_est[zero_idx_ts:] = observer_scan(ts_data[zero_idx_ts:], q_est[zero_idx_ts], A, B, C, D, L)
+    elif engine == "loop":
+        for i in range(zero_idx_ts + 1, ts_data.shape[0]):
+            y = ts_data[i - 1, [1, 3]].reshape([2, 1])
+            u = ts_data[i - 1, 2].reshape([1, 1])
+
+            if ts_data[i, 0] == ts_data[i - 1, 0]:
+                ts_data[i, 0] = (ts_data[i - 1, 0] + ts_data[i + 1, 0]) / 2
+
+            dt = ts_data[i, 0] - ts_data[i - 1, 0]
+            qhat = q_est[i - 1, :].reshape([3, 1])
+            qdot = A @ qhat + B @ u + L @ (y - C @ qhat - D @ u)
+            q_est[i, :] = (qhat + dt * qdot).reshape([3,])
+    else:
+        raise ValueError(f"Unknown observer engine: {engine}")
 
     # Concatenate the time column with the estimated states
     ts_first_column = ts_data[:, 0].reshape(-1, 1)
@@ -5,125 +5,26 @@ Created on Sun Jun 23 00:29:13 2024
 @author: zhita
 """
 
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-from math import radians
 import numpy as np
-from scipy import signal
-from scipy.spatial.transform import Rotation
-import control
-from sklearn.metrics import root_mean_squared_error
-
-def find_max_pz_timestamp(df):
-    
-    max_idx = df["pz(m)"].idxmax()
-    max_timestamp = df.loc[max_idx, "timestamp"]
-    
-    return max_timestamp
-
-def preprocess_data(cf_path, ts_path, mocap_path, experiment_num):
-    
-    """Preprocess data from Crazyflie, TinySense, and Mocap systems."""
-    # Load data
-    cf_data = pd.read_csv(cf_path, header=0)
-    ts_data = pd.read_csv(ts_path, header=0)
-    mocap_data = pd.read_csv(mocap_path, header=0)
-
-    # Print data info
-    print(f'TinySense data length: {len(ts_data)}')
-    print(f'TinySense info:\n{ts_data.info()}')
-    print(f'Crazyflie data length: {len(cf_data)}')
-    print(f'Crazyflie info:\n{cf_data.info()}')
-
-    # Process mocap data
-    mocap_data.drop("header.frame_id", axis=1, inplace=True)
-    ts_data.rename(columns={ts_data.columns[0]: 'timestamp'}, inplace=True)
-    mocap_data.rename(columns={mocap_data.columns[0]: 'timestamp'}, inplace=True)
-
-    # Convert and scale units
-    ts_data["gyro(d/s)"] = ts_data.apply(lambda row: -radians(row["gyro(d/s)"]), axis=1)
-    cf_data["gyro_pitch_filtered(rad/s)"] = cf_data.apply(lambda row: radians(row["gyro_pitch_filtered(rad/s)"]), axis=1)
-    ts_data["optic_flow(rad/s)"] *= -1.2  # Apply scaling factor
-
-    # Subtract z-bias for TinySense
-    z_bias = ts_data["z(m)"].iloc[:5].mean()
-    ts_data["z(m)"] = ts_data["z(m)"] - z_bias
-
-    # Subtract gyro bias for TinySense and Crazyflie
-    gyro_bias_tiny = ts_data["gyro(d/s)"].iloc[:5].mean()
-    ts_data["gyro(d/s)"] = ts_data["gyro(d/s)"] - gyro_bias_tiny
-    gyro_bias_crazyflie = cf_data["gyro_pitch_filtered(rad/s)"].iloc[:5].mean()
-    cf_data["gyro_pitch_filtered(rad/s)"] = cf_data["gyro_pitch_filtered(rad/s)"] - gyro_bias_crazyflie
-
-    # Time filtering based on max pz timestamp
-    max_time = find_max_pz_timestamp(cf_data)
-    TIME_LOWER_BOUND = max_time - 7
-    TIME_UPPER_BOUND = cf_data["timestamp"].iloc[-1]
-
-    # Filter data based on time range
-    ts_data = ts_data[(ts_data.timestamp > TIME_LOWER_BOUND) & (ts_data.timestamp <= TIME_UPPER_BOUND)]
-    cf_data = cf_data[(cf_data.timestamp > TIME_LOWER_BOUND) & (cf_data.timestamp <= TIME_UPPER_BOUND)]
-    mocap_data = mocap_data[(mocap_data.timestamp > TIME_LOWER_BOUND) & (mocap_data.timestamp <= TIME_UPPER_BOUND)]
-
-    # Shift the timestamps for all datasets
-    ts_data["timestamp"] -= ts_data["timestamp"].iloc[0]
-    cf_data["timestamp"] -= cf_data["timestamp"].iloc[0]
-    mocap_data["timestamp"] -= mocap_data["timestamp"].iloc[0]
-
-    # Further shift to align with propeller start time (approx. 0.5s)
-    time_shift = 0.5
-    ts_data["timestamp"] -= ts_data["timestamp"].iloc[(ts_data["timestamp"] - time_shift).abs().argmin()]
-    cf_data["timestamp"] -= cf_data["timestamp"].iloc[(cf_data["timestamp"] - time_shift).abs().argmin()]
-    mocap_data["timestamp"] -= mocap_data["timestamp"].iloc[(mocap_data["timestamp"] - time_shift).abs().argmin()]
-
-    # Adjust z bias for experiment 0
-    if experiment_num == 0:
-        z_bias_ts = ts_data["z(m)"].iloc[:5].mean()
-        ts_data.loc[ts_data["timestamp"] > 0, "z(m)"] = ts_data.loc[ts_data["timestamp"] > 0, "z(m)"] - z_bias_ts + 0.2
-
-    return cf_data, ts_data, mocap_data
-
-
-def interpolate_mocap(mocap_data):
-    """Interpolates mocap data to obtain velocity, angle, and altitude."""
-    mocap_interp_time = np.linspace(mocap_data.iloc[0]["timestamp"], mocap_data.iloc[-1]["timestamp"], len(mocap_data))
-    mocap_interp_px = np.interp(mocap_interp_time, mocap_data["timestamp"], mocap_data["pose.position.y"])
-
-    # Apply a low-pass filter to the interpolated position data
-    b, a = signal.butter(2, 0.1)
-    mocap_interp_px = signal.filtfilt(b, a, mocap_interp_px)
-
-    # Calculate velocity (vx)
-    mocap_interp_vx = np.gradient(mocap_interp_px, mocap_interp_time)
-
-    # Calculate pitch angle (theta)
-    quats = [Rotation.from_quat([row["pose.orientation.x"], row["pose.orientation.y"], row["pose.orientation.z"], row["pose.orientation.w"]]) for _, row in mocap_data.iterrows()]
-    bias = quats[0].as_euler("xyz")[0]
-    mocap_interp_theta = np.interp(mocap_interp_time, mocap_data["timestamp"], [-q.as_euler("xyz")[0] + bias for q in quats])
-    mocap_interp_theta = signal.filtfilt(b, a, mocap_interp_theta)
-
-    # Interpolate altitude (z)
-    mocap_interp_z = np.interp(mocap_interp_time, mocap_data["timestamp"], mocap_data["pose.position.z"])
-    mocap_interp_z = signal.filtfilt(b, a, mocap_interp_z)
-
-    return pd.DataFrame({"timestamp": mocap_interp_time, "vx(m/s)": mocap_interp_vx, "theta": mocap_interp_theta, "z(m)": mocap_interp_z})
-
-
-
-
-def kalman_filter_optimal_pure_tinysense(cf_data_df, ts_data_df, mocap_data_df, G, Q, R):
-    """Performs Kalman filtering with z set to 0.01m and optic flow to 0 before 1.8 seconds."""
-    b = 13.2e-3
-    m = 0.3
-    zd = 1  # Desired altitude
-
-    A = np.array([[0, 0, 0],
-                  [-9.81, -b/m, 0],
-                  [0, 0, 0]])
-
-    B = np.array([[1, 0, 0]]).T
-    C = np.array([[0, -1/zd, 0],
-                  [0, 0, 1]])
-    D = np.array([[1, 0]]).T
+from scipy import linalg, optimize
+from TinySense.alignment import align, align_indices
+# preprocess_data and interpolate_mocap are re-exported for scripts that imported the copies once kept here
+from TinySense.data_processing import (DEFAULT_KALMAN_PARAMS, interpolate_mocap, params_to_weights, preprocess_data,
+                                       state_space_model)
+from TinySense.flight_log import as_flight_log
+from TinySense.gain_cache import steady_state_gain
+from TinySense.metrics import pair_rms
+from TinySense.kalman_scan import affine_prefix_scan, fill_duplicate_timestamps, observer_scan, observer_transitions
+
+def kalman_filter_optimal_pure_tinysense(cf_data_df, ts_data_df, mocap_data_df, G, Q, R, engine="loop"):
+    """Performs Kalman filtering with z set to 0.01m and optic flow to 0 before 1.8 seconds.
+
+    The logs are FlightLogs or DataFrames and are left unchanged.  engine
+    selects the sequential "loop" or the parallel-in-time "scan" observer.
+    """
+    A, B, C, D = state_space_model()
 
  #    # Parameters for Kalman filter
  #    # params = np.array([0.72, 0.10, 20.00, 0.14, 0.093, 0.08, 1.06, 0.20])
@@ -140,34 +41,44 @@ def kalman_filter_optimal_pure_tinysense(cf_data_df, ts_data_df, mocap_data_df,
  #    Q = np.diag(params[3:6] ** 2)
  #    R = np.diag(params[6:] ** 2)
 
-    L, _, _ = control.lqe(A, G, C, Q, R)
+    L, _, _ = steady_state_gain(A, G, C, Q, R)
 
-    # Ignore pressure sensor and optic flow data before 1.8s
-    ts_data_df.loc[ts_data_df["timestamp"] < 1.8, ["z(m)", "optic_flow(rad/s)"]] = [0.01, 0]
+    ts_log = as_flight_log(ts_data_df).copy()
+    ts_data = ts_log.data
+    cf_data = as_flight_log(cf_data_df).to_numpy(dtype="float64")
+    mocap_data = as_flight_log(mocap_data_df).to_numpy(dtype="float64")
 
-    ts_data = ts_data_df.to_numpy(dtype="float64", copy=True)
-    cf_data = cf_data_df.to_numpy(dtype="float64")
-    mocap_data = mocap_data_df.to_numpy(dtype="float64")
+    # Ignore pressure sensor and optic flow data before 1.8s
+    early = ts_log["timestamp"] < 1.8
+    ts_log["z(m)"][early] = 0.01
+    ts_log["optic_flow(rad/s)"][early] = 0
 
     # Find indices for zero-time points
-    zero_idx_cf = np.where(cf_data[:, 0] == 0)[0][0]
-    zero_idx_ts = np.where(ts_data[:, 0] == 0)[0][0]
+    # First samples at or after time zero (exactly zero unless preprocess_data synced the clocks)
+    zero_idx_cf = np.searchsorted(cf_data[:, 0], 0)
+    zero_idx_ts = np.searchsorted(ts_data[:, 0], 0)
     zero_idx_mocap = np.argmin(np.abs(mocap_data[:, 0]))
 
     q_est = np.zeros([ts_data.shape[0], 3])
     q_est[zero_idx_ts] = [-cf_data[zero_idx_cf, 6], -cf_data[zero_idx_cf, 5], 0.08]
 
-    for i in range(zero_idx_ts + 1, ts_data.shape[0]):
-        y = ts_data[i - 1, [1, 3]].reshape([2, 1])
-        u = ts_data[i - 1, 2].reshape([1, 1])
+    if engine == "scan":
+        fill_duplicate_timestamps(ts_data[:, 0], zero_idx_ts)
+        q_est[zero_idx_ts:] = observer_scan(ts_data[zero_idx_ts:], q_est[zero_idx_ts], A, B, C, D, L)
+    elif engine == "loop":
+        for i in range(zero_idx_ts + 1, ts_data.shape[0]):
+            y = ts_data[i - 1, [1, 3]].reshape([2, 1])
+            u = ts_data[i - 1, 2].reshape([1, 1])
 
-        if ts_data[i, 0] == ts_data[i - 1, 0]:
-            ts_data[i, 0] = (ts_data[i - 1, 0] + ts_data[i + 1, 0]) / 2
+            if ts_data[i, 0] == ts_data[i - 1, 0]:
+                ts_data[i, 0] = (ts_data[i - 1, 0] + ts_data[i + 1, 0]) / 2
 
-        dt = ts_data[i, 0] - ts_data[i - 1, 0]
-        qhat = q_est[i - 1, :].reshape([3, 1])
-        qdot = A @ qhat + B @ u + L @ (y - C @ qhat - D @ u)
-        q_est[i, :] = (qhat + dt * qdot).reshape([3,])
+            dt = ts_data[i, 0] - ts_data[i - 1, 0]
+            qhat = q_est[i - 1, :].reshape([3, 1])
+            qdot = A @ qhat + B @ u + L @ (y - C @ qhat - D @ u)
+            q_est[i, :] = (qhat + dt * qdot).reshape([3,])
+    else:
+        raise ValueError(f"Unknown observer engine: {engine}")
 
     # Concatenate the time column with the estimated states
     ts_first_column = ts_data[:, 0].reshape(-1, 1)
@@ -180,6 +91,229 @@ def kalman_filter_optimal_pure_tinysense(cf_data_df, ts_data_df, mocap_data_df,
 
 
 
+# Names of the 8 entries of a params vector: G = diag(params[:3]),
+# Q = diag(params[3:6] ** 2) and R = diag(params[6:] ** 2)
+PARAM_NAMES = ["G_theta", "G_vx", "G_z", "Q_theta", "Q_vx", "Q_z", "R_optic_flow", "R_z"]
+SWEEP_METRICS = ["ts_mocap_vx_RMS", "ts_mocap_theta_RMS", "ts_mocap_altitude_RMS",
+                 "ts_cf_vx_RMS", "ts_cf_theta_RMS", "ts_cf_altitude_RMS"]
+SWEEP_PAIRS = (("ts", "mocap"), ("ts", "cf"))
+
+# Experiments shared with the sweep worker processes
+_worker_experiments = None
+
+
+def prepare_sweep_data(cf_data_df, ts_data_df, mocap_data_df):
+    """Converts one preprocessed experiment into the arrays shared by every sweep candidate.
+
+    Applies the same masking and initial state as kalman_filter_optimal_pure_tinysense
+    and precomputes the samples compared at every Crazyflie timestamp.  The
+    logs are FlightLogs or DataFrames and are left unchanged.
+    """
+    ts_log = as_flight_log(ts_data_df).copy()
+    ts_data = ts_log.data
+    cf_data = as_flight_log(cf_data_df).to_numpy(dtype="float64")
+    mocap_data = as_flight_log(mocap_data_df).to_numpy(dtype="float64")
+
+    # Ignore pressure sensor and optic flow data before 1.8s
+    early = ts_log["timestamp"] < 1.8
+    ts_log["z(m)"][early] = 0.01
+    ts_log["optic_flow(rad/s)"][early] = 0
+
+    # First samples at or after time zero (exactly zero unless preprocess_data synced the clocks)
+    zero_idx_cf = np.searchsorted(cf_data[:, 0], 0)
+    zero_idx_ts = np.searchsorted(ts_data[:, 0], 0)
+    zero_idx_mocap = np.argmin(np.abs(mocap_data[:, 0]))
+
+    ts_data = ts_data[zero_idx_ts:]
+    cf_data = cf_data[zero_idx_cf:]
+    mocap_data = mocap_data[zero_idx_mocap:]
+    fill_duplicate_timestamps(ts_data[:, 0])
+
+    return {
+        "ts_data": ts_data,
+        "q0": np.array([-cf_data[0, 6], -cf_data[0, 5], 0.08]),
+        "cf_data": cf_data,
+        "mocap_data": align(mocap_data[:, 0], mocap_data, cf_data[:, 0], mode="nearest"),
+        "qest_idx": align_indices(ts_data[:, 0], cf_data[:, 0], mode="nearest")[0],
+    }
+
+
+def sweep_metrics(data, q_est):
+    """RMS errors of (..., N, 3) estimates against mocap and Crazyflie, as in main.py."""
+    # ts_cf_theta_RMS in radians, as in runner.RMS_UNITS
+    rms = pair_rms(data["cf_data"], data["mocap_data"], q_est[..., data["qest_idx"], :], SWEEP_PAIRS,
+                   radian_theta=(("ts", "cf"),))
+    return rms.reshape(rms.shape[:-2] + (-1,))
+
+
+def _init_sweep_worker(experiments):
+    global _worker_experiments
+    _worker_experiments = experiments
+
+
+def _sweep_chunk(params, experiments=None):
+    """Computes gains, runs the batched observers and scores one block of candidates."""
+    if experiments is None:
+        experiments = _worker_experiments
+    A, B, C, D = state_space_model()
+    G, Q, R = params_to_weights(params)
+
+    L = np.full((len(params), 3, 2), np.nan)
+    for k in range(len(params)):
+        try:
+            L[k] = steady_state_gain(A, G[k], C, Q[k], R[k])[0]
+        except (ValueError, np.linalg.LinAlgError):
+            pass  # Candidates without a stabilizing gain score NaN
+
+    metrics = np.zeros((len(params), len(SWEEP_METRICS)))
+    for data in experiments:
+        q_est = observer_scan(data["ts_data"], data["q0"], A, B, C, D, L)
+        metrics += sweep_metrics(data, q_est)
+    return metrics / len(experiments)
+
+
+def sweep_kalman_params(experiments, params, batch_size=128, n_workers=1):
+    """Evaluates every row of an (N_params x 8) params array on prepared experiments.
+
+    experiments is one prepare_sweep_data result or a list of them; the metrics
+    are averaged over experiments.  Candidates run batch_size at a time as
+    stacked observers, sharded across n_workers processes when n_workers > 1.
+    Returns a DataFrame with one row per candidate: its params and RMS metrics.
+    """
+    if isinstance(experiments, dict):
+        experiments = [experiments]
+    params = np.atleast_2d(np.asarray(params, dtype="float64"))
+    chunks = [params[i:i + batch_size] for i in range(0, len(params), batch_size)]
+
+    if n_workers > 1:
+        with ProcessPoolExecutor(n_workers, initializer=_init_sweep_worker, initargs=(experiments,)) as pool:
+            results = list(pool.map(_sweep_chunk, chunks))
+    else:
+        results = [_sweep_chunk(chunk, experiments) for chunk in chunks]
+
+    table = pd.DataFrame(params, columns=PARAM_NAMES)
+    table[SWEEP_METRICS] = np.concatenate(results) if results else np.empty((0, len(SWEEP_METRICS)))
+    return table
+
+
+# Metrics minimized by tune_kalman_params: TinySense against mocap
+TUNING_METRICS = SWEEP_METRICS[:3]
+
+
+def lqe_sensitivity(params, A, C):
+    """Observer gain L of an 8-entry params vector and its derivatives dL/dparams.
+
+    Differentiates the filter Riccati equation
+    A P + P A' - P C' R^-1 C P + G Q G' = 0: every dP solves the Lyapunov
+    equation (A - L C) dP + dP (A - L C)' = -(dW + L dR L') and
+    dL = dP C' R^-1 - L dR R^-1.  Returns L (3, 2) and dL (8, 3, 2).
+    """
+    params = np.asarray(params, dtype="float64")
+    G, Q, R = params_to_weights(params)
+    L, P, _ = steady_state_gain(A, G, C, Q, R)
+    L = np.asarray(L)
+    P = np.asarray(P)
+    R_inv = np.linalg.inv(R)
+    A_cl = A - L @ C
+
+    g, q, r = params[:3], params[3:6], params[6:]
+    dW = np.zeros((8, 3, 3))
+    dR = np.zeros((8, 2, 2))
+    for i in range(3):
+        dW[i, i, i] = 2 * g[i] * q[i] ** 2
+        dW[3 + i, i, i] = 2 * g[i] ** 2 * q[i]
+    for j in range(2):
+        dR[6 + j, j, j] = 2 * r[j]
+
+    dL = np.empty((8, 3, 2))
+    for k in range(8):
+        dP = linalg.solve_continuous_lyapunov(A_cl, -(dW[k] + L @ dR[k] @ L.T))
+        dL[k] = dP @ C.T @ R_inv - L @ dR[k] @ R_inv
+    return L, dL
+
+
+def observer_sensitivity(data, A, B, C, D, L, dL):
+    """Estimates (N, 3) of one prepared experiment and their derivatives (K, N, 3) along K gain directions dL.
+
+    The sensitivities follow the observer's own affine recursion,
+    S[i] = (I + dt (A - L C)) S[i-1] + dt dL (y - D u - C qhat[i-1]), and are
+    computed with the same associative scan.
+    """
+    ts_data = data["ts_data"]
+    t, y, u = ts_data[:, 0], ts_data[:, [1, 3]], ts_data[:, [2]]
+    M, c = observer_transitions(A, B, C, D, L, t, y, u)
+    P, s = affine_prefix_scan(M, c)
+    q_est = np.concatenate([data["q0"][None], (P @ data["q0"][:, None])[..., 0] + s])
+
+    innovation = y[:-1] - q_est[:-1] @ C.T - u[:-1] @ D.T
+    dt = np.diff(t)[:, None]
+    dc = dt * (innovation @ np.swapaxes(dL, -1, -2))  # (K, N-1, 3)
+    _, ds = affine_prefix_scan(np.broadcast_to(M, dc.shape[:-1] + M.shape[-2:]), dc)
+    dq = np.concatenate([np.zeros(dc.shape[:-2] + (1, 3)), ds], axis=-2)
+    return q_est, dq
+
+
+def tuning_loss(params, experiments, weights=(1.0, 1.0, 1.0)):
+    """Weighted sum of the TUNING_METRICS averaged over experiments, and its gradient (8,).
+
+    experiments are prepare_sweep_data results; the metrics are those of
+    sweep_metrics (theta in degrees).
+    """
+    A, B, C, D = state_space_model()
+    L, dL = lqe_sensitivity(params, A, C)
+
+    loss = 0.0
+    gradient = np.zeros(8)
+    for data in experiments:
+        q_est, dq = observer_sensitivity(data, A, B, C, D, L, dL)
+        idx = data["qest_idx"]
+        q, dq = q_est[idx], dq[:, idx]
+        mocap_data = data["mocap_data"]
+        # (error, d error / d q) of vx, theta and z as in sweep_metrics
+        terms = [(mocap_data[:, 1] - q[:, 1], -dq[..., 1]),
+                 (np.degrees(mocap_data[:, 2]) + np.degrees(q[:, 0]), np.degrees(dq[..., 0])),
+                 (mocap_data[:, 3] - q[:, 2], -dq[..., 2])]
+        for weight, (error, d_error) in zip(weights, terms):
+            rms = np.sqrt(np.mean(error ** 2))
+            loss += weight * rms
+            gradient += weight * (d_error @ error) / (len(error) * rms)
+    return loss / len(experiments), gradient / len(experiments)
+
+
+def tune_kalman_params(experiments, params0=None, free=PARAM_NAMES[3:], weights=(1.0, 1.0, 1.0), max_iter=100,
+                       verbose=False):
+    """Minimizes tuning_loss over the free params with L-BFGS-B and analytic gradients.
+
+    experiments is one prepare_sweep_data result or a list of them, tuned
+    jointly.  The search runs on log(params) so every candidate stays
+    positive.  By default G is held fixed, since the gain only depends on the
+    products G_i * Q_i.  Returns (params, result) where result is the
+    scipy OptimizeResult with the evaluation count in nfev and the loss of
+    every evaluation in result.history.
+    """
+    if isinstance(experiments, dict):
+        experiments = [experiments]
+    params0 = np.array(DEFAULT_KALMAN_PARAMS if params0 is None else params0, dtype="float64")
+    free_idx = np.array([PARAM_NAMES.index(name) for name in free])
+    history = []
+
+    def objective(log_free):
+        params = params0.copy()
+        params[free_idx] = np.exp(log_free)
+        loss, gradient = tuning_loss(params, experiments, weights)
+        history.append(loss)
+        if verbose:
+            print(f"evaluation {len(history)}: loss {loss:.6f}")
+        return loss, gradient[free_idx] * params[free_idx]
+
+    result = optimize.minimize(objective, np.log(params0[free_idx]), jac=True, method="L-BFGS-B",
+                               options={"maxiter": max_iter})
+    params = params0.copy()
+    params[free_idx] = np.exp(result.x)
+    result.history = history
+    return params, result
+
+
 
 
 # def kalman_filter_optimal_crazyflie(cf_data_df, ts_data_df, G, Q, R):
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental rendering of the paper's 3 x N figures, one column at a time.
+
+render_grid draws each column of a figure (one experiment) as its own strip
+on a fixed grid layout and composites the strips into the PNG.  Strips are
+cached as .npy images keyed on the SHA-256 of everything that changes the
+column: its data arrays and FlightLogs, title and extra arguments, its
+position in the grid, the figure size, dpi and layout, the rcParams in
+RC_KEYS, the decimation settings and the source of the plotting module.
+After a change to one experiment or one filter parameter only the affected
+columns are drawn again, in a process pool when there are several.
+
+The layout is fixed rather than tight_layout so that a strip does not
+depend on its neighbours; LAYOUT reproduces the tight layout of the paper
+figures.  Strip borders run through the middle of the gaps between columns.
+"""
+
+import hashlib
+import inspect
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib as mpl
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from TinySense import plotting
+from TinySense.flight_log import FlightLog
+
+DEFAULT_FIGURE_CACHE_DIR = os.path.join(os.environ.get("TINYSENSE_CACHE_DIR", ".tinysense_cache"), "figures")
+# Subplot parameters matching tight_layout of the 22 x 12 inch paper figures
+LAYOUT = {"left": 0.058, "right": 0.986, "bottom": 0.076, "top": 0.938, "wspace": 0.05, "hspace": 0.08}
+# rcParams that change how a strip looks and are therefore part of its key
+RC_KEYS = ("font.size", "font.family", "pdf.fonttype", "lines.linewidth", "lines.antialiased", "axes.linewidth")
+
+# Strips drawn and loaded from the cache in this process
+stats = {"drawn": 0, "cached": 0}
+
+
+def _update(digest, value):
+    """Feeds a value into digest: arrays by content, FlightLogs and DataFrames with their columns."""
+    if isinstance(value, FlightLog):
+        digest.update(repr(list(value.columns)).encode())
+        _update(digest, value.data)
+    elif isinstance(value, pd.DataFrame):
+        digest.update(repr(list(value.columns)).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        digest.update(f"{value.dtype.str}{value.shape}".encode())
+        digest.update(value.tobytes())
+    elif isinstance(value, (tuple, list)):
+        digest.update(f"{type(value).__name__}{len(value)}".encode())
+        for item in value:
+            _update(digest, item)
+    else:
+        digest.update(repr(value).encode())
+
+
+def column_key(plot, column, col, n_cols, figsize, dpi, rc):
+    """SHA-256 identifying the strip of one column."""
+    digest = hashlib.sha256()
+    digest.update(f"{plot.__module__}.{plot.__qualname__}".encode())
+    digest.update(inspect.getsource(sys.modules[plot.__module__]).encode())
+    _update(digest, (col, n_cols, tuple(figsize), dpi, sorted(LAYOUT.items()), sorted(rc.items()),
+                     sorted(plotting._config.items())))
+    _update(digest, (column["args"], column["title"], column.get("extra", ())))
+    return digest.hexdigest()
+
+
+def _strip_bounds(fig, gridspec, n_cols):
+    """Pixel columns [start, stop) of every strip of the figure."""
+    _, _, lefts, rights = gridspec.get_grid_positions(fig)
+    width = fig.bbox.width
+    edges = [0] + [round((rights[i] + lefts[i + 1]) / 2 * width) for i in range(n_cols - 1)] + [round(width)]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def render_column(plot, column, col, n_cols, figsize, dpi, rc, decimation):
+    """RGBA image (height, strip width, 4) of one column drawn on the full-size grid."""
+    plotting.configure(**decimation)
+    with mpl.rc_context(rc):
+        fig = Figure(figsize=figsize, dpi=dpi)
+        canvas = FigureCanvasAgg(fig)
+        gridspec = fig.add_gridspec(3, n_cols, **LAYOUT)
+        axs = np.empty((3, n_cols), dtype=object)
+        for row in range(3):
+            axs[row, col] = fig.add_subplot(gridspec[row, col])
+        plot(*column["args"], axs, col, column["title"], *column.get("extra", ()))
+        canvas.draw()
+        start, stop = _strip_bounds(fig, gridspec, n_cols)[col]
+        return np.asarray(canvas.buffer_rgba())[:, start:stop].copy()
+
+
+def _render_task(task):
+    return render_column(*task)
+
+
+def render_grid(path, plot, columns, figsize=(22, 12), dpi=100, cache_dir=DEFAULT_FIGURE_CACHE_DIR, n_workers=None):
+    """Draws plot for every column spec into a 3 x len(columns) figure saved as path.
+
+    plot is one of the grid plotting functions, called as
+    plot(*column["args"], axs, col, column["title"], *column["extra"]).
+    Only columns missing from cache_dir are drawn; several missing columns
+    are drawn in a pool of n_workers processes (default one per column, at
+    most os.cpu_count()).  Returns the composited RGBA image.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    rc = {key: mpl.rcParams[key] for key in RC_KEYS}
+    decimation = dict(plotting._config)
+    keys = [column_key(plot, column, col, len(columns), figsize, dpi, rc) for col, column in enumerate(columns)]
+    strips = [None] * len(columns)
+    tasks = {}
+    for col, key in enumerate(keys):
+        strip_path = os.path.join(cache_dir, f"{key}.npy")
+        if os.path.exists(strip_path):
+            strips[col] = np.load(strip_path)
+            stats["cached"] += 1
+        else:
+            tasks[col] = (plot, columns[col], col, len(columns), figsize, dpi, rc, decimation)
+
+    if len(tasks) > 1 and n_workers != 1:
+        with ProcessPoolExecutor(min(len(tasks), n_workers or os.cpu_count())) as pool:
+            drawn = dict(zip(tasks, pool.map(_render_task, tasks.values())))
+    else:
+        drawn = {col: _render_task(task) for col, task in tasks.items()}
+    for col, strip in drawn.items():
+        strip_path = os.path.join(cache_dir, f"{keys[col]}.npy")
+        np.save(f"{strip_path}.{os.getpid()}.tmp.npy", strip)
+        os.replace(f"{strip_path}.{os.getpid()}.tmp.npy", strip_path)
+        strips[col] = strip
+        stats["drawn"] += 1
+
+    image = np.concatenate(strips, axis=1)
+    plt.imsave(path, image, dpi=dpi)
+    return image
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Compact container of one source's preprocessed log.
+
+A FlightLog holds the whole log as a single float64 (rows, columns) array
+in column-major order, so every column is contiguous, plus the column names.
+Unlike a DataFrame it has no index, no block manager and no per-column
+Series objects:
+
+* log["z(m)"] is a view of a column and log["z(m)"] -= bias edits it in place,
+* log[["pose.orientation.x", ...]] selects several columns (a copy, as in NumPy),
+* any other key indexes the array, so log[:, 0] and log[i:, 3] work as on the
+  arrays the Kalman and plotting code used to receive,
+* log.window(t0, t1) and log.rows(i0, i1) are views, found by binary search
+  on the (sorted) timestamps instead of boolean masks.
+
+from_frame wraps the array of a homogeneous float64 DataFrame, as returned
+by load_flight_csv, without copying it; loaders.load_flight_log reads a CSV
+straight into a FlightLog.  Views keep the array they were taken from
+alive; copy() gives a log of its own.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class FlightLog:
+    """One source's log: a float64 (rows, columns) array and its column names."""
+
+    __slots__ = ("data", "columns", "_positions")
+
+    def __init__(self, data, columns):
+        data = np.asarray(data)
+        columns = tuple(columns)
+        if data.ndim != 2 or data.shape[1] != len(columns):
+            raise ValueError(f"Expected a 2-D array with {len(columns)} columns, got shape {data.shape}")
+        self.data = data
+        self.columns = columns
+        self._positions = {name: i for i, name in enumerate(columns)}
+
+    @classmethod
+    def from_frame(cls, frame, dtype="float64"):
+        """FlightLog of a DataFrame's values; shares them when they already are one block of dtype."""
+        return cls(frame.to_numpy(dtype=dtype), frame.columns)
+
+    @classmethod
+    def empty(cls, rows, columns, dtype="float64"):
+        """Uninitialized column-major FlightLog to be filled column by column."""
+        return cls(np.empty((rows, len(columns)), dtype=dtype, order="F"), columns)
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def __contains__(self, name):
+        return name in self._positions
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.data[:, self._positions[key]]
+        if isinstance(key, list) and key and all(isinstance(name, str) for name in key):
+            return self.data[:, [self._positions[name] for name in key]]
+        return self.data[key]
+
+    def __setitem__(self, key, values):
+        if isinstance(key, str):
+            key = (slice(None), self._positions[key])
+        self.data[key] = values
+
+    def __array__(self, dtype=None, copy=None):
+        if copy:
+            return np.array(self.data, dtype=dtype)
+        return np.asarray(self.data, dtype=dtype)
+
+    def __repr__(self):
+        return f"FlightLog({len(self)} rows, columns={list(self.columns)})"
+
+    def info(self):
+        """Prints the size, columns, dtype and memory of the log, like DataFrame.info."""
+        print(f"{self!r}, {self.data.dtype}, {self.data.nbytes / 1e6:.1f} MB")
+
+    def rows(self, start, stop):
+        """View of rows [start, stop)."""
+        return FlightLog(self.data[start:stop], self.columns)
+
+    def window(self, t0, t1, time_column="timestamp"):
+        """View of the rows with t0 < time <= t1; the times must be sorted."""
+        times = self[time_column]
+        return self.rows(np.searchsorted(times, t0, side="right"), np.searchsorted(times, t1, side="right"))
+
+    def copy(self):
+        return FlightLog(self.data.copy(order="F"), self.columns)
+
+    def to_numpy(self, dtype=None, copy=False):
+        """The values as an array, shared with the log unless copy=True or dtype differs."""
+        return np.array(self.data, dtype=dtype) if copy else np.asarray(self.data, dtype=dtype)
+
+    def to_frame(self):
+        """DataFrame of a copy of the values, with a default index."""
+        return pd.DataFrame(self.data, columns=list(self.columns), copy=True)
+
+
+def as_flight_log(data):
+    """data as a FlightLog: FlightLogs are returned as they are, DataFrames wrapped by from_frame."""
+    return data if isinstance(data, FlightLog) else FlightLog.from_frame(data)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Memoized steady-state Kalman gains.
+
+steady_state_gain is a drop-in replacement for control.lqe(A, G, C, Q, R).
+Solutions are keyed on a canonical SHA-256 of the five matrices (dtype,
+shape and values, with -0.0 folded into 0.0) and served from, in order:
+
+* an in-process LRU of maxsize entries
+* an optional on-disk store of .npz files, shared between runs and worker
+  processes, enabled with TINYSENSE_GAIN_CACHE_DIR or configure(cache_dir=...)
+* a warm start: when a gain for the same A and C is cached and G Q G' and R
+  moved by less than half since, Newton-Kleinman iteration refines it.  A gain that stabilizes
+  A - L C stays stabilizing whatever the noise weights, so each iteration is
+  one Lyapunov solve and a few of them converge to machine precision.  The
+  warm start falls back to control.lqe if it does not converge fast.
+
+The measurement data never enters the gain, so repeated filter runs on new
+data are always served from the cache.  stats counts every outcome; report()
+formats the hit rates.
+"""
+
+import hashlib
+import os
+from collections import OrderedDict
+
+import control
+import numpy as np
+from scipy import linalg
+
+from TinySense.instrument import annotate
+
+# Outcomes of steady_state_gain calls in this process
+stats = {"hits": 0, "disk_hits": 0, "warm_starts": 0, "solves": 0}
+
+_config = {"maxsize": 1024, "cache_dir": os.environ.get("TINYSENSE_GAIN_CACHE_DIR") or None,
+           "warm_start": True, "tolerance": 1e-12, "max_iterations": 8}
+_solutions = OrderedDict()  # key -> (L, P, E), least recently used first
+_families = OrderedDict()  # key of (A, C) -> (L, G Q G', R) of the latest solution for them
+
+
+def configure(maxsize=None, cache_dir=None, warm_start=None):
+    """Changes the LRU size, the on-disk store (False disables it) or the warm start.
+
+    The on-disk store is exported to the environment so worker processes share it.
+    """
+    if maxsize is not None:
+        _config["maxsize"] = maxsize
+    if cache_dir is not None:
+        _config["cache_dir"] = cache_dir or None
+        if cache_dir:
+            os.environ["TINYSENSE_GAIN_CACHE_DIR"] = cache_dir
+        else:
+            os.environ.pop("TINYSENSE_GAIN_CACHE_DIR", None)
+    if warm_start is not None:
+        _config["warm_start"] = warm_start
+
+
+def clear():
+    """Empties the in-process cache and resets stats; the on-disk store is kept."""
+    _solutions.clear()
+    _families.clear()
+    for name in stats:
+        stats[name] = 0
+
+
+def canonical_key(*matrices):
+    """SHA-256 of the dtype-normalized shapes and values of matrices."""
+    digest = hashlib.sha256()
+    for matrix in matrices:
+        matrix = np.ascontiguousarray(matrix, dtype="float64") + 0.0  # -0.0 hashes like 0.0
+        digest.update(repr(matrix.shape).encode())
+        digest.update(matrix.tobytes())
+    return digest.hexdigest()
+
+
+def _remember(cache, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > _config["maxsize"]:
+        cache.popitem(last=False)
+
+
+def _load(key):
+    path = os.path.join(_config["cache_dir"], f"{key}.npz")
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as entry:
+        return entry["L"], entry["P"], entry["E"]
+
+
+def _store(key, solution):
+    os.makedirs(_config["cache_dir"], exist_ok=True)
+    path = os.path.join(_config["cache_dir"], f"{key}.npz")
+    tmp_path = f"{path}.tmp-{os.getpid()}.npz"
+    np.savez(tmp_path, L=solution[0], P=solution[1], E=solution[2])
+    os.replace(tmp_path, path)
+
+
+def kleinman_refine(A, G, C, Q, R, L0, tolerance=1e-12, max_iterations=8):
+    """Newton-Kleinman iteration for the filter Riccati equation from a stabilizing gain L0.
+
+    Returns (L, P) or None when L0 does not stabilize A - L0 C or the
+    iteration does not converge quickly.
+    """
+    W = G @ Q @ G.T
+    R_inv = np.linalg.inv(R)
+    L = L0
+    # Every iterate stabilizes A - L C once the first one does
+    if np.max(np.linalg.eigvals(A - L @ C).real) >= 0:
+        return None
+    # A first relative change of L above 0.2 takes more iterations than one control.lqe solve costs
+    largest_step = 0.2
+    for _ in range(max_iterations):
+        P = linalg.solve_continuous_lyapunov(A - L @ C, -(W + L @ R @ L.T))
+        L_next = P @ C.T @ R_inv
+        step = np.max(np.abs(L_next - L)) / np.max(np.abs(L_next))
+        L = L_next
+        if step <= tolerance:
+            return L, (P + P.T) / 2
+        if not step <= largest_step:
+            return None
+        largest_step = step / 2
+    return None
+
+
+def _close(previous, W, R):
+    """Whether the process and measurement noise moved little enough from a cached solution to warm start."""
+    _, W_previous, R_previous = previous
+    return (np.linalg.norm(W - W_previous) <= 0.5 * np.linalg.norm(W_previous)
+            and np.linalg.norm(R - R_previous) <= 0.5 * np.linalg.norm(R_previous))
+
+
+def steady_state_gain(A, G, C, Q, R):
+    """control.lqe(A, G, C, Q, R) served from the gain cache: returns (L, P, E).
+
+    The returned arrays are shared with the cache and read-only.
+    """
+    A, G, C, Q, R = (np.asarray(matrix, dtype="float64") for matrix in (A, G, C, Q, R))
+    key = canonical_key(A, G, C, Q, R)
+    if key in _solutions:
+        _solutions.move_to_end(key)
+        stats["hits"] += 1
+        annotate(gain_cache="hit")
+        return _solutions[key]
+
+    family = canonical_key(A, C)
+    solution = _load(key) if _config["cache_dir"] else None
+    if solution is not None:
+        stats["disk_hits"] += 1
+        annotate(gain_cache="disk")
+    else:
+        refined = None
+        if _config["warm_start"] and family in _families and _close(_families[family], G @ Q @ G.T, R):
+            refined = kleinman_refine(A, G, C, Q, R, _families[family][0], _config["tolerance"],
+                                      _config["max_iterations"])
+        if refined is not None:
+            L, P = refined
+            E = np.linalg.eigvals(A - L @ C)
+            stats["warm_starts"] += 1
+            annotate(gain_cache="warm")
+        else:
+            L, P, E = control.lqe(A, G, C, Q, R)
+            stats["solves"] += 1
+            annotate(gain_cache="solve")
+        solution = (np.asarray(L), np.asarray(P), np.asarray(E))
+        if _config["cache_dir"]:
+            _store(key, solution)
+
+    for array in solution:
+        array.flags.writeable = False
+    _remember(_solutions, key, solution)
+    _remember(_families, family, (solution[0], G @ Q @ G.T, R))
+    return solution
+
+
+def hit_rate():
+    """Fraction of calls served without a full Riccati solve."""
+    total = sum(stats.values())
+    return (total - stats["solves"]) / total if total else 0.0
+
+
+def report():
+    """One-line summary of the cache outcomes."""
+    total = sum(stats.values())
+    return (f"gain cache: {total} calls, {stats['hits']} memory hits, {stats['disk_hits']} disk hits, "
+            f"{stats['warm_starts']} warm starts, {stats['solves']} solves ({hit_rate():.0%} without a solve)")
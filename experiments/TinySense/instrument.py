@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight instrumentation of the processing and plotting stages.
+
+Functions decorated with @instrumented() record, when tracing is on, their
+wall and CPU time, the rows of the FlightLogs, DataFrames and arrays they
+take and return, the bytes they allocate (tracemalloc) and any fields the
+stage adds with annotate(), such as cache hits.  Selected stages can also run under
+cProfile.  Events are grouped per experiment (with experiment(name)) and
+written to the trace directory as JSON lines or as a Chrome trace that
+chrome://tracing or Perfetto open.
+
+Tracing is off unless TINYSENSE_TRACE names a trace directory or configure()
+is called (runner --trace does this).  When off, a decorated call costs one
+global lookup.  Other settings:
+
+    TINYSENSE_TRACE_FORMAT   jsonl (default) or chrome
+    TINYSENSE_TRACE_MEMORY   0 disables tracemalloc, which slows Python code
+    TINYSENSE_PROFILE        comma-separated stage names to profile, or "all"
+
+Summarize the traces of a run from the experiments folder with:
+
+    python -m TinySense.instrument traces
+"""
+
+import argparse
+import atexit
+import cProfile
+import functools
+import glob
+import json
+import os
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from TinySense.flight_log import FlightLog
+
+FORMATS = ("jsonl", "chrome")
+
+# Active configuration, None while tracing is off
+_config = None
+_stack = []
+_events = {}  # Buffered events by experiment name
+_experiment = None
+_profiling = False
+_profile_count = 0
+
+
+def configure(trace_dir, trace_format="jsonl", memory=True, profile=()):
+    """Turns tracing on and exports the settings so worker processes inherit them."""
+    global _config
+    if trace_format not in FORMATS:
+        raise ValueError(f"Unknown trace format: {trace_format}")
+    os.makedirs(trace_dir, exist_ok=True)
+    _config = {"trace_dir": trace_dir, "format": trace_format, "memory": memory, "profile": set(profile)}
+    os.environ.update(TINYSENSE_TRACE=trace_dir, TINYSENSE_TRACE_FORMAT=trace_format,
+                      TINYSENSE_TRACE_MEMORY="1" if memory else "0", TINYSENSE_PROFILE=",".join(profile))
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    """Writes pending events and turns tracing off."""
+    global _config
+    flush()
+    os.environ.pop("TINYSENSE_TRACE", None)
+    _config = None
+
+
+def enabled():
+    return _config is not None
+
+
+def _rows(value):
+    """Total rows of the FlightLogs, DataFrames and arrays in a value or tuple of values."""
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(value) if value.ndim else 0
+    if isinstance(value, FlightLog):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(_rows(item) for item in value)
+    return 0
+
+
+def _wants_profile(name):
+    return not _profiling and ("all" in _config["profile"] or name in _config["profile"])
+
+
+class _Stage:
+    """Context manager recording one stage; used by instrumented() and stage()."""
+
+    def __init__(self, name, rows_in=0):
+        self.name = name
+        self.event = {"name": name, "rows_in": rows_in}
+        self.profiler = None
+
+    def __enter__(self):
+        global _profiling
+        event = self.event
+        if _config["memory"] and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if _stack:
+                _stack[-1]._peak = max(_stack[-1]._peak, peak)
+            tracemalloc.reset_peak()
+            self._start_memory = current
+            self._peak = current
+        if _wants_profile(self.name):
+            self.profiler = cProfile.Profile()
+            _profiling = True
+        event["depth"] = len(_stack)
+        event["pid"] = os.getpid()
+        _stack.append(self)
+        event["start"] = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        if self.profiler is not None:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        global _profiling, _profile_count
+        if self.profiler is not None:
+            self.profiler.disable()
+        event = self.event
+        event["wall_s"] = time.perf_counter() - self._wall
+        event["cpu_s"] = time.process_time() - self._cpu
+        _stack.pop()
+        if exc_type is not None:
+            event["error"] = exc_type.__name__
+        if _config["memory"] and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            self._peak = max(self._peak, peak)
+            event["alloc_bytes"] = current - self._start_memory
+            event["peak_bytes"] = self._peak - self._start_memory
+            if _stack:
+                _stack[-1]._peak = max(_stack[-1]._peak, self._peak)
+        if self.profiler is not None:
+            _profiling = False
+            _profile_count += 1
+            path = os.path.join(_config["trace_dir"],
+                                f"{_experiment or 'session'}.{self.name}.{os.getpid()}.{_profile_count}.prof")
+            self.profiler.dump_stats(path)
+            event["profile"] = path
+        _events.setdefault(_experiment, []).append(event)
+        return False
+
+    def set_result(self, result):
+        self.event["rows_out"] = _rows(result)
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+    def set_result(self, result):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name, rows_in=0):
+    """Context manager timing a block as a stage; call set_result(value) to count output rows."""
+    return _NULL_STAGE if _config is None else _Stage(name, rows_in)
+
+
+def instrumented(name=None):
+    """Decorator recording every call of a function as a stage named name (default its name)."""
+    def decorate(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _config is None:
+                return func(*args, **kwargs)
+            with _Stage(stage_name, _rows(args) + _rows(tuple(kwargs.values()))) as recorder:
+                result = func(*args, **kwargs)
+                recorder.set_result(result)
+            return result
+        return wrapper
+    return decorate
+
+
+def annotate(**fields):
+    """Adds fields to the innermost running stage, such as cache="hit"."""
+    if _config is not None and _stack:
+        _stack[-1].event.update(fields)
+
+
+class experiment:
+    """Context manager grouping the stages run inside it into one trace file per experiment."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        global _experiment
+        self._previous = _experiment
+        _experiment = self.name
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        global _experiment
+        _experiment = self._previous
+        if _config is not None:
+            _write(self.name, _events.pop(self.name, []))
+        return False
+
+
+def _write(name, events):
+    """Appends events to <trace_dir>/<name>.jsonl or writes <trace_dir>/<name>.trace.json."""
+    if not events:
+        return
+    base = os.path.join(_config["trace_dir"], name or f"session-{os.getpid()}")
+    if _config["format"] == "jsonl":
+        with open(f"{base}.jsonl", "a") as file:
+            for event in events:
+                file.write(json.dumps(event) + "\n")
+        return
+
+    trace_events = [{"name": event["name"], "ph": "X", "pid": event["pid"], "tid": 0,
+                     "ts": event["start"] * 1e6, "dur": event["wall_s"] * 1e6,
+                     "args": {key: value for key, value in event.items()
+                              if key not in ("name", "pid", "start", "wall_s")}}
+                    for event in events]
+    with open(f"{base}.trace.json", "w") as file:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, file)
+
+
+def flush():
+    """Writes the buffered events of every experiment."""
+    if _config is None:
+        return
+    for name in list(_events):
+        _write(name, _events.pop(name))
+
+
+def load_traces(trace_dir):
+    """All events of the JSON lines and Chrome traces in trace_dir as a DataFrame."""
+    records = []
+    for path in sorted(glob.glob(os.path.join(trace_dir, "*.jsonl"))):
+        experiment_name = os.path.basename(path)[:-len(".jsonl")]
+        with open(path) as file:
+            records += [dict(json.loads(line), experiment=experiment_name) for line in file if line.strip()]
+    for path in sorted(glob.glob(os.path.join(trace_dir, "*.trace.json"))):
+        experiment_name = os.path.basename(path)[:-len(".trace.json")]
+        with open(path) as file:
+            for event in json.load(file)["traceEvents"]:
+                records.append(dict(event["args"], name=event["name"], pid=event["pid"], start=event["ts"] / 1e6,
+                                    wall_s=event["dur"] / 1e6, experiment=experiment_name))
+    return pd.DataFrame(records)
+
+
+def summarize(events):
+    """Calls, total and mean wall/CPU time and rows per stage, slowest first."""
+    columns = {"calls": ("wall_s", "size"), "wall_s": ("wall_s", "sum"), "mean_wall_s": ("wall_s", "mean"),
+               "cpu_s": ("cpu_s", "sum"), "rows_in": ("rows_in", "sum"), "rows_out": ("rows_out", "sum")}
+    if "peak_bytes" in events:
+        columns["max_peak_bytes"] = ("peak_bytes", "max")
+    return events.groupby("name").agg(**columns).sort_values("wall_s", ascending=False)
+
+
+def _configure_from_environment():
+    trace_dir = os.environ.get("TINYSENSE_TRACE")
+    if trace_dir:
+        profile = [name for name in os.environ.get("TINYSENSE_PROFILE", "").split(",") if name]
+        configure(trace_dir, os.environ.get("TINYSENSE_TRACE_FORMAT", "jsonl"),
+                  os.environ.get("TINYSENSE_TRACE_MEMORY", "1") != "0", profile)
+
+
+_configure_from_environment()
+atexit.register(flush)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the stage traces of a run.")
+    parser.add_argument("trace_dir")
+    args = parser.parse_args()
+
+    events = load_traces(args.trace_dir)
+    if events.empty:
+        print(f"No traces in {args.trace_dir}")
+        return
+    print(f"{events['experiment'].nunique()} experiments, {len(events)} stage calls")
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+        print(summarize(events))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel-in-time engine for the TinySense observer.
+
+Every Euler step of the observer in data_processing is affine in qhat:
+
+    qhat[i] = (I + dt * (A - L C)) qhat[i-1] + dt * (B u + L (y - D u))
+
+so the whole trajectory is a prefix composition of affine maps.  The maps are
+built for all samples at once and combined with an associative scan, which
+replaces the per-sample Python loop with O(sqrt(N)) batched matrix products.
+"""
+
+import numpy as np
+
+
+def fill_duplicate_timestamps(t, start=0):
+    """Moves repeated timestamps to the midpoint with the next sample, in place.
+
+    Matches the sequential loop: inside a run of equal timestamps only the last
+    repeat is moved, the others keep a zero time step.
+    """
+    i = np.arange(max(start, 0) + 1, len(t) - 1)
+    dup = (t[i] == t[i - 1]) & (t[i + 1] != t[i])
+    i = i[dup]
+    t[i] = (t[i - 1] + t[i + 1]) / 2
+    return t
+
+
+def observer_transitions(A, B, C, D, L, t, y, u):
+    """Builds the per-step affine maps (M, c) of the observer.
+
+    t has shape (..., N), y has shape (..., N, 2) and u has shape (..., N, 1).
+    Step i maps qhat[i-1] to qhat[i] using the inputs of sample i-1, so the
+    returned M has shape (..., N-1, 3, 3) and c has shape (..., N-1, 3).
+    L may carry the same leading batch dimensions as the data.
+    """
+    L = np.asarray(L, dtype="float64")
+    dt = np.diff(t, axis=-1)[..., None]
+    F = A - L @ C
+    y = y[..., :-1, :]
+    u = u[..., :-1, :]
+
+    M = np.eye(A.shape[0]) + dt[..., None] * F[..., None, :, :]
+    innovation = y - u @ D.T
+    c = dt * (u @ B.T + innovation @ np.swapaxes(L, -1, -2))
+    return M, c
+
+
+def affine_prefix_scan(M, c, block_size=None):
+    """Inclusive prefix composition of affine maps along axis -3 of M.
+
+    Returns (P, s) with P[i] = M[i] ... M[0] and s[i] the offset accumulated by
+    the same composition, so that x[i+1] = P[i] x[0] + s[i].
+
+    The scan is blocked: the maps are split into blocks of block_size (default
+    about sqrt(N)), every block is scanned at once with one vectorized pass per
+    block position, and the block totals are scanned recursively to carry each
+    block's starting state into the next.  Work is O(N) in about 2*sqrt(N)
+    vectorized steps.
+    """
+    n, k = M.shape[-3], M.shape[-1]
+    batch = M.shape[:-3]
+    if block_size is None:
+        block_size = max(1, int(np.ceil(np.sqrt(n))))
+    n_blocks = -(-n // block_size)
+
+    # Pad with identity maps so the samples reshape into whole blocks
+    pad = n_blocks * block_size - n
+    if pad:
+        M = np.concatenate([M, np.broadcast_to(np.eye(k), batch + (pad, k, k))], axis=-3)
+        c = np.concatenate([c, np.zeros(batch + (pad, k))], axis=-2)
+    M = M.reshape(batch + (n_blocks, block_size, k, k))
+    c = c.reshape(batch + (n_blocks, block_size, k))
+
+    # Scan inside every block simultaneously
+    P = np.empty(M.shape)
+    s = np.empty(c.shape)
+    P[..., 0, :, :] = M[..., 0, :, :]
+    s[..., 0, :] = c[..., 0, :]
+    for j in range(1, block_size):
+        P[..., j, :, :] = M[..., j, :, :] @ P[..., j - 1, :, :]
+        s[..., j, :] = (M[..., j, :, :] @ s[..., j - 1, :, None])[..., 0] + c[..., j, :]
+
+    # Compose every block after the scanned totals of the blocks before it
+    if n_blocks > 1:
+        carry_P, carry_s = affine_prefix_scan(P[..., :-1, -1, :, :], s[..., :-1, -1, :])
+        s[..., 1:, :, :] += (P[..., 1:, :, :, :] @ carry_s[..., :, None, :, None])[..., 0]
+        P[..., 1:, :, :, :] = P[..., 1:, :, :, :] @ carry_P[..., :, None, :, :]
+
+    P = P.reshape(batch + (-1, k, k))[..., :n, :, :]
+    s = s.reshape(batch + (-1, k))[..., :n, :]
+    return P, s
+
+
+def observer_scan(ts_data, q0, A, B, C, D, L):
+    """Runs the observer over ts_data with the associative scan.
+
+    ts_data holds the [timestamp, optic_flow, gyro, z] columns starting at the
+    initial sample, with duplicate timestamps already resolved.  Leading batch
+    dimensions of ts_data, q0 and L broadcast against each other, so a stack of
+    gains runs as one batch.  Returns the (..., N, 3) state estimates with q0 in
+    the first row.
+    """
+    t = ts_data[..., 0]
+    y = ts_data[..., [1, 3]]
+    u = ts_data[..., [2]]
+    q0 = np.asarray(q0, dtype="float64")
+
+    M, c = observer_transitions(A, B, C, D, L, t, y, u)
+    P, s = affine_prefix_scan(M, c)
+    q_first = np.broadcast_to(q0[..., None, :], s.shape[:-2] + (1, s.shape[-1]))
+    return np.concatenate([q_first, (P @ q0[..., None, :, None])[..., 0] + s], axis=-2)
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized NumPy port of the LKOpticFlow firmware library.
+
+Mirrors OpticFlowProvider<WIDTH, HEIGHT, PATCHSIZE>::update from
+src/lib/LKOpticFlow for offline reprocessing of recorded camera frames:
+
+* the input frame is decimated by skipFactor in both directions
+* the image is split into PATCHSIZE x PATCHSIZE patches and the one-pixel
+  border of every patch is ignored
+* gradients come from the previous frame with integer central differences,
+  b = prev - curr
+* each patch solves the 2x2 Lucas-Kanade normal equations (~A*A) v = ~A*b;
+  patches whose normal matrix is singular are skipped, but the average still
+  divides by the total number of patches
+
+All patches of all frame pairs are solved at once with strided patch views and
+a closed-form 2x2 inverse.  The normal matrices hold integers small enough to
+be exact in float64, so the singular-patch test is exact; the velocities are
+returned as float32 like the firmware's.
+"""
+
+import numpy as np
+
+# Settings of the Avionics and CameraOpticFlow sketches
+OF_WIDTH = 40
+OF_HEIGHT = 30
+OF_PATCH = 10
+SKIP_FACTOR = 4
+
+
+def decimate(frames, width=OF_WIDTH, height=OF_HEIGHT, skip_factor=SKIP_FACTOR):
+    """performArraySkip: every skip_factor-th pixel of every skip_factor-th row.
+
+    frames has shape (..., height * skip_factor, width * skip_factor) or is
+    flat with that many pixels in its last axis.  Returns a view.
+    """
+    frames = np.asarray(frames)
+    shape = (height * skip_factor, width * skip_factor)
+    if frames.shape[-2:] != shape:
+        frames = frames.reshape(frames.shape[:-1] + shape)
+    return frames[..., ::skip_factor, ::skip_factor]
+
+
+def _patches(image, patch_size):
+    """(..., rows, cols, patch_size - 2, patch_size - 2) view of the patch interiors."""
+    height, width = image.shape[-2:]
+    rows, cols = height // patch_size, width // patch_size
+    patches = image.reshape(image.shape[:-2] + (rows, patch_size, cols, patch_size))
+    patches = np.swapaxes(patches, -3, -2)
+    return patches[..., 1:-1, 1:-1]
+
+
+def patch_flows(prev, curr, patch_size=OF_PATCH):
+    """Lucas-Kanade velocity of every patch of decimated (..., height, width) frames.
+
+    Returns (v, valid): v has shape (..., rows, cols, 2) with NaN for singular
+    patches, valid marks the patches the firmware would use.
+    """
+    prev = np.asarray(prev, dtype=np.int16)
+    curr = np.asarray(curr, dtype=np.int16)
+    height, width = prev.shape[-2:]
+    if height % patch_size or width % patch_size:
+        raise ValueError(f"Frame size {width}x{height} is not a multiple of the patch size {patch_size}")
+
+    # Integer central differences of the previous frame, truncated like C int division
+    ix = np.zeros(prev.shape, dtype=np.float64)
+    iy = np.zeros(prev.shape, dtype=np.float64)
+    ix[..., :, 1:-1] = np.fix((prev[..., :, 2:] - prev[..., :, :-2]) / 2)
+    iy[..., 1:-1, :] = np.fix((prev[..., 2:, :] - prev[..., :-2, :]) / 2)
+    it = (prev - curr).astype(np.float64)
+
+    ix, iy, it = (_patches(image, patch_size) for image in (ix, iy, it))
+    sxx = np.einsum("...ij,...ij->...", ix, ix)
+    sxy = np.einsum("...ij,...ij->...", ix, iy)
+    syy = np.einsum("...ij,...ij->...", iy, iy)
+    sxb = np.einsum("...ij,...ij->...", ix, it)
+    syb = np.einsum("...ij,...ij->...", iy, it)
+
+    det = sxx * syy - sxy * sxy
+    valid = det != 0
+    safe_det = np.where(valid, det, 1.0)
+    v = np.stack([(syy * sxb - sxy * syb) / safe_det,
+                  (sxx * syb - sxy * sxb) / safe_det], axis=-1)
+    v[~valid] = np.nan
+    return v, valid
+
+
+def optic_flow(prev, curr, patch_size=OF_PATCH):
+    """Average flow (x, y) of decimated frame pairs, as returned by getXVelocity/getYVelocity."""
+    v, valid = patch_flows(prev, curr, patch_size)
+    n_patches = valid.shape[-1] * valid.shape[-2]
+    v = np.where(valid[..., None], v, 0.0)
+    return (v.sum(axis=(-3, -2)) / n_patches).astype(np.float32)
+
+
+def optic_flow_sequence(frames, width=OF_WIDTH, height=OF_HEIGHT, patch_size=OF_PATCH,
+                        skip_factor=SKIP_FACTOR, prev=None, chunk_size=4096):
+    """Flow of every frame of a recording against the frame before it.
+
+    frames is an (N, rows, cols) or (N, pixels) array of raw camera frames.  The
+    first frame is compared with prev (decimated), or with the all-zero buffer
+    the firmware starts from, which yields zero flow.  Frames are processed
+    chunk_size at a time to bound memory.  Returns an (N, 2) float32 array.
+    """
+    data = decimate(frames, width, height, skip_factor)
+    last = np.zeros((height, width), dtype=np.uint8) if prev is None else np.asarray(prev)
+    flows = np.empty((len(data), 2), dtype=np.float32)
+    for start in range(0, len(data), chunk_size):
+        chunk = data[start:start + chunk_size]
+        previous = np.concatenate([last[None], chunk[:-1]])
+        flows[start:start + len(chunk)] = optic_flow(previous, chunk, patch_size)
+        last = chunk[-1]
+    return flows
+
+
+class OpticFlowProvider:
+    """Stateful equivalent of the firmware class for frame-by-frame use."""
+
+    def __init__(self, width=OF_WIDTH, height=OF_HEIGHT, patch_size=OF_PATCH):
+        self.width = width
+        self.height = height
+        self.patch_size = patch_size
+        self.prev = np.zeros((height, width), dtype=np.uint8)
+        self.x_velocity = 0.0
+        self.y_velocity = 0.0
+
+    def update(self, frame, skip_factor=1):
+        data = decimate(frame, self.width, self.height, skip_factor)
+        self.x_velocity, self.y_velocity = optic_flow(self.prev, data, self.patch_size)
+        self.prev = data.copy()
+
+    def get_x_velocity(self):
+        return self.x_velocity
+
+    def get_y_velocity(self):
+        return self.y_velocity
+
+
+def firmware_update(prev, data, width=OF_WIDTH, height=OF_HEIGHT, patch_size=OF_PATCH):
+    """Line-by-line transliteration of OpticFlowProvider::update for one decimated frame.
+
+    Float32 arithmetic and the zero-pivot singular test of the firmware's LU
+    decomposition; the slow reference the batched port is checked against.
+    """
+    prev = prev.ravel().astype(int)
+    data = data.ravel().astype(int)
+    patch_rows, patch_cols = height // patch_size, width // patch_size
+    x_velocity = np.float32(0)
+    y_velocity = np.float32(0)
+    for row in range(0, height, patch_size):
+        for col in range(0, width, patch_size):
+            A = []
+            b = []
+            for i in range(row + 1, row + patch_size - 1):
+                for j in range(col + 1, col + patch_size - 1):
+                    flat = i * width + j
+                    A.append((int((prev[flat + 1] - prev[flat - 1]) / 2),
+                              int((prev[flat + width] - prev[flat - width]) / 2)))
+                    b.append(prev[flat] - data[flat])
+            A = np.array(A, dtype=np.float32)
+            b = np.array(b, dtype=np.float32)
+            product = A.T @ A
+            # Zero-pivot singular test of an LU decomposition with partial pivoting
+            pivot_row = int(abs(product[1, 0]) > abs(product[0, 0]))
+            pivot = product[pivot_row, 0]
+            other = product[1 - pivot_row]
+            second = other[1] - other[0] / pivot * product[pivot_row, 1] if pivot != 0 else 0
+            if pivot == 0 or second == 0:
+                continue
+            v = np.linalg.inv(product.astype(np.float64)) @ (A.T @ b)
+            x_velocity += np.float32(v[0] / (patch_rows * patch_cols))
+            y_velocity += np.float32(v[1] / (patch_rows * patch_cols))
+    return x_velocity, y_velocity
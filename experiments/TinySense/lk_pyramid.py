@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Batched pyramidal Lucas-Kanade optic flow for long camera recordings.
+
+The firmware's OpticFlowProvider (see lk_optic_flow) solves one single-scale
+system per patch, so motion beyond about a pixel per frame is lost.  This
+engine tracks a grid of patch centers coarse to fine through an image pyramid
+and iterates each level, which recovers motion of several pixels per frame.
+
+Each frame's pyramid and gradients are built once and used both when the
+frame is the template of pair (k, k+1) and the target of pair (k-1, k).  All
+frame pairs of a chunk are solved together: templates, gradients and warped
+targets are gathered as (pairs, patches, window) arrays and the 2x2 systems are
+solved in closed form.  The template-side normal matrices are fixed per level,
+so every iteration only resamples the target.  Chunks can be spread over a
+process pool.
+
+flow_rate_series converts the pixel flow into the units of the TinySense
+optic_flow(rad/s) column so that it can replace that column before
+kalman_filter_from_1cm_optic.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import ndimage
+
+# Binomial kernel used to smooth each level before halving it
+PYRAMID_KERNEL = np.array([1, 4, 6, 4, 1]) / 16
+
+
+def build_pyramids(frames, levels):
+    """Images and x/y gradients of each pyramid level of (N, height, width) frames.
+
+    Returns a list of (image, grad_x, grad_y) tuples of float32 arrays, finest
+    level first.
+    """
+    image = np.asarray(frames, dtype=np.float32)
+    pyramid = []
+    for level in range(levels):
+        if level:
+            image = ndimage.convolve1d(image, PYRAMID_KERNEL, axis=-1, mode="nearest")
+            image = ndimage.convolve1d(image, PYRAMID_KERNEL, axis=-2, mode="nearest")[..., ::2, ::2]
+        pyramid.append((image, np.gradient(image, axis=-1), np.gradient(image, axis=-2)))
+    return pyramid
+
+
+def patch_centers(height, width, patch_size):
+    """(y, x) centers of the patch_size grid covering a height x width frame."""
+    rows, cols = height // patch_size, width // patch_size
+    y = (np.arange(rows) + 0.5) * patch_size - 0.5
+    x = (np.arange(cols) + 0.5) * patch_size - 0.5
+    y, x = np.meshgrid(y, x, indexing="ij")
+    return y.ravel(), x.ravel()
+
+
+def _sample(images, y, x):
+    """Bilinear samples of (N, H, W) images at (N, ...) coordinates, clamped to the border."""
+    n, height, width = images.shape
+    y = np.clip(y, 0, height - 1)
+    x = np.clip(x, 0, width - 1)
+    y0 = np.minimum(y.astype(np.intp), height - 2)
+    x0 = np.minimum(x.astype(np.intp), width - 2)
+    wy = (y - y0).astype(np.float32)
+    wx = (x - x0).astype(np.float32)
+    flat = images.reshape(-1)
+    base = np.arange(n).reshape((n,) + (1,) * (y.ndim - 1)) * (height * width) + y0 * width + x0
+    top = flat[base] * (1 - wx) + flat[base + 1] * wx
+    bottom = flat[base + width] * (1 - wx) + flat[base + width + 1] * wx
+    return top * (1 - wy) + bottom * wy
+
+
+def _track(pyramid_prev, pyramid_curr, centers, window, iterations, min_eigenvalue):
+    """Displacement (pairs, patches, 2) of every patch center and its validity mask."""
+    center_y, center_x = centers
+    offsets = np.arange(-window, window + 1)
+    offset_y, offset_x = (a.ravel() for a in np.meshgrid(offsets, offsets, indexing="ij"))
+    n_pairs = len(pyramid_prev[0][0])
+    guess = np.zeros((n_pairs, len(center_y), 2))
+    valid = np.ones((n_pairs, len(center_y)), dtype=bool)
+
+    for level in reversed(range(len(pyramid_prev))):
+        image_prev, grad_x, grad_y = pyramid_prev[level]
+        image_curr = pyramid_curr[level][0]
+        scale = 2 ** level
+        # Template coordinates, (pairs, patches, window pixels)
+        ty = np.broadcast_to((center_y / scale)[:, None] + offset_y, (n_pairs,) + (len(center_y), len(offset_y)))
+        tx = np.broadcast_to((center_x / scale)[:, None] + offset_x, ty.shape)
+        template = _sample(image_prev, ty, tx)
+        gx = _sample(grad_x, ty, tx)
+        gy = _sample(grad_y, ty, tx)
+
+        sxx = np.einsum("...k,...k->...", gx, gx)
+        sxy = np.einsum("...k,...k->...", gx, gy)
+        syy = np.einsum("...k,...k->...", gy, gy)
+        det = sxx * syy - sxy * sxy
+        # Smaller eigenvalue of the normal matrix per window pixel
+        min_eig = ((sxx + syy) / 2 - np.sqrt(((sxx - syy) / 2) ** 2 + sxy ** 2)) / len(offset_y)
+        level_valid = min_eig > min_eigenvalue
+        safe_det = np.where(level_valid, det, 1.0)
+
+        for _ in range(iterations):
+            warped = _sample(image_curr, ty + guess[..., 1:2], tx + guess[..., 0:1])
+            error = template - warped
+            sxb = np.einsum("...k,...k->...", gx, error)
+            syb = np.einsum("...k,...k->...", gy, error)
+            step = np.stack([(syy * sxb - sxy * syb) / safe_det, (sxx * syb - sxy * sxb) / safe_det], axis=-1)
+            guess += np.where(level_valid[..., None], step, 0.0)
+
+        if level == 0:
+            # Patches tracked out of the frame only saw the clamped border
+            height, width = image_curr.shape[-2:]
+            inside = ((ty + guess[..., 1:2] >= 0) & (ty + guess[..., 1:2] <= height - 1)
+                      & (tx + guess[..., 0:1] >= 0) & (tx + guess[..., 0:1] <= width - 1)).all(axis=-1)
+            valid &= level_valid & inside
+        else:
+            guess *= 2
+    return guess, valid
+
+
+def pair_flows(frames, prev=None, levels=3, patch_size=20, window=4, iterations=3, min_eigenvalue=1.0):
+    """Average (x, y) flow in pixels per frame between consecutive frames.
+
+    frames is an (N, height, width) array; pair k compares frames[k - 1] (or
+    prev for k = 0) with frames[k], and the first row is zero without prev.
+    Flow is the median over the patches whose gradients are well conditioned
+    (smaller normal-matrix eigenvalue per pixel above min_eigenvalue, in squared
+    intensity units) and that stay inside the frame; pairs without any such
+    patch get zero flow like the firmware.  Returns an (N, 2) float32 array.
+    """
+    frames = np.asarray(frames)
+    if prev is not None:
+        frames = np.concatenate([np.asarray(prev)[None], frames])
+    flows = np.zeros((len(frames) - (prev is not None), 2), dtype=np.float32)
+    if len(frames) < 2:
+        return flows
+
+    # One pyramid per frame, shared by the pairs on both sides of it
+    pyramid = build_pyramids(frames, levels)
+    pyramid_prev = [tuple(array[:-1] for array in level) for level in pyramid]
+    pyramid_curr = [tuple(array[1:] for array in level) for level in pyramid]
+    centers = patch_centers(frames.shape[1], frames.shape[2], patch_size)
+    displacement, valid = _track(pyramid_prev, pyramid_curr, centers, window, iterations, min_eigenvalue)
+
+    # Median over the valid patches; invalid ones sort to the end as NaN
+    ordered = np.sort(np.where(valid[..., None], displacement, np.nan), axis=1)
+    n_valid = valid.sum(axis=1)[:, None, None]
+    lower = np.take_along_axis(ordered, np.maximum(n_valid - 1, 0) // 2, axis=1)
+    upper = np.take_along_axis(ordered, n_valid // 2, axis=1)
+    median = np.where(n_valid > 0, (lower + upper) / 2, 0.0)[:, 0]
+    flows[len(flows) - len(median):] = median
+    return flows
+
+
+def _chunk_flows(args):
+    frames, prev, kwargs = args
+    return pair_flows(frames, prev, **kwargs)
+
+
+def pyramidal_flow(frames, chunk_size=256, n_workers=1, **kwargs):
+    """pair_flows over a long recording, chunk_size frames at a time.
+
+    Each chunk also receives the last frame of the chunk before it, so the
+    result matches a single pair_flows call.  With n_workers > 1 the chunks are
+    processed in a process pool.  frames can be a FrameStore memory map; only
+    the frames of a chunk are read into memory for it.  kwargs go to pair_flows.
+    """
+    tasks = [(frames[start:start + chunk_size], frames[start - 1] if start else None, kwargs)
+             for start in range(0, len(frames), chunk_size)]
+    if n_workers > 1:
+        with ProcessPoolExecutor(n_workers) as pool:
+            results = list(pool.map(_chunk_flows, tasks))
+    else:
+        results = [_chunk_flows(task) for task in tasks]
+    return np.concatenate(results) if results else np.zeros((0, 2), dtype=np.float32)
+
+
+def flow_rate_series(flows, timestamps, fov, width):
+    """Optic flow in rad/s from pixel flow between frames stamped with timestamps (s).
+
+    fov is the horizontal field of view in radians spanned by the width pixels
+    the flow was computed on.  Returns a DataFrame with the timestamp and
+    optic_flow(rad/s) columns of the TinySense logs (x flow) plus
+    optic_flow_y(rad/s); the first frame, which has no predecessor, is zero.
+    """
+    flows = np.asarray(flows, dtype=np.float64)
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    dt = np.diff(timestamps, prepend=np.nan)
+    rate = np.divide(flows * (fov / width), dt[:, None], out=np.zeros_like(flows), where=dt[:, None] > 0)
+    return pd.DataFrame({"timestamp": timestamps, "optic_flow(rad/s)": rate[:, 0], "optic_flow_y(rad/s)": rate[:, 1]})
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Schema-driven CSV loaders for the TinySense, Crazyflie and mocap logs.
+
+Each source lists the columns the pipeline reads and their dtype, so pandas
+parses only those columns with no type inference.  Timestamps are Unix epoch
+seconds; every column is float64, which gives the same values as pd.read_csv
+with type inference.  Columns come back in schema order whatever their order
+in the file.  iter_flight_csv reads the same columns in blocks of rows for logs that do not
+fit in memory, and load_flight_log joins those blocks into one FlightLog.
+Both also read a source out of a flight archive (a .tsa file, see
+TinySense.archive) instead of a CSV.
+"""
+
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from TinySense.archive import FlightArchive, is_archive
+from TinySense.flight_log import FlightLog
+
+SCHEMAS = {
+    "tinysense": {
+        "timestamp": "float64",
+        "optic_flow(rad/s)": "float64",
+        "gyro(d/s)": "float64",
+        "z(m)": "float64",
+    },
+    # Every Crazyflie column is kept: the Kalman and plotting code index them by position
+    "crazyflie": {
+        "timestamp": "float64",
+        "px(m)": "float64",
+        "py(m)": "float64",
+        "pz(m)": "float64",
+        "lz(m)": "float64",
+        "vx(m/s)": "float64",
+        "theta_pitch(rad)": "float64",
+        "gyro_pitch_raw(rad/s)": "float64",
+        "gyro_pitch_filtered(rad/s)": "float64",
+        "omega_pitch(rad/s)": "float64",
+        "of_x(pixels/frame)": "float64",
+    },
+    "mocap": {
+        "Time": "float64",
+        "pose.position.y": "float64",
+        "pose.position.z": "float64",
+        "pose.orientation.x": "float64",
+        "pose.orientation.y": "float64",
+        "pose.orientation.z": "float64",
+        "pose.orientation.w": "float64",
+    },
+}
+
+
+def load_flight_csv(path, source):
+    """Loads the schema columns of one source's CSV with the time column named "timestamp"."""
+    schema = SCHEMAS[source]
+    data = pd.read_csv(path, header=0, usecols=list(schema), dtype=schema, engine="c")[list(schema)]
+    return data.rename(columns={data.columns[0]: "timestamp"})
+
+
+def iter_flight_csv(path, source, block_rows=100_000, columns=None):
+    """Yields the schema columns of one source's CSV in DataFrames of at most block_rows rows.
+
+    The frames are those of load_flight_csv split into blocks, index
+    included; columns restricts them to a subset of the schema (the time
+    column is always read).  An archive is read chunk by chunk, each split
+    into blocks of at most block_rows rows.
+    """
+    schema = SCHEMAS[source]
+    time_column = next(iter(schema))
+    names = [column for column in schema if columns is None or column == time_column or column in columns]
+    if is_archive(path):
+        row = 0
+        with FlightArchive(path) as archive:
+            for log in archive.iter_blocks(source, names):
+                for start in range(0, len(log), block_rows):
+                    part = log.rows(start, start + block_rows)
+                    block = pd.DataFrame(part.data, columns=part.columns, index=pd.RangeIndex(row, row + len(part)))
+                    row += len(part)
+                    yield block
+        return
+    dtypes = {column: schema[column] for column in names}
+    with pd.read_csv(path, header=0, usecols=names, dtype=dtypes, engine="c", chunksize=block_rows) as reader:
+        for block in reader:
+            if list(block.columns) != names:
+                block = block[names]  # usecols keeps the order of the file
+            yield block.rename(columns={time_column: "timestamp"})
+
+
+def load_flight_log(path, source, block_rows=100_000):
+    """Loads the schema columns of one source's CSV as a float64 FlightLog.
+
+    pd.read_csv holds several times the size of a log while parsing it; the
+    blocks of iter_flight_csv are copied into one column-major array
+    instead, so the peak stays near twice the log.  The values are those of
+    load_flight_csv.  Archives are read directly into the FlightLog.
+    """
+    if is_archive(path):
+        with FlightArchive(path) as archive:
+            return archive.read_window(source, columns=list(SCHEMAS[source])[1:])
+    blocks = deque(block.to_numpy(dtype="float64") for block in iter_flight_csv(path, source, block_rows))
+    columns = ["timestamp"] + list(SCHEMAS[source])[1:]
+    data = np.empty((sum(len(block) for block in blocks), len(columns)), dtype="float64", order="F")
+    row = 0
+    while blocks:
+        block = blocks.popleft()  # Released as soon as it is copied
+        data[row:row + len(block)] = block
+        row += len(block)
+    return FlightLog(data, columns)
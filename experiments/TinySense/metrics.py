@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized error metrics of the TinySense, Crazyflie and mocap estimates.
+
+source_channels gathers the vx (m/s), theta (degrees) and z (m) series of
+the three sources, sampled at the Crazyflie timestamps, as
+(..., channel, N) arrays; pair_errors turns them into one
+(..., pair, channel, N) array of the errors of every comparison pair (first
+source minus second) and error_statistics reduces it to RMS, MAE, bias and
+max error.  Leading axes are batch
+axes, so the estimates of thousands of sweep candidates are scored at once.
+Statistics are in CHANNEL_UNITS; pair_rms can give the theta RMS of chosen
+pairs in radians instead, as the paper reports TinySense against Crazyflie.
+
+rolling_rms computes windowed RMS from cumulative sums, and bootstrap_ci
+resamples with a multinomial count matrix, so every replicate is one matrix
+product instead of a Python loop.
+"""
+
+import numpy as np
+
+SOURCES = ("ts", "cf", "mocap")
+CHANNELS = ("vx", "theta", "altitude")
+PAIRS = (("ts", "mocap"), ("cf", "mocap"), ("ts", "cf"))
+STATISTICS = ("RMS", "MAE", "bias", "max")
+CHANNEL_UNITS = {"vx": "m/s", "theta": "deg", "altitude": "m"}
+
+
+def source_channels(cf_data, mocap, q, theta_unit="deg"):
+    """{source: (..., 3 channels, N)} arrays of SOURCES in CHANNELS order.
+
+    cf_data and mocap are Crazyflie-rate arrays as returned by
+    alignment.align (N rows); q holds the matching [theta, vx, z] observer
+    states with any batch axes in front, shape (..., N, 3).  Only the
+    TinySense channels carry the batch axes; the others broadcast.  theta
+    is in degrees, or in radians with theta_unit="rad".
+    """
+    angle = {"deg": np.degrees, "rad": np.asarray}[theta_unit]
+    q = np.asarray(q, dtype="float64")
+    return {"ts": np.stack([q[..., 1], -angle(q[..., 0]), q[..., 2]], axis=-2),
+            "cf": np.array([-cf_data[:, 5], angle(cf_data[:, 6]), cf_data[:, 3]]),
+            "mocap": np.array([mocap[:, 1], angle(mocap[:, 2]), mocap[:, 3]])}
+
+
+def pair_errors(channels, pairs=PAIRS):
+    """(..., pair, channel, N) errors, first source of each pair minus the second."""
+    return np.stack(np.broadcast_arrays(*[channels[a] - channels[b] for a, b in pairs]), axis=-3)
+
+
+def error_statistics(errors, statistics=STATISTICS):
+    """(..., statistic) RMS, MAE, bias and max absolute error over the last axis of errors.
+
+    statistics selects and orders a subset, e.g. ("RMS",) for sweeps.
+    """
+    reductions = {"RMS": lambda: np.sqrt(np.mean(errors * errors, axis=-1)),
+                  "MAE": lambda: np.mean(np.abs(errors), axis=-1),
+                  "bias": lambda: np.mean(errors, axis=-1),
+                  "max": lambda: np.max(np.abs(errors), axis=-1)}
+    return np.stack([reductions[name]() for name in statistics], axis=-1)
+
+
+def pair_rms(cf_data, mocap, q, pairs=PAIRS, radian_theta=()):
+    """(..., pair, channel) RMS errors in CHANNEL_UNITS, except theta of the radian_theta pairs in radians.
+
+    The arguments are those of source_channels.
+    """
+    rms = error_statistics(pair_errors(source_channels(cf_data, mocap, q), pairs), ("RMS",))[..., 0]
+    if radian_theta:
+        channels = source_channels(cf_data, mocap, q, theta_unit="rad")
+        theta = CHANNELS.index("theta")
+        for a, b in radian_theta:
+            errors = channels[a][..., theta, :] - channels[b][..., theta, :]
+            rms[..., pairs.index((a, b)), theta] = error_statistics(errors, ("RMS",))[..., 0]
+    return rms
+
+
+def metrics_table(statistics, pairs=PAIRS):
+    """Flat {"<pair>_<channel>_<statistic>": value} dict of (pair, channel, 4) statistics."""
+    return {f"{a}_{b}_{channel}_{name}": float(statistics[p, c, s])
+            for p, (a, b) in enumerate(pairs) for c, channel in enumerate(CHANNELS)
+            for s, name in enumerate(STATISTICS)}
+
+
+def error_metrics(cf_data, mocap, qest):
+    """metrics_table of downsample_to_cf output: every statistic of every channel and pair, in CHANNEL_UNITS."""
+    errors = pair_errors(source_channels(cf_data, mocap, qest[:, 1:]))
+    return metrics_table(error_statistics(errors))
+
+
+def rolling_rms(errors, window, times=None):
+    """RMS of errors over a trailing window ending at every sample.
+
+    window counts samples, or seconds when the sample times are given; the
+    first samples use the shorter window available.  Sums of squares come
+    from one cumulative sum, so the cost does not depend on the window.
+    """
+    errors = np.asarray(errors, dtype="float64")
+    n = errors.shape[-1]
+    cumulative = np.concatenate([np.zeros(errors.shape[:-1] + (1,)), np.cumsum(errors * errors, axis=-1)], axis=-1)
+    end = np.arange(1, n + 1)
+    if times is None:
+        start = np.maximum(end - int(window), 0)
+    else:
+        start = np.searchsorted(times, np.asarray(times) - window, side="right")
+    mean_square = (cumulative[..., end] - cumulative[..., start]) / (end - start)
+    return np.sqrt(np.maximum(mean_square, 0))  # Cancellation can leave tiny negatives
+
+
+def bootstrap_ci(errors, statistic="RMS", n_boot=1000, confidence=0.95, block=1, seed=None):
+    """Percentile bootstrap interval (low, high) of a statistic over the last axis of errors.
+
+    statistic is "RMS", "MAE" or "bias".  Samples are drawn in blocks of
+    block consecutive errors (moving-block bootstrap), which keeps the
+    autocorrelation of the error series; block=1 is the ordinary bootstrap
+    and block may be at most the series length.  Every replicate is a row of a multinomial count matrix, so all of them
+    are computed by one matrix product.
+    """
+    errors = np.asarray(errors, dtype="float64")
+    n = errors.shape[-1]
+    if not 1 <= block <= n:
+        raise ValueError(f"block must be between 1 and the {n} errors of a series, got {block}")
+    rng = np.random.default_rng(seed)
+    n_starts = n - block + 1
+    start_counts = rng.multinomial(int(np.ceil(n / block)), np.full(n_starts, 1 / n_starts), size=n_boot)
+    # Each drawn block start covers the block samples that follow it
+    counts = np.cumsum(np.concatenate([start_counts, np.zeros((n_boot, block - 1))], axis=1), axis=1)
+    counts[:, block:] -= np.cumsum(start_counts, axis=1)[:, :n - block]
+    counts /= counts.sum(axis=1, keepdims=True)
+
+    values = {"RMS": errors * errors, "MAE": np.abs(errors), "bias": errors}[statistic]
+    replicates = values.reshape(-1, n) @ counts.T
+    if statistic == "RMS":
+        replicates = np.sqrt(replicates)
+    low, high = np.quantile(replicates, [(1 - confidence) / 2, (1 + confidence) / 2], axis=-1)
+    return low.reshape(errors.shape[:-1]), high.reshape(errors.shape[:-1])
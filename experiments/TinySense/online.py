@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming form of the TinySense observer for live telemetry and long replays.
+
+OnlineEstimator keeps only the current state and the inputs of the last
+sample, so memory is constant and every sample costs one observer step.  It
+reproduces kalman_filter_from_1cm_optic sample for sample when fed the same
+preprocessed TinySense rows from the first one at or after time zero, starting
+from the batch filter's initial state as q0.  Like the batch filter, it
+replaces the barometric altitude by 0.01 m before 1.8 s.
+
+Repeated timestamps are resolved without looking ahead: the batch filter moves
+the last repeat to the midpoint with the next sample, so the estimator defers
+that half step until the next distinct timestamp arrives.  The state at every
+distinct timestamp therefore matches the batch filter exactly; only the
+estimate reported for the repeated sample itself is the unadvanced one.
+"""
+
+import numpy as np
+
+from TinySense.data_processing import DEFAULT_KALMAN_PARAMS, params_to_weights, state_space_model
+from TinySense.gain_cache import steady_state_gain
+
+# kalman_filter_from_1cm_optic ignores the pressure sensor before this time (s)
+# and uses this altitude (m) instead
+BARO_START = 1.8
+BARO_GROUND = 0.01
+
+
+class OnlineEstimator:
+    """Observer that is stepped one [timestamp, optic_flow, gyro, z] sample at a time."""
+
+    def __init__(self, params=DEFAULT_KALMAN_PARAMS, q0=(0, 0, 0), L=None, model=None):
+        """params is the 8-entry G/Q/R vector used to compute the gain unless L is given.
+
+        q0 is the initial [theta, vx, z] state; model overrides state_space_model().
+        """
+        A, B, C, D = state_space_model() if model is None else model
+        if L is None:
+            G, Q, R = params_to_weights(params)
+            L, _, _ = steady_state_gain(A, G, C, Q, R)
+
+        self.A, self.B, self.C, self.D = A, B, C, D
+        self.L = np.asarray(L, dtype="float64")
+        self.q0 = np.array(q0, dtype="float64")
+        self.reset()
+
+    def reset(self, q0=None):
+        """Forgets all samples and restarts from q0 (the constructor's q0 by default)."""
+        if q0 is not None:
+            self.q0 = np.array(q0, dtype="float64")
+        self.q = self.q0.copy()
+        self.t = None
+        self._inputs = None
+        self._split_inputs = None  # Inputs of the half step deferred by a repeated timestamp
+
+    def _advance(self, dt, inputs):
+        y, u = inputs
+        qhat = self.q.reshape([3, 1])
+        qdot = self.A @ qhat + self.B @ u + self.L @ (y - self.C @ qhat - self.D @ u)
+        self.q = (qhat + dt * qdot).reshape([3,])
+
+    def step(self, t, optic_flow, gyro, z):
+        """Adds one sample and returns the [theta, vx, z] estimate at time t."""
+        if t < BARO_START:
+            z = BARO_GROUND
+        inputs = (np.array([[optic_flow], [z]], dtype="float64"), np.array([[gyro]], dtype="float64"))
+
+        if self.t is None:
+            self.t = t
+        elif t == self.t:
+            # Defer the step into this sample until the next timestamp is known
+            self._split_inputs = self._inputs
+        else:
+            if self._split_inputs is not None:
+                midpoint = (self.t + t) / 2
+                self._advance(midpoint - self.t, self._split_inputs)
+                self.t = midpoint
+                self._split_inputs = None
+            self._advance(t - self.t, self._inputs)
+            self.t = t
+
+        self._inputs = inputs
+        return self.q.copy()
+
+
+def estimate_stream(samples, estimator=None, **kwargs):
+    """Yields (t, theta, vx, z) for every (t, optic_flow, gyro, z) sample of an iterable.
+
+    Creates an OnlineEstimator from kwargs unless one is given.
+    """
+    if estimator is None:
+        estimator = OnlineEstimator(**kwargs)
+    for t, optic_flow, gyro, z in samples:
+        theta, vx, altitude = estimator.step(t, optic_flow, gyro, z)
+        yield t, theta, vx, altitude
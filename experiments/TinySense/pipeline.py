@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed, incremental pipeline of the experiments workflow.
+
+A Pipeline is a DAG of named nodes.  Each node calls a function with the
+outputs of its input nodes followed by its keyword params, and its output
+is memoized on disk under a key that hashes
+
+* the node function's source code and the source of every TinySense module
+  it reaches (see cache.code_digest), plus an optional version string,
+* its params (arrays by content) and the content of any files it reads,
+* the keys of its input nodes,
+
+so a node reruns exactly when something upstream of it changed: editing
+interpolate_mocap reruns every interpolate node and everything after it.  Nodes whose
+inputs are ready run concurrently in a process pool.
+
+experiment_pipeline declares the workflow of main.py for every flight:
+
+    <name>/preprocess -> <name>/interpolate -> <name>/kalman -> <name>/downsample -> <name>/metrics
+                                                                                         \\-> summary
+
+Changing the Kalman params reruns only the kalman, downsample, metrics and
+summary nodes; sync (see TinySense.sync) reruns every node.  From the experiments folder:
+
+    python -m TinySense.pipeline --workers 4
+"""
+
+import argparse
+import hashlib
+import os
+import pickle
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+from TinySense.cache import code_digest, file_digest
+from TinySense.data_processing import (DEFAULT_KALMAN_PARAMS, interpolate_mocap, kalman_filter_from_1cm_optic,
+                                       preprocess_data)
+from TinySense.sync import SYNC_MODES
+from TinySense.runner import RMS_COLUMNS, discover_experiments, downsample_to_cf, rms_errors
+
+DEFAULT_PIPELINE_DIR = os.path.join(os.environ.get("TINYSENSE_CACHE_DIR", ".tinysense_cache"), "pipeline")
+
+
+def _feed(digest, value):
+    """Feeds a parameter value into digest: arrays by content, containers item by item."""
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        digest.update(f"{value.dtype.str}{value.shape}".encode())
+        digest.update(value.tobytes())
+    elif isinstance(value, dict):
+        digest.update(f"dict{len(value)}".encode())
+        for name in sorted(value):
+            digest.update(repr(name).encode())
+            _feed(digest, value[name])
+    elif isinstance(value, (tuple, list)):
+        digest.update(f"{type(value).__name__}{len(value)}".encode())
+        for item in value:
+            _feed(digest, item)
+    else:
+        digest.update(repr(value).encode())
+
+
+def _call(func, inputs, params):
+    return func(*inputs, **params)
+
+
+class Pipeline:
+    """DAG of memoized nodes; see the module docstring."""
+
+    def __init__(self, cache_dir=DEFAULT_PIPELINE_DIR):
+        self.cache_dir = cache_dir
+        self.nodes = {}
+        # Outcome of every node in the last run: "computed" or "cached"
+        self.last_run = {}
+
+    def add(self, name, func, inputs=(), params=None, files=(), version=""):
+        """Declares node name = func(*outputs of inputs, **params).
+
+        files are paths the node reads; their content is part of its key, as
+        is the source of func and of the TinySense modules it reaches (see
+        cache.code_digest).  Bump version only for changes the key cannot
+        see, such as upgrading NumPy or SciPy or editing a file read outside
+        files.
+        """
+        if name in self.nodes:
+            raise ValueError(f"Duplicate node: {name}")
+        missing = [node for node in inputs if node not in self.nodes]
+        if missing:
+            raise ValueError(f"Node {name} depends on undeclared nodes {missing}")
+        self.nodes[name] = {"func": func, "inputs": tuple(inputs), "params": dict(params or {}),
+                            "files": tuple(files), "version": version}
+        return name
+
+    def keys(self):
+        """Content key of every node; nodes are declared after their inputs, so one pass suffices."""
+        keys = {}
+        code = {}
+        for name, node in self.nodes.items():
+            if node["func"] not in code:
+                code[node["func"]] = code_digest(node["func"])
+            digest = hashlib.sha256()
+            digest.update(code[node["func"]].encode())
+            _feed(digest, (node["version"], node["params"], [file_digest(path) for path in node["files"]],
+                           [keys[parent] for parent in node["inputs"]]))
+            keys[name] = digest.hexdigest()
+        return keys
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def _load(self, key):
+        with open(self._path(key), "rb") as file:
+            return pickle.load(file)
+
+    def _store(self, key, value):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as file:
+            pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(key))
+
+    def run(self, targets=None, n_workers=1, verbose=False):
+        """Outputs of targets (default every node), computing only nodes without a cached output."""
+        targets = list(self.nodes) if targets is None else list(targets)
+        keys = self.keys()
+
+        # Walk up from the targets: missing outputs are computed, cached ones only loaded if needed
+        to_compute, to_load = [], set(targets)
+        stack = list(targets)
+        while stack:
+            name = stack.pop()
+            if name in to_compute or os.path.exists(self._path(keys[name])):
+                continue
+            to_compute.append(name)
+            to_load.update(self.nodes[name]["inputs"])
+            stack.extend(self.nodes[name]["inputs"])
+        order = {name: index for index, name in enumerate(self.nodes)}
+        to_compute.sort(key=order.get)
+
+        values = {name: self._load(keys[name]) for name in to_load if name not in to_compute}
+        self.last_run = dict.fromkeys(values, "cached")
+        pending = list(to_compute)
+        executor = ProcessPoolExecutor(n_workers) if n_workers > 1 and len(pending) > 1 else None
+        running = {}
+        try:
+            while pending or running:
+                for name in [name for name in pending if all(parent in values for parent in self.nodes[name]["inputs"])]:
+                    pending.remove(name)
+                    node = self.nodes[name]
+                    inputs = [values[parent] for parent in node["inputs"]]
+                    if executor is None:
+                        start = time.perf_counter()
+                        self._finish(name, keys[name], _call(node["func"], inputs, node["params"]), values, verbose,
+                                     start)
+                    else:
+                        running[executor.submit(_call, node["func"], inputs, node["params"])] = (name, time.perf_counter())
+                if running:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name, start = running.pop(future)
+                        self._finish(name, keys[name], future.result(), values, verbose, start)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+        return {name: values[name] for name in targets}
+
+    def _finish(self, name, key, value, values, verbose, start):
+        self._store(key, value)
+        values[name] = value
+        self.last_run[name] = "computed"
+        if verbose:
+            print(f"  computed {name} in {time.perf_counter() - start:.3f} s")
+
+
+def _interpolate(preprocessed):
+    cf_data, ts_data, mocap_data = preprocessed
+    return cf_data, ts_data, interpolate_mocap(mocap_data)
+
+
+def _kalman(loaded, engine, params):
+    cf_data, ts_data, mocap_data = loaded
+    return kalman_filter_from_1cm_optic(cf_data, ts_data, mocap_data, engine=engine, params=params)
+
+
+def _downsample(kalman):
+    cf_data, ts_data, mocap_data, q_est, zero_idx, zero_idx_cf, zero_idx_mocap, K = kalman
+    return downsample_to_cf(cf_data, mocap_data, q_est, zero_idx, zero_idx_cf, zero_idx_mocap)
+
+
+def _metrics(downsampled):
+    return rms_errors(*downsampled)
+
+
+def _summary(*metrics):
+    """Mean and standard deviation over the flights of every RMS column."""
+    table = pd.DataFrame(list(metrics))
+    return {column: (float(np.mean(table[column])), float(np.std(table[column]))) for column in RMS_COLUMNS}
+
+
+def experiment_pipeline(experiments, params=DEFAULT_KALMAN_PARAMS, engine="loop", cache_dir=DEFAULT_PIPELINE_DIR,
+                        sync=None):
+    """Pipeline of main.py over experiments (discover_experiments records)."""
+    pipeline = Pipeline(cache_dir)
+    for experiment in experiments:
+        name = experiment["name"]
+        pipeline.add(f"{name}/preprocess", preprocess_data,
+                     params={"cf_path": experiment["cf"], "ts_path": experiment["ts"],
+                             "mocap_path": experiment["mocap"], "experiment_num": experiment["experiment_num"],
+                             "sync": sync},
+                     files=(experiment["cf"], experiment["ts"], experiment["mocap"]))
+        pipeline.add(f"{name}/interpolate", _interpolate, [f"{name}/preprocess"])
+        pipeline.add(f"{name}/kalman", _kalman, [f"{name}/interpolate"],
+                     params={"engine": engine, "params": np.asarray(params, dtype="float64")})
+        pipeline.add(f"{name}/downsample", _downsample, [f"{name}/kalman"])
+        pipeline.add(f"{name}/metrics", _metrics, [f"{name}/downsample"])
+    pipeline.add("summary", _summary, [f"{experiment['name']}/metrics" for experiment in experiments])
+    return pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the experiments pipeline, reusing unchanged results.")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--engine", choices=("loop", "scan"), default="loop")
+    parser.add_argument("--params", type=float, nargs=8, default=list(DEFAULT_KALMAN_PARAMS),
+                        help="Kalman G/Q/R parameters")
+    parser.add_argument("--cache-dir", default=DEFAULT_PIPELINE_DIR)
+    parser.add_argument("--sync", choices=SYNC_MODES, help="refine the clock alignment to the mocap")
+    args = parser.parse_args()
+
+    pipeline = experiment_pipeline(discover_experiments(args.data_dir, skip_incomplete=True), args.params, args.engine, args.cache_dir,
+                                   args.sync)
+    start = time.perf_counter()
+    summary = pipeline.run(["summary"], args.workers, verbose=True)["summary"]
+    computed = sum(outcome == "computed" for outcome in pipeline.last_run.values())
+    print(f"{computed} of {len(pipeline.nodes)} nodes computed in {time.perf_counter() - start:.2f} s")
+    for column, (mean, std) in summary.items():
+        print(f"{column}: {mean:.3f} +/- {std:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,17 +5,148 @@ Created on Sun Jun 23 00:45:23 2024
 @author: zhita
 """
 
+import os
+import weakref
+
 import matplotlib.pyplot as plt
 from cycler import cycler
 import matplotlib as mpl
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import numpy as np
+from TinySense.instrument import instrumented
 
 mpl.rcParams['pdf.fonttype'] = 42
 
 # Get the default color cycle
 default_colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
 
+# Lines longer than this many samples per pixel column of their axes are
+# decimated before drawing; see configure()
+_config = {"decimate": True, "samples_per_pixel": 2}
+
+# Figures whose lines and titles are updated in place when drawn again;
+# see FigureBatch
+_reuse_figures = weakref.WeakSet()
+
+
+def configure(decimate=None, samples_per_pixel=None):
+    """Turns line decimation on or off and sets its resolution (buckets per axes pixel)."""
+    if decimate is not None:
+        _config["decimate"] = decimate
+    if samples_per_pixel is not None:
+        _config["samples_per_pixel"] = samples_per_pixel
+
+
+def batch_mode():
+    """Switches pyplot to the non-interactive Agg backend for headless batch rendering."""
+    plt.switch_backend("Agg")
+
+
+def minmax_decimate(x, y, buckets):
+    """Subset of a line that draws the same at a resolution of buckets columns.
+
+    x is split into buckets equal intervals and the first, last, smallest and
+    largest sample of each are kept in x order (the M4 scheme), so peaks and
+    steps survive unlike with striding.  x must be non-decreasing; other
+    lines, and lines already short enough, are returned unchanged.
+    """
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    if len(x) <= 4 * buckets or not np.all(x[1:] >= x[:-1]):
+        return x, y
+    starts = np.unique(np.searchsorted(x, np.linspace(x[0], x[-1], buckets + 1)[:-1]))
+    ends = np.append(starts[1:], len(x)) - 1
+    segment = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(x))))
+    keep = [starts, ends]
+    for reduce in (np.fmin, np.fmax):
+        extreme = reduce.reduceat(y, starts)
+        hits = np.flatnonzero(y == extreme[segment])
+        keep.append(hits[np.unique(segment[hits], return_index=True)[1]])  # First hit per bucket
+    index = np.unique(np.concatenate(keep))
+    return x[index], y[index]
+
+
+def _line(ax, x, y, **style):
+    """ax.plot(x, y, **style), decimated to the axes width.
+
+    On the axes of a FigureBatch, drawing a new experiment into axes that
+    already hold a line labelled style["label"] updates that line's data
+    instead of adding another one.
+    """
+    if _config["decimate"]:
+        x, y = minmax_decimate(x, y, int(np.ceil(ax.bbox.width * _config["samples_per_pixel"])))
+    if ax.figure not in _reuse_figures:
+        return ax.plot(x, y, **style)[0]
+    key = f"line:{style.get('label')}"
+    for line in ax.lines:
+        if line.get_gid() == key:
+            line.set_data(x, y)
+            ax.relim()
+            ax.autoscale_view()
+            return line
+    return ax.plot(x, y, gid=key, **style)[0]
+
+
+def _title(ax, title):
+    """Column title above ax, reusing the existing one on the axes of a FigureBatch."""
+    reuse = ax.figure in _reuse_figures
+    if reuse:
+        for text in ax.texts:
+            if text.get_gid() == "title":
+                text.set_text(title)
+                return text
+    return ax.annotate(title, xy=(0.5, 1.1), xytext=(0, 5), xycoords='axes fraction', textcoords='offset points',
+                       ha='center', va='baseline', fontsize=14, fontweight='bold', gid="title" if reuse else None)
+
+
+def save_figure(fig, path, formats=("png",), dpi=None):
+    """Saves fig as path.<format> for each format from a single layout and Agg draw.
+
+    The PNG is written from the Agg buffer of that draw; vector formats such
+    as pdf render the already decimated lines again with their own backend.
+    """
+    if dpi is not None:
+        fig.set_dpi(dpi)
+    canvas = fig.canvas if isinstance(fig.canvas, FigureCanvasAgg) else FigureCanvasAgg(fig)
+    fig.tight_layout()
+    canvas.draw()
+    paths = []
+    for fmt in formats:
+        output = f"{path}.{fmt}"
+        if fmt == "png":
+            plt.imsave(output, np.asarray(canvas.buffer_rgba()), dpi=fig.dpi)
+        else:
+            fig.savefig(output, format=fmt)
+        paths.append(output)
+    return paths
+
+
+class FigureBatch:
+    """A pyplot-free Agg figure that renders one experiment after another.
+
+    On these axes, and only these, the plotting functions update the lines
+    and titles already on axs instead of adding new ones, so every
+    experiment reuses the figure, axes and artists of the first one:
+
+        batch = FigureBatch(3, 1, figsize=(8, 12))
+        for name, (cf_data, ts_data, mocap_data) in flights.items():
+            plot_data_all_sensors_bw(cf_data, ts_data, mocap_data, batch.axs, 0, name)
+            batch.save(os.path.join("figures", name), formats=("png", "pdf"))
+    """
+
+    def __init__(self, rows=3, cols=1, figsize=(8, 12), dpi=100):
+        self.fig = Figure(figsize=figsize, dpi=dpi)
+        FigureCanvasAgg(self.fig)
+        self.axs = self.fig.subplots(rows, cols, squeeze=False)
+        _reuse_figures.add(self.fig)
+
+    def save(self, path, formats=("png",)):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        return save_figure(self.fig, path, formats)
+
 
+@instrumented()
 def plot_data_single_exp(cf_data, ts_data, mocap_data, experiment_num):
     fig, axs = plt.subplots(3, 1, figsize=(10, 8))
     ylabels = ["$vx$ (m/s)", r"$\theta$ $(rad)$", "$z$ $(m)$"]
@@ -44,6 +175,7 @@ def plot_data_single_exp(cf_data, ts_data, mocap_data, experiment_num):
     plt.show()
 
 
+@instrumented()
 def plot_data_all_sensors_bw(cf_data, ts_data, mocap_data, axs, col, title):
     # ylabels = ["$vx$ (m/s)", r"$\theta$ $(rad)$", "$z$ $(m)$"]
     YLIM_GYRO = [-5, 5]
@@ -51,25 +183,25 @@ def plot_data_all_sensors_bw(cf_data, ts_data, mocap_data, axs, col, title):
     YLIM_ALTITUDE = [-3.0, 1.5]
 
     # Plot gyro
-    axs[0, col].plot(cf_data["timestamp"], cf_data["gyro_pitch_filtered(rad/s)"], linewidth="5", color="lightgrey", label="Crazyflie")
-    axs[0, col].plot(ts_data["timestamp"], ts_data["gyro(d/s)"], color="black", label="TinySense")
+    _line(axs[0, col], cf_data["timestamp"], cf_data["gyro_pitch_filtered(rad/s)"], linewidth="5", color="lightgrey", label="Crazyflie")
+    _line(axs[0, col], ts_data["timestamp"], ts_data["gyro(d/s)"], color="black", label="TinySense")
     # axs[0, col].set_ylabel("Angular Velocity(rad/s)")
     axs[0, col].set_ylim(YLIM_GYRO)
     # axs[0, col].legend(loc='upper left')
     # axs[0, col].legend(loc='lower right')
     
     # Plot optic flow
-    axs[1, col].plot(cf_data["timestamp"], cf_data["of_x(pixels/frame)"], linewidth="5", color = "lightgrey", label="Crazyflie")
-    axs[1, col].plot(ts_data["timestamp"], ts_data["optic_flow(rad/s)"], color = "black", label="TinySense")
+    _line(axs[1, col], cf_data["timestamp"], cf_data["of_x(pixels/frame)"], linewidth="5", color = "lightgrey", label="Crazyflie")
+    _line(axs[1, col], ts_data["timestamp"], ts_data["optic_flow(rad/s)"], color = "black", label="TinySense")
     # axs[1, col].set_ylabel("Optical Flow (pixels/frame)")
     axs[1, col].set_ylim(YLIM_OPTIC_FLOW)
     # axs[1, col].legend(loc='upper left')
     # axs[1, col].legend()
     
     # Plot altitude measurements
-    axs[2, col].plot(cf_data["timestamp"], cf_data["pz(m)"], linewidth="5", color="lightgrey", label="Crazyflie")
-    axs[2, col].plot(ts_data["timestamp"], ts_data["z(m)"], color = "black", label="TinySense")
-    axs[2, col].plot(mocap_data["timestamp"], mocap_data["z(m)"], linestyle="dashed", color = "black", linewidth="3", label="Mocap")
+    _line(axs[2, col], cf_data["timestamp"], cf_data["pz(m)"], linewidth="5", color="lightgrey", label="Crazyflie")
+    _line(axs[2, col], ts_data["timestamp"], ts_data["z(m)"], color = "black", label="TinySense")
+    _line(axs[2, col], mocap_data["timestamp"], mocap_data["z(m)"], linestyle="dashed", color = "black", linewidth="3", label="Mocap")
     # axs[2, col].set_ylabel("Altitude (m)")
     axs[2, col].set_ylim(YLIM_ALTITUDE)
     # axs[2, col].legend(loc='upper left')
@@ -101,10 +233,9 @@ def plot_data_all_sensors_bw(cf_data, ts_data, mocap_data, axs, col, title):
     axs[1, col].set_xticks([])
     axs[2, col].set_xlabel(r"Time $t$ (s)")
     # Add the column title (a), (b), (c)
-    axs[0, col].annotate(title, xy=(0.5, 1.1), xytext=(0, 5),
-                         xycoords='axes fraction', textcoords='offset points',
-                         ha='center', va='baseline', fontsize=14, fontweight='bold')
+    _title(axs[0, col], title)
 
+@instrumented()
 def plot_data_all_sensors_bw_without_vertical_axis(cf_data, ts_data, mocap_data, axs, col, title):
     # ylabels = ["$vx$ (m/s)", r"$\theta$ $(rad)$", "$z$ $(m)$"]
     YLIM_GYRO = [-5, 5]
@@ -112,24 +243,24 @@ def plot_data_all_sensors_bw_without_vertical_axis(cf_data, ts_data, mocap_data,
     YLIM_ALTITUDE = [-2.8, 1.5]
 
     # Plot gyro
-    axs[0, col].plot(cf_data["timestamp"], cf_data["gyro_pitch_filtered(rad/s)"], linewidth="5", color="lightgrey", label="Crazyflie")
-    axs[0, col].plot(ts_data["timestamp"], ts_data["gyro(d/s)"], color="black", label="Tinysense")
+    _line(axs[0, col], cf_data["timestamp"], cf_data["gyro_pitch_filtered(rad/s)"], linewidth="5", color="lightgrey", label="Crazyflie")
+    _line(axs[0, col], ts_data["timestamp"], ts_data["gyro(d/s)"], color="black", label="Tinysense")
     # axs[0, col].set_ylabel("Angular Velocity(rad/s)")
     axs[0, col].set_ylim(YLIM_GYRO)
     axs[0, col].legend(loc='upper left')
     
     # Plot optic flow
-    axs[1, col].plot(cf_data["timestamp"], cf_data["of_x(pixels/frame)"], linewidth="5", color = "lightgrey", label="Crazyflie")
-    axs[1, col].plot(ts_data["timestamp"], ts_data["optic_flow(rad/s)"], color = "black", label="Tinysense")
+    _line(axs[1, col], cf_data["timestamp"], cf_data["of_x(pixels/frame)"], linewidth="5", color = "lightgrey", label="Crazyflie")
+    _line(axs[1, col], ts_data["timestamp"], ts_data["optic_flow(rad/s)"], color = "black", label="Tinysense")
     # axs[1, col].set_ylabel("Optical Flow (pixels/frame)")
     axs[1, col].set_ylim(YLIM_OPTIC_FLOW)
     axs[1, col].legend(loc='upper left')
     # axs[1, col].legend()
     
     # Plot altitude measurements
-    axs[2, col].plot(cf_data["timestamp"], cf_data["pz(m)"], linewidth="5", color="lightgrey", label="Crazyflie")
-    axs[2, col].plot(ts_data["timestamp"], ts_data["z(m)"], color = "black", label="Tinysense")
-    axs[2, col].plot(mocap_data["timestamp"], mocap_data["z(m)"], linestyle="dashed", color = "black", linewidth="3", label="Mocap")
+    _line(axs[2, col], cf_data["timestamp"], cf_data["pz(m)"], linewidth="5", color="lightgrey", label="Crazyflie")
+    _line(axs[2, col], ts_data["timestamp"], ts_data["z(m)"], color = "black", label="Tinysense")
+    _line(axs[2, col], mocap_data["timestamp"], mocap_data["z(m)"], linestyle="dashed", color = "black", linewidth="3", label="Mocap")
     # axs[2, col].set_ylabel("Altitude (m)")
     axs[2, col].set_ylim(YLIM_ALTITUDE)
     axs[2, col].legend(loc='upper left')
@@ -138,10 +269,9 @@ def plot_data_all_sensors_bw_without_vertical_axis(cf_data, ts_data, mocap_data,
         ax.set_xlabel("Time (s)")
 
     # Add the column title (a), (b), (c)
-    axs[0, col].annotate(title, xy=(0.5, 1.1), xytext=(0, 5),
-                          xycoords='axes fraction', textcoords='offset points',
-                          ha='center', va='baseline', fontsize=14, fontweight='bold')
+    _title(axs[0, col], title)
 
+@instrumented()
 def plot_estimates_all(cf_data, ts_data, mocap_data, q_est, axs, col, title, zero_idx, zero_idx_cf, zero_idx_mocap):
     
     YLIM_VX = [-1.5, 1.5]
@@ -150,31 +280,31 @@ def plot_estimates_all(cf_data, ts_data, mocap_data, q_est, axs, col, title, zer
     
     
     # Plot vx
-    axs[0, col].plot(cf_data[zero_idx_cf:, 0], -cf_data[zero_idx_cf:, 5], linewidth="5", color="lightgrey", label="Crazyflie")
+    _line(axs[0, col], cf_data[zero_idx_cf:, 0], -cf_data[zero_idx_cf:, 5], linewidth="5", color="lightgrey", label="Crazyflie")
     # axs[0, col].plot(ts_data[:, 0], q_est[:, 2], color="black", label="Tinysense")
     # axs[0, col].plot(q_est[:, 0], q_est[:, 2], color="black", label="Tinysense")
-    axs[0, col].plot(q_est[zero_idx:, 0], q_est[zero_idx:, 2], color="black", label="TinySense")
-    axs[0, col].plot(mocap_data[zero_idx_mocap:, 0], mocap_data[zero_idx_mocap:, 1], linestyle="dashed", color="black", label="Mocap")
+    _line(axs[0, col], q_est[zero_idx:, 0], q_est[zero_idx:, 2], color="black", label="TinySense")
+    _line(axs[0, col], mocap_data[zero_idx_mocap:, 0], mocap_data[zero_idx_mocap:, 1], linestyle="dashed", color="black", label="Mocap")
     # axs[0, col].set_ylabel("Velocity vx (m/s)")
     axs[0, col].set_ylim(YLIM_VX)
     # axs[0, col].legend(loc='upper left')
     
     # Plot theta
-    axs[1, col].plot(cf_data[zero_idx_cf:, 0], np.degrees(cf_data[zero_idx_cf:, 6]), linewidth="5", color="lightgrey", label="Crazyflie")
+    _line(axs[1, col], cf_data[zero_idx_cf:, 0], np.degrees(cf_data[zero_idx_cf:, 6]), linewidth="5", color="lightgrey", label="Crazyflie")
     # axs[1, col].plot(ts_data[:, 0], -q_est[:, 1], color="black", label="Tinysense")
     # axs[1, col].plot(q_est[:, 0], -q_est[:, 1], color="black", label="Tinysense")
-    axs[1, col].plot(q_est[zero_idx:, 0], -np.degrees(q_est[zero_idx:, 1]), color="black", label="TinySense")
-    axs[1, col].plot(mocap_data[zero_idx_mocap:, 0], np.degrees(mocap_data[zero_idx_mocap:, 2]), linestyle="dashed", color="black", label="Mocap")
+    _line(axs[1, col], q_est[zero_idx:, 0], -np.degrees(q_est[zero_idx:, 1]), color="black", label="TinySense")
+    _line(axs[1, col], mocap_data[zero_idx_mocap:, 0], np.degrees(mocap_data[zero_idx_mocap:, 2]), linestyle="dashed", color="black", label="Mocap")
     # axs[1, col].set_ylabel("Pitch angle (rad)")
     axs[1, col].set_ylim(YLIM_THETA)
     # axs[1, col].legend(loc='upper left')
     
     # Plot altitude estimates
-    axs[2, col].plot(cf_data[zero_idx_cf:, 0], cf_data[zero_idx_cf:, 3], linewidth="5", color="lightgrey", label="Crazyflie")
+    _line(axs[2, col], cf_data[zero_idx_cf:, 0], cf_data[zero_idx_cf:, 3], linewidth="5", color="lightgrey", label="Crazyflie")
     # axs[2, col].plot(ts_data[:, 0], q_est[:, 3], color="black", label="Tinysense")
     # axs[2, col].plot(q_est[:, 0], q_est[:, 3], color="black", label="Tinysense")
-    axs[2, col].plot(q_est[zero_idx:, 0], q_est[zero_idx:, 3], color="black", label="TinySense")
-    axs[2, col].plot(mocap_data[zero_idx_mocap:, 0], mocap_data[zero_idx_mocap:, 3], linestyle="dashed", color="black", label="Mocap")
+    _line(axs[2, col], q_est[zero_idx:, 0], q_est[zero_idx:, 3], color="black", label="TinySense")
+    _line(axs[2, col], mocap_data[zero_idx_mocap:, 0], mocap_data[zero_idx_mocap:, 3], linestyle="dashed", color="black", label="Mocap")
     # axs[2, col].set_ylabel("Altitude (m)")
     axs[2, col].set_ylim(YLIM_ALTITUDE)
     # axs[2, col].legend(loc='upper left')
@@ -207,10 +337,9 @@ def plot_estimates_all(cf_data, ts_data, mocap_data, q_est, axs, col, title, zer
     #                      ha='center', va='baseline', fontsize=14, fontweight='bold')
 
 
-    axs[0, col].annotate(title, xy=(0.5, 1.1), xytext=(0, 5),
-                         xycoords='axes fraction', textcoords='offset points',
-                         ha='center', va='baseline', fontsize=14, fontweight='bold')
+    _title(axs[0, col], title)
     
+@instrumented()
 def plot_estimates_all_without_vertical_axis(cf_data, ts_data, mocap_data, q_est, axs, col, title):
     
     YLIM_VX = [-1.5, 1.5]
@@ -219,25 +348,25 @@ def plot_estimates_all_without_vertical_axis(cf_data, ts_data, mocap_data, q_est
     
     
     # Plot vx
-    axs[0, col].plot(cf_data[:, 0], -cf_data[:, 5], linewidth="5", color="lightgrey", label="Crazyflie")
-    axs[0, col].plot(ts_data[:, 0], q_est[:, 2], color="black", label="Tinysense")
-    axs[0, col].plot(mocap_data[:, 0], mocap_data[:, 1], linestyle="dashed", color="black", label="Mocap")
+    _line(axs[0, col], cf_data[:, 0], -cf_data[:, 5], linewidth="5", color="lightgrey", label="Crazyflie")
+    _line(axs[0, col], ts_data[:, 0], q_est[:, 2], color="black", label="Tinysense")
+    _line(axs[0, col], mocap_data[:, 0], mocap_data[:, 1], linestyle="dashed", color="black", label="Mocap")
     # axs[0, col].set_ylabel("Velocity vx (m/s)")
     axs[0, col].set_ylim(YLIM_VX)
     axs[0, col].legend(loc='upper left')
     
     # Plot theta
-    axs[1, col].plot(cf_data[:, 0], cf_data[:, 6], linewidth="5", color="lightgrey", label="Crazyflie")
-    axs[1, col].plot(ts_data[:, 0], -q_est[:, 1], color="black", label="Tinysense")
-    axs[1, col].plot(mocap_data[:, 0], mocap_data[:, 2], linestyle="dashed", color="black", label="Mocap")
+    _line(axs[1, col], cf_data[:, 0], cf_data[:, 6], linewidth="5", color="lightgrey", label="Crazyflie")
+    _line(axs[1, col], ts_data[:, 0], -q_est[:, 1], color="black", label="Tinysense")
+    _line(axs[1, col], mocap_data[:, 0], mocap_data[:, 2], linestyle="dashed", color="black", label="Mocap")
     # axs[1, col].set_ylabel("Pitch angle (rad)")
     axs[1, col].set_ylim(YLIM_THETA)
     axs[1, col].legend(loc='upper left')
     
     # Plot altitude estimates
-    axs[2, col].plot(cf_data[:, 0], cf_data[:, 3], linewidth="5", color="lightgrey", label="Crazyflie")
-    axs[2, col].plot(ts_data[:, 0], q_est[:, 3], color="black", label="Tinysense")
-    axs[2, col].plot(mocap_data[:, 0], mocap_data[:, 3], linestyle="dashed", color="black", label="Mocap")
+    _line(axs[2, col], cf_data[:, 0], cf_data[:, 3], linewidth="5", color="lightgrey", label="Crazyflie")
+    _line(axs[2, col], ts_data[:, 0], q_est[:, 3], color="black", label="Tinysense")
+    _line(axs[2, col], mocap_data[:, 0], mocap_data[:, 3], linestyle="dashed", color="black", label="Mocap")
     # axs[2, col].set_ylabel("Altitude (m)")
     axs[2, col].set_ylim(YLIM_ALTITUDE)
     axs[2, col].legend(loc='upper left')
@@ -246,10 +375,9 @@ def plot_estimates_all_without_vertical_axis(cf_data, ts_data, mocap_data, q_est
         ax.set_xlabel("Timestamp")
 
     # Add the column title (a), (b), (c)
-    axs[0, col].annotate(title, xy=(0.5, 1.1), xytext=(0, 5),
-                          xycoords='axes fraction', textcoords='offset points',
-                          ha='center', va='baseline', fontsize=14, fontweight='bold')
+    _title(axs[0, col], title)
     
+@instrumented()
 def plot_data_all_sensors_colored(cf_data, ts_data, mocap_data, axs, col, title):
     ylabels = ["$vx$ (m/s)", r"$\theta$ $(rad)$", "$z$ $(m)$"]
     YLIM_GYRO = [-5, 5]
@@ -257,23 +385,23 @@ def plot_data_all_sensors_colored(cf_data, ts_data, mocap_data, axs, col, title)
     YLIM_ALTITUDE = [-1.1, 1.3]
 
     # Plot gyro
-    axs[0, col].plot(cf_data["timestamp"], cf_data["gyro_pitch_filtered(rad/s)"], linewidth="4", label="Crazyflie Gyro")
-    axs[0, col].plot(ts_data["timestamp"], ts_data["gyro(d/s)"], label="Tinysense Gyro")
+    _line(axs[0, col], cf_data["timestamp"], cf_data["gyro_pitch_filtered(rad/s)"], linewidth="4", label="Crazyflie Gyro")
+    _line(axs[0, col], ts_data["timestamp"], ts_data["gyro(d/s)"], label="Tinysense Gyro")
     axs[0, col].set_ylabel("Gyro Reading (rad/s)")
     axs[0, col].set_ylim(YLIM_GYRO)
     axs[0, col].legend()
     
     # Plot optic flow
-    axs[1, col].plot(cf_data["timestamp"], cf_data["of_x(pixels/frame)"], linewidth="4", label="Crazyflie Optic Flow")
-    axs[1, col].plot(ts_data["timestamp"], ts_data["optic_flow(rad/s)"], label="Tinysense Optic Flow")
+    _line(axs[1, col], cf_data["timestamp"], cf_data["of_x(pixels/frame)"], linewidth="4", label="Crazyflie Optic Flow")
+    _line(axs[1, col], ts_data["timestamp"], ts_data["optic_flow(rad/s)"], label="Tinysense Optic Flow")
     axs[1, col].set_ylabel("Optical Flow (pixels/frame)")
     axs[1, col].set_ylim(YLIM_OPTIC_FLOW)
     axs[1, col].legend()
     
     # Plot altitude measurements
-    axs[2, col].plot(cf_data["timestamp"], cf_data["pz(m)"], linewidth="4", label="Crazyflie Altitude")
-    axs[2, col].plot(ts_data["timestamp"], ts_data["z(m)"], label="Tinysense Altitude")
-    axs[2, col].plot(mocap_data["timestamp"], mocap_data["z(m)"], linestyle="dashed", linewidth="3", label="Mocap Altitude")
+    _line(axs[2, col], cf_data["timestamp"], cf_data["pz(m)"], linewidth="4", label="Crazyflie Altitude")
+    _line(axs[2, col], ts_data["timestamp"], ts_data["z(m)"], label="Tinysense Altitude")
+    _line(axs[2, col], mocap_data["timestamp"], mocap_data["z(m)"], linestyle="dashed", linewidth="3", label="Mocap Altitude")
     axs[2, col].set_ylabel("Altitude (m)")
     axs[2, col].set_ylim(YLIM_ALTITUDE)
     axs[2, col].legend()
@@ -282,9 +410,7 @@ def plot_data_all_sensors_colored(cf_data, ts_data, mocap_data, axs, col, title)
         ax.set_xlabel("Timestamp")
     
     # Add the column title (a), (b), (c)
-    axs[0, col].annotate(title, xy=(0.5, 1.1), xytext=(0, 5),
-                          xycoords='axes fraction', textcoords='offset points',
-                          ha='center', va='baseline', fontsize=14, fontweight='bold')
+    _title(axs[0, col], title)
     
     
 # def plot_data_all_sensors_try(cf_data, ts_data, mocap_data, axs, col, title):
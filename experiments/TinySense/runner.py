@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Batch runner that evaluates many flights in parallel.
+
+Experiments are discovered from data/exp*/{crazyflie,tinysense,mocap} or read
+from a manifest, processed in a process pool, and their RMS errors merged in
+manifest order into <output>.csv and <output>.json.  A flight that fails,
+including an experiment folder without exactly one CSV per source or a
+manifest record missing a path, is reported with its error instead of
+aborting the batch.  From the experiments folder:
+
+    python -m TinySense.runner --workers 4
+    python -m TinySense.runner --manifest flights.csv --output flights_results
+    python -m TinySense.runner --trace traces --profile kalman_filter_from_1cm_optic
+    python -m TinySense.runner --gain-cache gains --workers 1
+
+A manifest is a CSV or JSON list of records with name, cf, ts and mocap paths
+(relative to the manifest) and an optional experiment_num.
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from TinySense import gain_cache, instrument
+from TinySense.alignment import align
+from TinySense.cache import load_experiment
+from TinySense.chunked import DEFAULT_BLOCK_ROWS
+from TinySense.data_processing import kalman_filter_from_1cm_optic
+from TinySense.metrics import CHANNEL_UNITS, CHANNELS, PAIRS, pair_rms
+
+SOURCES = {"cf": "crazyflie", "ts": "tinysense", "mocap": "mocap"}
+RMS_COLUMNS = ["cf_mocap_vx_RMS", "cf_mocap_theta_RMS", "cf_mocap_altitude_RMS",
+               "ts_mocap_vx_RMS", "ts_mocap_theta_RMS", "ts_mocap_altitude_RMS",
+               "ts_cf_vx_RMS", "ts_cf_theta_RMS", "ts_cf_altitude_RMS"]
+# Unit of every RMS column: metrics.CHANNEL_UNITS, but the paper reports the TinySense vs Crazyflie pitch in radians
+RADIAN_THETA_PAIRS = (("ts", "cf"),)
+RMS_UNITS = {f"{a}_{b}_{channel}_RMS": "rad" if channel == "theta" and (a, b) in RADIAN_THETA_PAIRS
+             else CHANNEL_UNITS[channel] for a, b in PAIRS for channel in CHANNELS}
+
+
+def _natural_key(text):
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", text)]
+
+
+def _find_source_csv(exp_dir, source):
+    """Path of the single CSV in a source folder, matching the folder name case-insensitively."""
+    for entry in sorted(os.listdir(exp_dir)):
+        path = os.path.join(exp_dir, entry)
+        if entry.lower() == source and os.path.isdir(path):
+            csvs = sorted(glob.glob(os.path.join(path, "*.csv")))
+            if len(csvs) != 1:
+                raise ValueError(f"Expected one CSV in {path}, found {len(csvs)}")
+            return csvs[0]
+    raise FileNotFoundError(f"No {source} folder in {exp_dir}")
+
+
+def discover_experiments(data_dir="data", skip_incomplete=False):
+    """Experiments found in data_dir/exp*, in natural order, numbered from 0.
+
+    A folder missing a source folder, or with no or several CSVs in one, is
+    listed with its error under "error" and no paths, so that run_batch
+    reports it as a failed flight.  skip_incomplete leaves such folders out
+    instead, printing why.
+    """
+    experiments = []
+    exp_dirs = sorted(glob.glob(os.path.join(data_dir, "exp*")), key=_natural_key)
+    for exp_dir in filter(os.path.isdir, exp_dirs):
+        experiment = {"name": os.path.basename(exp_dir), "experiment_num": len(experiments)}
+        try:
+            for key, source in SOURCES.items():
+                experiment[key] = _find_source_csv(exp_dir, source)
+        except (FileNotFoundError, ValueError) as error:
+            experiment.update(dict.fromkeys(SOURCES), error=str(error))
+        experiments.append(experiment)
+    if skip_incomplete:
+        for experiment in experiments:
+            if experiment.get("error"):
+                print(f"Skipping {experiment['name']}: {experiment['error']}")
+        experiments = [experiment for experiment in experiments if not experiment.get("error")]
+    return experiments
+
+
+def read_manifest(path):
+    """Experiments listed in a CSV or JSON manifest."""
+    if path.endswith(".json"):
+        with open(path) as file:
+            records = json.load(file)
+    else:
+        records = pd.read_csv(path).to_dict("records")
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    experiments = []
+    for i, record in enumerate(records):
+        experiment = {"name": str(record.get("name", f"exp{i + 1}")),
+                      "experiment_num": int(record.get("experiment_num", i))}
+        missing = [key for key in SOURCES if pd.isna(record.get(key))]
+        for key in SOURCES:
+            experiment[key] = None if key in missing else os.path.join(base_dir, record[key])
+        if missing:
+            experiment["error"] = f"No {', '.join(missing)} path in {path}"
+        experiments.append(experiment)
+    return experiments
+
+
+def downsample_to_cf(cf_data, mocap_data, q_est, zero_idx, zero_idx_cf, zero_idx_mocap):
+    """Crazyflie data from time zero with the estimates and mocap aligned to its timestamps."""
+    # Truncate data to start from the same time point
+    q_est = q_est[zero_idx:]
+    cf_data = cf_data[zero_idx_cf:]
+    mocap_data = mocap_data[zero_idx_mocap:]
+
+    # Downsample q_est and mocap to match cf_data timestamps
+    qest = align(q_est[:, 0], q_est, cf_data[:, 0], mode="nearest")
+    mocap = align(mocap_data[:, 0], mocap_data, cf_data[:, 0], mode="nearest")
+    return cf_data, mocap, qest
+
+
+@instrument.instrumented()
+def compute_rms(cf_data, mocap_data, q_est, zero_idx, zero_idx_cf, zero_idx_mocap):
+    """RMS errors between TinySense, Crazyflie and mocap at the Crazyflie timestamps."""
+    return rms_errors(*downsample_to_cf(cf_data, mocap_data, q_est, zero_idx, zero_idx_cf, zero_idx_mocap))
+
+
+def rms_errors(cf_data, mocap, qest):
+    """RMS errors of downsample_to_cf output, in RMS_UNITS."""
+    rms = pair_rms(cf_data, mocap, qest[:, 1:], radian_theta=RADIAN_THETA_PAIRS)
+    table = {f"{a}_{b}_{channel}_RMS": float(rms[p, c])
+             for p, (a, b) in enumerate(PAIRS) for c, channel in enumerate(CHANNELS)}
+    return {column: table[column] for column in RMS_COLUMNS}
+
+
+def process_experiment(experiment, **load_options):
+    """Preprocesses, filters and scores one flight; errors are returned, not raised.
+
+    load_options (e.g. chunked=True) are forwarded to cache.load_experiment.
+    """
+    result = {"name": experiment["name"], "status": "ok", "error": ""}
+    if experiment.get("error"):  # Incomplete folder or manifest record
+        result.update(status="error", error=experiment["error"], seconds=0.0)
+        return result
+    start = time.perf_counter()
+    try:
+        with instrument.experiment(experiment["name"]):
+            cf_data, ts_data, mocap_data = load_experiment(experiment["cf"], experiment["ts"], experiment["mocap"],
+                                                           experiment["experiment_num"], **load_options)
+            cf_data, ts_data, mocap_data, q_est, zero_idx, zero_idx_cf, zero_idx_mocap, K = \
+                kalman_filter_from_1cm_optic(cf_data, ts_data, mocap_data)
+            result.update(compute_rms(cf_data, mocap_data, q_est, zero_idx, zero_idx_cf, zero_idx_mocap))
+        result["ts_samples"] = len(ts_data)
+        result["cf_samples"] = len(cf_data)
+    except Exception as error:
+        result.update(status="error", error="".join(traceback.format_exception_only(error)).strip())
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def run_batch(experiments, n_workers=1, **load_options):
+    """Processes experiments in a pool of n_workers and returns one row per flight, in input order."""
+    process = partial(process_experiment, **load_options)
+    if n_workers > 1:
+        with ProcessPoolExecutor(n_workers) as pool:
+            results = list(pool.map(process, experiments))
+    else:
+        results = [process(experiment) for experiment in experiments]
+
+    table = pd.DataFrame(results)
+    return table.reindex(columns=["name", "status", "error"] + RMS_COLUMNS + ["ts_samples", "cf_samples", "seconds"])
+
+
+def summarize(table):
+    """Mean and standard deviation of every RMS column over the successful flights."""
+    ok = table[table["status"] == "ok"]
+    return {column: {"mean": float(np.mean(ok[column])), "std": float(np.std(ok[column]))}
+            for column in RMS_COLUMNS} if len(ok) else {}
+
+
+def write_results(table, output):
+    """Writes <output>.csv with one row per flight and <output>.json with the summary and units."""
+    table.to_csv(f"{output}.csv", index=False)
+    with open(f"{output}.json", "w") as file:
+        json.dump({"experiments": json.loads(table.to_json(orient="records", double_precision=15)),
+                   "summary": summarize(table),
+                   "units": {column: RMS_UNITS[column] for column in RMS_COLUMNS}}, file, indent=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate TinySense flights in parallel.")
+    parser.add_argument("--data-dir", default="data", help="folder holding exp*/ experiment folders")
+    parser.add_argument("--manifest", help="CSV or JSON manifest used instead of discovery")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", default="batch_results", help="output path without extension")
+    parser.add_argument("--trace", help="write per-experiment stage traces to this folder")
+    parser.add_argument("--trace-format", choices=instrument.FORMATS, default="jsonl")
+    parser.add_argument("--no-trace-memory", action="store_true", help="skip tracemalloc allocation tracking")
+    parser.add_argument("--profile", nargs="+", default=[], help="stages to run under cProfile, or all")
+    parser.add_argument("--gain-cache", help="folder storing Kalman gains between runs and workers")
+    parser.add_argument("--chunked", action="store_true",
+                        help="preprocess logs out of core in blocks of --block-rows rows (for multi-hour logs)")
+    parser.add_argument("--block-rows", type=int, default=DEFAULT_BLOCK_ROWS)
+    args = parser.parse_args()
+
+    if args.trace:
+        instrument.configure(args.trace, args.trace_format, not args.no_trace_memory, args.profile)
+    if args.gain_cache:
+        gain_cache.configure(cache_dir=args.gain_cache)
+    experiments = read_manifest(args.manifest) if args.manifest else discover_experiments(args.data_dir)
+    table = run_batch(experiments, args.workers, **({"chunked": True, "block_rows": args.block_rows}
+                                                    if args.chunked else {}))
+    write_results(table, args.output)
+
+    failed = table[table["status"] != "ok"]
+    print(f"Processed {len(table)} experiments, {len(failed)} failed")
+    for _, row in failed.iterrows():
+        print(f"  {row['name']}: {row['error']}")
+    if args.workers <= 1:
+        print(gain_cache.report())  # Workers keep their own counts
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Time alignment of the TinySense and Crazyflie logs to the mocap clock.
+
+preprocess_data aligns the sources only roughly: it cuts every log at the
+same timestamp and snaps the approximate propeller start to the nearest
+sample.  estimate_sync measures what is left, by cross-correlating the
+signals every source shares with the mocap:
+
+* pitch rate: the gyros against the derivative of the mocap pitch, which
+  gives the sharp peak, and
+* altitude, with a lower weight: its peak is broad but rules out wrong
+  pitch-rate peaks.
+
+Each pair is resampled on a uniform grid of dt seconds, low-passed at
+cutoff Hz (below the Crazyflie's Nyquist frequency; the gyros are otherwise
+dominated by noise), standardized and correlated with an FFT, so a log of N
+samples costs O(N log N).  The correlations of the signals are averaged with
+SIGNAL_WEIGHTS and the highest peak within max_lag seconds is refined to a fraction of a grid
+step by fitting a parabola through it and its neighbours.  Gaps longer than max_gap seconds
+are left out instead of interpolated across.
+
+With drift=True the lag is also measured in overlapping segments of
+segment seconds and a line lag(t) = offset + drift * t is fitted to them,
+weighted by their correlation peaks; segments whose peak is below
+min_correlation (e.g. the drone sitting still) and outliers beyond four
+median absolute deviations of the fit are ignored.  A few
+milliseconds of lag noise per segment make drift meaningful only on logs
+much longer than the segments.  apply_sync
+then maps source times t onto the mocap clock as t - lag(t).
+"""
+
+import numpy as np
+from scipy import signal
+from scipy.spatial.transform import Rotation
+
+from TinySense.alignment import align
+
+SYNC_MODES = ("offset", "drift")
+# Weights of the signal correlations in the averaged correlation
+SIGNAL_WEIGHTS = {"pitch_rate": 1.0, "altitude": 0.25}
+
+
+def sync_signals(data, source):
+    """(times, {name: values}) of the signals of a preprocessed log shared by all sources."""
+    times = np.asarray(data["timestamp"], dtype="float64")
+    if source == "mocap":
+        quats = np.asarray(data[["pose.orientation.x", "pose.orientation.y", "pose.orientation.z",
+                                 "pose.orientation.w"]], dtype="float64")
+        pitch = np.unwrap(Rotation.from_quat(quats).as_euler("xyz")[:, 0])
+        b, a = signal.butter(2, 0.1)  # As in interpolate_mocap
+        altitude = np.asarray(data["pose.position.z"], dtype="float64")
+        return times, {"altitude": altitude, "pitch_rate": np.gradient(signal.filtfilt(b, a, pitch), times)}
+    columns = {"cf": ("pz(m)", "gyro_pitch_filtered(rad/s)"), "ts": ("z(m)", "gyro(d/s)")}[source]
+    return times, {"altitude": np.asarray(data[columns[0]], dtype="float64"),
+                   "pitch_rate": np.asarray(data[columns[1]], dtype="float64")}
+
+
+def _resample(times, values, grid, max_gap, cutoff):
+    """Low-passed, standardized values on grid, zero where the log has a gap."""
+    resampled = align(times, values, grid, mode="linear", max_gap=max_gap)
+    valid = np.isfinite(resampled)
+    if valid.sum() < 2:
+        return np.zeros_like(grid)
+    resampled = resampled - np.mean(resampled[valid])
+    scale = np.std(resampled[valid])
+    resampled = np.where(valid, resampled / scale if scale > 0 else 0, 0)
+    dt = grid[1] - grid[0]
+    if cutoff is not None and cutoff * 2 * dt < 1 and len(grid) > 9:
+        b, a = signal.butter(2, cutoff * 2 * dt)
+        resampled = signal.filtfilt(b, a, resampled, padlen=min(9, len(grid) - 1))
+    return resampled
+
+
+def cross_correlation(x, y, dt):
+    """(lags in seconds, normalized correlation) of standardized x against y, computed by FFT.
+
+    A peak at a positive lag means x is late: x(t) matches y(t - lag).
+    """
+    norm = np.sqrt(np.sum(x * x) * np.sum(y * y))
+    correlation = signal.correlate(x, y, mode="full", method="fft") / (norm if norm > 0 else 1)
+    return signal.correlation_lags(len(x), len(y)) * dt, correlation
+
+
+def _peak(lags, correlation, max_lag, dt):
+    """(sub-sample lag, peak value) of the highest correlation within max_lag."""
+    window = np.flatnonzero(np.abs(lags) <= max_lag + 1e-9)
+    k = window[np.argmax(correlation[window])]
+    if window[0] < k < window[-1]:
+        left, centre, right = correlation[k - 1:k + 2]
+        curvature = left - 2 * centre + right
+        if curvature < 0:
+            shift = 0.5 * (left - right) / curvature
+            return lags[k] + shift * dt, centre - 0.25 * (left - right) * shift
+    return lags[k], correlation[k]
+
+
+def estimate_lag(times, signals, ref_times, ref_signals, start, stop, max_lag=1.0, dt=0.005, max_gap=0.2,
+                 cutoff=5.0, weights=SIGNAL_WEIGHTS):
+    """(lag, peak) of the signals of one source against the reference over [start, stop).
+
+    Both dicts map signal names to values at their times; the correlations
+    of the names present in both and in weights are averaged with weights.
+    """
+    grid = np.arange(start, stop, dt)
+    names = [name for name in signals if name in ref_signals and name in weights]
+    if len(grid) < 3 or not names:
+        return 0.0, 0.0
+    correlation = 0
+    for name in names:
+        x = _resample(times, signals[name], grid, max_gap, cutoff)
+        y = _resample(ref_times, ref_signals[name], grid, max_gap, cutoff)
+        lags, c = cross_correlation(x, y, dt)
+        correlation = correlation + weights[name] * c
+    return _peak(lags, correlation / sum(weights[name] for name in names), max_lag, dt)
+
+
+def _robust_line(x, y, weights, n_iter=3):
+    """(slope, intercept) of a weighted line fit, refitted without outliers beyond 4 MADs."""
+    keep = np.ones(len(x), dtype=bool)
+    for _ in range(n_iter):
+        slope, intercept = np.polyfit(x[keep], y[keep], 1, w=np.sqrt(weights[keep]))
+        residuals = y - (slope * x + intercept)
+        mad = np.median(np.abs(residuals[keep] - np.median(residuals[keep])))
+        keep_next = np.abs(residuals) <= 4 * 1.4826 * mad + 1e-4  # The 0.1 ms floor keeps exact fits
+        if keep_next.sum() < 2 or np.array_equal(keep_next, keep):
+            break
+        keep = keep_next
+    return slope, intercept
+
+
+def estimate_sync(data, source, reference, max_lag=1.0, dt=0.005, max_gap=0.2, cutoff=5.0, drift=False,
+                  segment=8.0, min_correlation=0.5):
+    """(offset, drift, peak) mapping the times of a preprocessed log onto the reference's.
+
+    data and reference are FlightLogs as returned by preprocess_data and
+    source is "cf" or "ts".  The lag of the source at its time t is
+    offset + drift * t; drift is 0 unless drift=True.  peak is the averaged
+    correlation of the overall fit, near 1 for a confident estimate.
+    """
+    times, signals = sync_signals(data, source)
+    ref_times, ref_signals = sync_signals(reference, "mocap")
+    start, stop = max(times[0], ref_times[0]), min(times[-1], ref_times[-1])
+    offset, peak = estimate_lag(times, signals, ref_times, ref_signals, start, stop, max_lag, dt, max_gap, cutoff)
+    if not drift:
+        return offset, 0.0, peak
+
+    # Lag of overlapping segments, searched near the overall offset
+    centres, lags, weights = [], [], []
+    for seg_start in np.arange(start, stop - segment + 1e-9, segment / 2):
+        lag, seg_peak = estimate_lag(times - offset, signals, ref_times, ref_signals, seg_start, seg_start + segment,
+                                     min(max_lag, segment / 4), dt, max_gap, cutoff)
+        if seg_peak >= min_correlation:
+            centres.append(seg_start + segment / 2)
+            lags.append(offset + lag)
+            weights.append(seg_peak)
+    if len(centres) < 2:
+        return offset, 0.0, peak
+    drift_rate, offset = _robust_line(np.array(centres), np.array(lags), np.array(weights))
+    return float(offset), float(drift_rate), peak
+
+
+def apply_sync(data, offset, drift=0.0):
+    """Copy of data with its timestamps mapped onto the reference clock, t - (offset + drift * t)."""
+    data = data.copy()
+    data["timestamp"] = data["timestamp"] * (1 - drift) - offset
+    return data
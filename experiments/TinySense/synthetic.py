@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic flights of arbitrary length for scaling and stress tests.
+
+The vehicle follows the estimator's own model (state_space_model: pitch
+integrates the gyro input, vx = -9.81 theta - b/m vx) closed with a simple
+velocity-hold controller tracking random speed setpoints, plus the horizontal
+position and a first-order altitude hold.  The closed loop is linear, so each
+chunk of the trajectory is propagated with the exact discretization and the
+associative scan of kalman_scan instead of a Python loop.
+
+Each sensor samples the trajectory on its own jittered clock and writes rows
+in the layout of the real logs, with the sign and unit conventions that
+preprocess_data and interpolate_mocap undo:
+
+* tinysense: optic flow from the model's C/D rows divided by the preprocessing
+  scale, gyro in deg/s with flipped sign, barometric altitude with an offset
+* crazyflie: position, velocity, pitch, gyro and optic flow of the flight
+  controller
+* mocap: ROS pose messages with the pitch as a rotation about x
+
+Noise, sensor biases, dropouts (gaps in a sensor's rows) and repeated
+timestamps are configurable.  Chunks are written as soon as they are
+simulated, so memory is bounded by chunk_seconds however long the flight is.
+Generate a flight that runner.discover_experiments can pick up with:
+
+    python -m TinySense.synthetic synthetic_data/exp1 --duration 3600 --seed 1
+
+preprocess_data keeps only time_window seconds before the highest Crazyflie
+altitude, so pass a time_window covering the flight to keep all of it.
+
+tile_flight instead repeats a recorded, preprocessed TinySense log end to end,
+synthetic_frames and synthetic_recording render camera frames of a moving
+texture, and kalman_weight_workloads draws sequences of filter weights.
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import ndimage
+from scipy.linalg import expm
+
+from TinySense.data_processing import DEFAULT_KALMAN_PARAMS, state_space_model
+from TinySense.flight_log import FlightLog
+from TinySense.kalman_scan import affine_prefix_scan
+from TinySense.lk_optic_flow import OF_HEIGHT, OF_WIDTH, SKIP_FACTOR
+
+TS_COLUMNS = ["timestamp", "optic_flow(rad/s)", "gyro(d/s)", "z(m)"]
+CF_COLUMNS = ["timestamp", "px(m)", "py(m)", "pz(m)", "lz(m)", "vx(m/s)", "theta_pitch(rad)",
+              "gyro_pitch_raw(rad/s)", "gyro_pitch_filtered(rad/s)", "omega_pitch(rad/s)", "of_x(pixels/frame)"]
+MOCAP_COLUMNS = ["Time", "header.seq", "header.stamp.secs", "header.stamp.nsecs", "header.frame_id",
+                 "pose.position.x", "pose.position.y", "pose.position.z",
+                 "pose.orientation.x", "pose.orientation.y", "pose.orientation.z", "pose.orientation.w"]
+
+# Median sample periods (s) of the recorded flights
+SENSOR_PERIODS = {"ts": 0.0145, "cf": 0.030, "mocap": 0.010}
+
+# Standard deviations of the measurement noise
+DEFAULT_NOISE = {"optic_flow": 0.05, "gyro": 0.02, "baro": 0.1,
+                 "cf_position": 0.005, "cf_velocity": 0.02, "cf_attitude": 0.005, "cf_gyro": 0.02,
+                 "mocap_position": 0.0005, "mocap_attitude": 0.001}
+
+
+def closed_loop_model(b=13.2e-3, m=0.3, k_theta=8.0, k_v=1.5, tau_z=0.5):
+    """Continuous closed-loop matrices of the state [theta, vx, position, z].
+
+    The inputs are [speed setpoint, pitch-rate disturbance, altitude setpoint].
+    The gyro input u = K x + F inputs follows a pitch setpoint
+    -k_v (v_cmd - vx) / 9.81 with gain k_theta; z tracks its setpoint with time
+    constant tau_z.  Returns (A_cl, B_cl, K, F).
+    """
+    A, B, _, _ = state_space_model(b, m)
+    g = -A[1, 0]
+    K = np.array([[-k_theta, k_theta * k_v / g, 0, 0]])
+    F = np.array([[-k_theta * k_v / g, 1, 0]])
+
+    A_cl = np.zeros((4, 4))
+    A_cl[:2, :2] = A[:2, :2] + B[:2] @ K[:, :2]
+    A_cl[2, 1] = 1
+    A_cl[3, 3] = -1 / tau_z
+    B_cl = np.zeros((4, 3))
+    B_cl[:2] = B[:2] @ F
+    B_cl[3, 2] = 1 / tau_z
+    return A_cl, B_cl, K, F
+
+
+def discretize(A, B, dt):
+    """Exact zero-order-hold discretization (Ad, Bd) of x' = A x + B v."""
+    n, p = B.shape
+    augmented = np.zeros((n + p, n + p))
+    augmented[:n, :n] = A
+    augmented[:n, n:] = B
+    transition = expm(augmented * dt)
+    return transition[:n, :n], transition[:n, n:]
+
+
+class _Setpoints:
+    """Random piecewise-constant speed and altitude setpoints, carried across chunks."""
+
+    def __init__(self, rng, takeoff_time, hover_altitude, altitude_variation, max_speed, maneuver_period):
+        self.rng = rng
+        self.takeoff_time = takeoff_time
+        self.hover_altitude = hover_altitude
+        self.altitude_variation = altitude_variation
+        self.max_speed = max_speed
+        self.maneuver_period = maneuver_period
+        self.next_change = takeoff_time + 2 * maneuver_period  # Climb before maneuvering
+        self.speed = 0.0
+        self.altitude = hover_altitude
+
+    def sample(self, t):
+        """Setpoints (len(t), 2) of speed and altitude on increasing times t."""
+        speed = np.empty(len(t))
+        altitude = np.empty(len(t))
+        start = 0
+        while start < len(t):
+            stop = int(np.searchsorted(t, self.next_change, side="left"))
+            speed[start:stop] = self.speed
+            altitude[start:stop] = self.altitude
+            if stop >= len(t):
+                break
+            self.speed = self.rng.uniform(-self.max_speed, self.max_speed)
+            self.altitude = self.hover_altitude + self.rng.uniform(-1, 1) * self.altitude_variation
+            self.next_change += self.rng.exponential(self.maneuver_period)
+            start = stop
+        grounded = t < self.takeoff_time
+        speed[grounded] = 0.0
+        altitude[grounded] = 0.0
+        return speed, altitude
+
+
+class _SensorClock:
+    """Jittered sample times of one sensor with dropouts and repeated timestamps."""
+
+    def __init__(self, rng, period, jitter, dropout_rate, dropout_length, duplicate_rate, resolution, start):
+        self.rng = rng
+        self.period = period
+        self.jitter = jitter
+        self.dropout_rate = dropout_rate
+        self.dropout_length = dropout_length
+        self.duplicate_rate = duplicate_rate
+        self.resolution = resolution
+        self.next_time = start
+        self.gap_end = -np.inf
+        self.last_stamp = -np.inf
+
+    def times(self, t_stop):
+        """Sample times in [next_time, t_stop): true times and logged timestamps."""
+        n = max(int((t_stop - self.next_time) / self.period) + 2, 1)
+        steps = self.period * (1 + self.jitter * self.rng.uniform(-1, 1, n))
+        t = self.next_time + np.concatenate([[0], np.cumsum(steps[:-1])])
+        t = t[t < t_stop]
+        self.next_time = t[-1] + steps[len(t) - 1] if len(t) else self.next_time
+
+        # Dropouts start as a Poisson process and last an exponential time
+        keep = t >= self.gap_end
+        if self.dropout_rate > 0 and len(t):
+            n_gaps = self.rng.poisson(self.dropout_rate * (t[-1] - t[0] + self.period))
+            for start in np.sort(self.rng.uniform(t[0], t[-1] + self.period, n_gaps)):
+                end = start + self.rng.exponential(self.dropout_length)
+                keep &= (t < start) | (t >= end)
+                self.gap_end = max(self.gap_end, end)
+        t = t[keep]
+
+        stamps = np.round(t / self.resolution) * self.resolution if self.resolution else t.copy()
+        if self.duplicate_rate > 0 and len(t):
+            repeat = self.rng.random(len(t)) < self.duplicate_rate
+            previous = np.concatenate([[self.last_stamp], stamps[:-1]])
+            stamps = np.where(repeat & np.isfinite(previous), previous, stamps)
+            stamps = np.maximum.accumulate(np.concatenate([[self.last_stamp], stamps]))[1:]
+        if len(stamps):
+            self.last_stamp = stamps[-1]
+        return t, stamps
+
+
+def generate_flight(output_dir, duration, name="synthetic", seed=0, start_time=1.7e9, chunk_seconds=60.0,
+                    base_dt=0.005, noise=None, gyro_bias=0.01, baro_bias=52.8, dropout_rate=0.0,
+                    dropout_length=0.2, duplicate_rate=0.0, max_speed=0.5, maneuver_period=3.0,
+                    hover_altitude=1.0, altitude_variation=0.2, takeoff_time=2.0, disturbance=0.2,
+                    b=13.2e-3, m=0.3, zd=1):
+    """Simulates a flight of duration seconds into TinySense, Crazyflie and mocap CSVs.
+
+    Files are written to output_dir/{tinysense,crazyflie,mocap}/{ts,cf,mocap}_<name>.csv
+    chunk_seconds of flight at a time.  noise overrides entries of
+    DEFAULT_NOISE; gyro_bias (rad/s) and baro_bias (m) offset the TinySense
+    gyro and altitude.  dropout_rate is the number of gaps per second in each
+    sensor's rows, each lasting an exponential time of mean dropout_length
+    seconds; duplicate_rate is the fraction of TinySense and Crazyflie rows
+    that repeat the previous timestamp.  disturbance is the standard deviation
+    (rad/s) of the pitch-rate disturbance once airborne.  Returns the paths by
+    source key ("ts", "cf", "mocap") and the number of rows written.
+    """
+    noise = dict(DEFAULT_NOISE, **(noise or {}))
+    rng = np.random.default_rng(seed)
+    A_cl, B_cl, K, F = closed_loop_model(b, m)
+    Ad, Bd = discretize(A_cl, B_cl, base_dt)
+    _, _, C, D = state_space_model(b, m, zd)
+
+    setpoints = _Setpoints(rng, takeoff_time, hover_altitude, altitude_variation, max_speed, maneuver_period)
+    clocks = {key: _SensorClock(rng, period, 0.1, dropout_rate, dropout_length,
+                                0.0 if key == "mocap" else duplicate_rate, None if key == "mocap" else 0.001,
+                                start_time)
+              for key, period in SENSOR_PERIODS.items()}
+    folders = {"ts": "tinysense", "cf": "crazyflie", "mocap": "mocap"}
+    paths = {}
+    for key, folder in folders.items():
+        os.makedirs(os.path.join(output_dir, folder), exist_ok=True)
+        paths[key] = os.path.join(output_dir, folder, f"{key}_{name}.csv")
+    files = {key: open(path, "w", newline="") for key, path in paths.items()}
+    rows = {key: 0 for key in paths}
+
+    x = np.zeros(4)
+    mocap_seq = 0
+    t0 = 0.0
+    try:
+        while t0 < duration:
+            # Trajectory on the base grid, including the chunk's end point
+            n = int(np.ceil(min(chunk_seconds, duration - t0) / base_dt))
+            t = t0 + base_dt * np.arange(n + 1)
+            speed, altitude = setpoints.sample(t)
+            w = np.where(t >= takeoff_time, rng.normal(0, disturbance, len(t)), 0.0)
+            v = np.stack([speed, w, altitude], axis=-1)
+            P, s = affine_prefix_scan(np.broadcast_to(Ad, (n, 4, 4)), v[:-1] @ Bd.T)
+            states = np.concatenate([x[None], (P @ x[:, None])[..., 0] + s])
+            u = states @ K[0] + v @ F[0]
+            x = states[-1]
+
+            for key, clock in clocks.items():
+                sample_t, stamps = clock.times(start_time + t[-1])
+                local = sample_t - start_time
+                theta, vx, position, z = (np.interp(local, t, states[:, i]) for i in range(4))
+                gyro = np.interp(local, t, u)
+                frame = _sensor_frame(key, rng, noise, stamps, theta, vx, position, z, gyro,
+                                      C, D, gyro_bias, baro_bias, mocap_seq)
+                if key == "mocap":
+                    mocap_seq += len(frame)
+                frame.to_csv(files[key], header=rows[key] == 0, index=False)
+                rows[key] += len(frame)
+            t0 = t[-1]
+    finally:
+        for file in files.values():
+            file.close()
+    return paths, rows
+
+
+def _sensor_frame(key, rng, noise, stamps, theta, vx, position, z, gyro, C, D, gyro_bias, baro_bias, mocap_seq):
+    """Rows of one sensor in the layout and conventions of its real logs."""
+    def noisy(values, name):
+        return values + rng.normal(0, noise[name], len(values))
+
+    # The model's measurements: optic flow -vx / zd + gyro, and altitude
+    state = np.stack([theta, vx, z], axis=-1)
+    optic_flow = state @ C[0] + gyro * D[0, 0]
+
+    if key == "ts":
+        # preprocess_data negates the gyro, converts it from deg/s and scales optic flow by -1.2
+        return pd.DataFrame({"timestamp": stamps,
+                             "optic_flow(rad/s)": noisy(optic_flow, "optic_flow") / -1.2,
+                             "gyro(d/s)": -np.degrees(noisy(gyro + gyro_bias, "gyro")),
+                             "z(m)": noisy(state @ C[1] + baro_bias, "baro")}, columns=TS_COLUMNS)
+    if key == "cf":
+        return pd.DataFrame({"timestamp": stamps,
+                             "px(m)": noisy(-position, "cf_position"),
+                             "py(m)": noisy(np.zeros(len(stamps)), "cf_position"),
+                             "pz(m)": noisy(z, "cf_position"),
+                             "lz(m)": noisy(z, "cf_position"),
+                             "vx(m/s)": noisy(-vx, "cf_velocity"),
+                             "theta_pitch(rad)": noisy(-theta, "cf_attitude"),
+                             "gyro_pitch_raw(rad/s)": np.zeros(len(stamps)),
+                             "gyro_pitch_filtered(rad/s)": np.degrees(noisy(gyro, "cf_gyro")),
+                             "omega_pitch(rad/s)": -noisy(gyro, "cf_gyro"),
+                             "of_x(pixels/frame)": noisy(optic_flow, "optic_flow")}, columns=CF_COLUMNS)
+
+    # interpolate_mocap differentiates position.y and reads the pitch as the x rotation
+    angle = noisy(theta, "mocap_attitude")
+    secs = np.floor(stamps)
+    return pd.DataFrame({"Time": stamps,
+                         "header.seq": mocap_seq + np.arange(len(stamps)),
+                         "header.stamp.secs": secs.astype(np.int64),
+                         "header.stamp.nsecs": np.round((stamps - secs) * 1e9).astype(np.int64),
+                         "header.frame_id": "world",
+                         "pose.position.x": noisy(np.zeros(len(stamps)), "mocap_position"),
+                         "pose.position.y": noisy(position, "mocap_position"),
+                         "pose.position.z": noisy(z, "mocap_position"),
+                         "pose.orientation.x": np.sin(angle / 2),
+                         "pose.orientation.y": np.zeros(len(stamps)),
+                         "pose.orientation.z": np.zeros(len(stamps)),
+                         "pose.orientation.w": np.cos(angle / 2)}, columns=MOCAP_COLUMNS)
+
+
+def tile_flight(ts_data, length):
+    """Repeats a TinySense log until it has the requested number of samples."""
+    ts = ts_data.to_numpy(dtype="float64")
+    reps = -(-length // len(ts))
+    period = ts[-1, 0] - ts[0, 0] + np.median(np.diff(ts[:, 0]))
+    tiled = np.tile(ts, (reps, 1))[:length]
+    tiled[:, 0] += np.repeat(np.arange(reps) * period, len(ts))[:length]
+    return FlightLog(tiled, ts_data.columns)
+
+
+def synthetic_frames(n_frames, seed=0):
+    """Smoothed noise texture drifting by a random sub-pixel motion per frame."""
+    rng = np.random.default_rng(seed)
+    size = (OF_HEIGHT * SKIP_FACTOR + 40, OF_WIDTH * SKIP_FACTOR + 40)
+    texture = ndimage.gaussian_filter(rng.uniform(0, 255, size), 3)
+    texture = (texture - texture.min()) / np.ptp(texture) * 255
+    shifts = np.cumsum(rng.normal(0, 1.5, (n_frames, 2)), axis=0)
+    frames = np.empty((n_frames, OF_HEIGHT * SKIP_FACTOR, OF_WIDTH * SKIP_FACTOR), dtype=np.uint8)
+    for k, (dy, dx) in enumerate(shifts):
+        moved = ndimage.shift(texture, (dy % 20, dx % 20), order=1, mode="wrap")
+        frames[k] = np.clip(moved[20:20 + frames.shape[1], 20:20 + frames.shape[2]], 0, 255)
+    return frames
+
+
+def synthetic_recording(n_frames, max_shift, seed=0, height=120, width=160):
+    """Frames of a texture moving by a random motion, and the true image motion per frame."""
+    rng = np.random.default_rng(seed)
+    motion = rng.uniform(-max_shift, max_shift, (n_frames, 2))
+    motion[0] = 0
+    position = np.cumsum(motion, axis=0)
+    position -= position.min(axis=0)
+    span = np.ceil(position.max(axis=0)).astype(int)
+    texture = ndimage.gaussian_filter(rng.uniform(0, 255, (height + span[1] + 2, width + span[0] + 2)), 2.5)
+    texture = (texture - texture.min()) / np.ptp(texture) * 255
+
+    frames = np.empty((n_frames, height, width), dtype=np.uint8)
+    for k, (x, y) in enumerate(position):
+        frames[k] = np.clip(ndimage.shift(texture, (-y, -x), order=1)[:height, :width], 0, 255)
+    return frames, -motion  # The scene moves opposite to the camera window
+
+
+def kalman_weight_workloads(calls, rng):
+    """Kalman parameter rows that repeat, drift a few percent per call, or scatter within a decade."""
+    repeat = np.tile(DEFAULT_KALMAN_PARAMS, (calls, 1))
+    steps = rng.normal(0, 0.03, (calls, 8))
+    steps[:, :3] = 0
+    nearby = DEFAULT_KALMAN_PARAMS * np.exp(np.cumsum(steps, axis=0))
+    scattered = DEFAULT_KALMAN_PARAMS * 10 ** rng.uniform(-1, 1, (calls, 8))
+    scattered[:, :3] = 1
+    return {"repeat": repeat, "nearby": nearby, "scattered": scattered}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic TinySense flight.")
+    parser.add_argument("output_dir", help="experiment folder to create, e.g. synthetic_data/exp1")
+    parser.add_argument("--duration", type=float, default=600, help="flight length in seconds")
+    parser.add_argument("--name", default="synthetic")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk-seconds", type=float, default=60)
+    parser.add_argument("--dropout-rate", type=float, default=0.0, help="gaps per second per sensor")
+    parser.add_argument("--dropout-length", type=float, default=0.2, help="mean gap length in seconds")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0, help="fraction of repeated timestamps")
+    parser.add_argument("--noise-scale", type=float, default=1.0, help="multiplies every noise level")
+    args = parser.parse_args()
+
+    noise = {name: sigma * args.noise_scale for name, sigma in DEFAULT_NOISE.items()}
+    paths, rows = generate_flight(args.output_dir, args.duration, args.name, args.seed,
+                                  chunk_seconds=args.chunk_seconds, noise=noise,
+                                  dropout_rate=args.dropout_rate, dropout_length=args.dropout_length,
+                                  duplicate_rate=args.duplicate_rate)
+    for key, path in paths.items():
+        print(f"{path}: {rows[key]} rows, {os.path.getsize(path) / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
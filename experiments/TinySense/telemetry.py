@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+Host-side ingestion of the Avionics sketch telemetry stream.
+
+src/sketches/Avionics/Avionics.ino writes one 12-byte record per frame over
+BLE UART: three little-endian float32 values [optic flow, gyro x, altitude].
+The stream carries no timestamps or framing, so records are stamped with the
+host arrival time.
+
+A TelemetryReader thread reads the stream in bulk chunks, decodes every whole
+record of a chunk with one np.frombuffer call and appends them to a
+preallocated RingBuffer.  The ring is mirrored (every record is written twice,
+capacity apart), so the latest n records are always one contiguous NumPy view
+that consumers read without copying.
+
+ReplaySource stands in for the hardware: it encodes a recorded
+data/exp*/tinysense CSV into the same byte stream and releases it in real time
+or at an accelerated rate, either directly or through a pseudo-terminal
+(replay_to_pty, Unix only) that a serial reader can open like a device.
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+
+from TinySense.loaders import load_flight_csv
+
+# Layout of one record on the wire and of one stamped record in the ring buffer
+WIRE_DTYPE = np.dtype([("optic_flow", "<f4"), ("gyro", "<f4"), ("z", "<f4")])
+RECORD_DTYPE = np.dtype([("timestamp", "<f8"), ("optic_flow", "<f4"), ("gyro", "<f4"), ("z", "<f4")])
+
+
+class RingBuffer:
+    """Fixed-capacity buffer of typed records whose recent records are zero-copy views.
+
+    Views stay valid until the writer laps them, capacity records later.
+    """
+
+    def __init__(self, capacity, dtype=RECORD_DTYPE):
+        self.capacity = capacity
+        self.count = 0  # Records ever written
+        self._data = np.zeros(2 * capacity, dtype=dtype)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def extend(self, records):
+        """Appends records, keeping only the newest capacity of them."""
+        count = self.count
+        if len(records) > self.capacity:
+            count += len(records) - self.capacity
+            records = records[-self.capacity:]
+        n = len(records)
+        start = count % self.capacity
+        first = min(n, self.capacity - start)
+        for offset in (0, self.capacity):
+            self._data[offset + start:offset + start + first] = records[:first]
+            self._data[offset:offset + n - first] = records[first:]
+        with self._lock:
+            self.count = count + n
+
+    def latest(self, n=None):
+        """View of the newest n records (all buffered records by default), oldest first."""
+        with self._lock:
+            count = self.count
+        n = len(self) if n is None else min(n, len(self))
+        start = (count - n) % self.capacity
+        return self._data[start:start + n]
+
+    def since(self, cursor):
+        """View of the records written after absolute position cursor, and the new cursor.
+
+        Records already overwritten are skipped.
+        """
+        with self._lock:
+            count = self.count
+        n = min(count - cursor, self.capacity)
+        return self.latest(n), count
+
+
+class TelemetryParser:
+    """Decodes the raw byte stream into stamped records, carrying partial records over."""
+
+    def __init__(self):
+        self._pending = b""
+        self._last_arrival = None
+
+    def feed(self, data, arrival_time):
+        """Returns the records completed by data as a RECORD_DTYPE array.
+
+        Records of one chunk are spread evenly between the previous chunk's
+        arrival and this one.
+        """
+        buffer = self._pending + bytes(data)
+        n = len(buffer) // WIRE_DTYPE.itemsize
+        self._pending = buffer[n * WIRE_DTYPE.itemsize:]
+
+        records = np.empty(n, dtype=RECORD_DTYPE)
+        wire = np.frombuffer(buffer, dtype=WIRE_DTYPE, count=n)
+        for name in WIRE_DTYPE.names:
+            records[name] = wire[name]
+        if self._last_arrival is None or n == 0:
+            records["timestamp"] = arrival_time
+        else:
+            records["timestamp"] = np.linspace(self._last_arrival, arrival_time, n + 1)[1:]
+        if n:
+            self._last_arrival = arrival_time
+        return records
+
+
+class TelemetryReader(threading.Thread):
+    """Background thread moving a byte source into a RingBuffer.
+
+    source is anything with read(size) returning bytes: a pyserial port, a file
+    opened with buffering=0, a pseudo-terminal or a ReplaySource.  Reading stops
+    at end of stream (empty read or EIO) or after stop().
+
+    The record stamps are spread between chunk arrivals (see TelemetryParser)
+    and say nothing about delays.  With record_arrivals, arrivals lists a
+    (records written so far, clock time) pair as each chunk's records become
+    available in the buffer, for latency measurements (see arrival_times).
+    """
+
+    def __init__(self, source, buffer, chunk_size=4096, clock=time.time, record_arrivals=False):
+        super().__init__(daemon=True)
+        self.source = source
+        self.buffer = buffer
+        self.chunk_size = chunk_size
+        self.clock = clock
+        self.parser = TelemetryParser()
+        self.bytes_read = 0
+        self.arrivals = [] if record_arrivals else None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                data = self.source.read(self.chunk_size)
+            except OSError:
+                break  # A pseudo-terminal whose writer closed raises EIO
+            if not data:
+                if getattr(self.source, "timeout", None) is not None:
+                    continue  # Serial read timed out
+                break
+            self.bytes_read += len(data)
+            records = self.parser.feed(data, self.clock())
+            if len(records):
+                self.buffer.extend(records)
+                if self.arrivals is not None:
+                    self.arrivals.append((self.buffer.count, self.clock()))
+
+    def stop(self):
+        self._stop_event.set()
+
+    def arrival_times(self):
+        """Clock time at which each record written so far became available, from arrivals."""
+        counts, times = np.array(self.arrivals, dtype="float64").reshape(-1, 2).T
+        return times[np.searchsorted(counts, np.arange(self.buffer.count), side="right")]
+
+
+def open_serial(port, baudrate=500000, timeout=0.1):
+    """Opens a serial port or BLE UART bridge with pyserial, which is only needed here."""
+    import serial
+    return serial.Serial(port, baudrate, timeout=timeout)
+
+
+def encode_flight(ts_path):
+    """Relative send times and the Avionics byte stream of a recorded TinySense CSV."""
+    ts_data = load_flight_csv(ts_path, "tinysense")
+    wire = np.empty(len(ts_data), dtype=WIRE_DTYPE)
+    wire["optic_flow"] = ts_data["optic_flow(rad/s)"]
+    wire["gyro"] = ts_data["gyro(d/s)"]
+    wire["z"] = ts_data["z(m)"]
+    times = ts_data["timestamp"].to_numpy()
+    return times - times[0], wire.tobytes()
+
+
+class ReplaySource:
+    """Byte source that replays a TinySense CSV as the Avionics telemetry stream.
+
+    speed scales the recorded timing (2.0 replays twice as fast); speed=None
+    releases records as fast as they are read.  repeat replays the flight that
+    many times back to back.  release_times records when each record became
+    available, for latency measurements.
+    """
+
+    def __init__(self, ts_path, speed=1.0, repeat=1, clock=time.time):
+        times, payload = encode_flight(ts_path)
+        period = np.median(np.diff(times)) if len(times) > 1 else 0.0
+        span = times[-1] + period
+        self._times = np.concatenate([times + k * span for k in range(repeat)])
+        self._payload = payload * repeat
+        self.speed = speed
+        self.clock = clock
+        self.release_times = np.full(len(self._times), np.nan)
+        self._next = 0
+        self._start = None
+
+    def __len__(self):
+        return len(self._times)
+
+    def read(self, size):
+        """Returns up to size bytes of whole records that are due, blocking until one is."""
+        record_size = WIRE_DTYPE.itemsize
+        if self._next >= len(self._times):
+            return b""
+        now = self.clock()
+        if self._start is None:
+            self._start = now
+
+        max_records = max(size // record_size, 1)
+        if self.speed is None:
+            n = min(max_records, len(self._times) - self._next)
+        else:
+            due = self._start + self._times[self._next] / self.speed
+            if due > now:
+                time.sleep(due - now)
+                now = self.clock()
+            elapsed = (now - self._start) * self.speed
+            n = int(np.searchsorted(self._times, elapsed, side="right")) - self._next
+            n = min(max(n, 1), max_records)
+
+        first = self._next
+        self._next += n
+        self.release_times[first:self._next] = now
+        return self._payload[first * record_size:self._next * record_size]
+
+
+def replay_to_pty(ts_path, speed=1.0, repeat=1):
+    """Replays a TinySense CSV into a pseudo-terminal.
+
+    Returns the device path to open as a serial port, the writer thread and the
+    ReplaySource (for its release_times).  Pseudo-terminals need a Unix host.
+    """
+    try:
+        import tty
+    except ImportError:
+        raise RuntimeError("replay_to_pty needs a Unix pseudo-terminal; "
+                           "read a ReplaySource directly on this platform") from None
+    master, slave = os.openpty()
+    tty.setraw(slave)  # Binary records must pass through unchanged
+    source = ReplaySource(ts_path, speed, repeat)
+
+    def write_all():
+        try:
+            while True:
+                data = source.read(4096)
+                if not data:
+                    break
+                os.write(master, data)
+        finally:
+            time.sleep(0.05)  # Let the reader drain before the device disappears
+            os.close(master)
+            os.close(slave)
+
+    writer = threading.Thread(target=write_all, daemon=True)
+    writer.start()
+    return os.ttyname(slave), writer, source
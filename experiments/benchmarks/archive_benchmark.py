@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Size and window-read speed of flight archives against the raw CSVs.
+
+A synthetic flight is converted with write_archive.  For every source the
+benchmark reports the CSV and archive sizes, the time to load the whole log
+with load_flight_log from each, and the time to pull random windows of
+--window seconds: pd.read_csv of the whole CSV plus a time mask against
+FlightArchive.read_window, which checks it returns the same rows.  Run from
+the experiments folder:
+
+    python -m benchmarks.archive_benchmark --duration 3600 --window 10
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from TinySense.archive import DEFAULT_CHUNK_ROWS, FlightArchive, write_archive
+from TinySense.loaders import load_flight_log
+from TinySense.synthetic import generate_flight
+
+SOURCES = {"cf": "crazyflie", "ts": "tinysense", "mocap": "mocap"}
+
+
+def _best(func, repeat):
+    seconds = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        seconds = min(seconds, time.perf_counter() - start)
+    return seconds, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--duration", type=float, default=3600.0, help="flight length in seconds")
+    parser.add_argument("--window", type=float, default=10.0, help="window length in seconds")
+    parser.add_argument("--windows", type=int, default=20, help="random windows read per source")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory() as folder:
+        paths, rows = generate_flight(os.path.join(folder, "flight"), args.duration, seed=args.seed)
+        output = os.path.join(folder, "flight.tsa")
+        start = time.perf_counter()
+        write_archive(output, {source: paths[key] for key, source in SOURCES.items()}, args.chunk_rows)
+        print(f"{args.duration:.0f} s flight converted in {time.perf_counter() - start:.2f} s: "
+              f"{sum(os.path.getsize(path) for path in paths.values()) / 1e6:.1f} MB of CSV -> "
+              f"{os.path.getsize(output) / 1e6:.1f} MB")
+
+        with FlightArchive(output) as archive:
+            for key, source in SOURCES.items():
+                csv_load, _ = _best(lambda: load_flight_log(paths[key], source), 1)
+                archive_load, _ = _best(lambda: load_flight_log(output, source), 3)
+
+                # The CSV has to be parsed in full for any window; time one parse, then mask each window
+                csv_parse, data = _best(lambda: pd.read_csv(paths[key]), 1)
+                times = data.iloc[:, 0].to_numpy()
+                columns = list(data.columns[1:])
+                window_seconds = []
+                for t0 in rng.uniform(times[0], times[-1] - args.window, args.windows):
+                    seconds, log = _best(lambda: archive.read_window(source, t0, t0 + args.window, columns), 3)
+                    window_seconds.append(seconds)
+                    mask = (times > t0) & (times <= t0 + args.window)
+                    if not np.array_equal(log["timestamp"], times[mask]):
+                        raise AssertionError(f"{source} window at {t0} differs from the CSV")
+
+                print(f"  {source:>9}: {rows[key]:8d} rows, CSV {os.path.getsize(paths[key]) / 1e6:6.1f} MB | "
+                      f"full load CSV {csv_load:6.3f} s, archive {archive_load:6.3f} s | "
+                      f"{args.window:.0f} s window: CSV {csv_parse:6.3f} s, archive "
+                      f"{np.median(window_seconds) * 1e3:6.2f} ms (median of {args.windows})")
+
+
+if __name__ == "__main__":
+    main()
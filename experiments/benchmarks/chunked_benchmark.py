@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Peak memory of in-memory against chunked preprocessing as logs grow.
+
+Synthetic flights of increasing length are preprocessed and interpolated by
+preprocess_data + interpolate_mocap and by chunked.write_chunked.  Peak
+memory is measured with tracemalloc (NumPy and pandas arrays) and the
+chunked output is compared with the in-memory frames.  Run from the
+experiments folder:
+
+    python -m benchmarks.chunked_benchmark --durations 900 1800 3600
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from TinySense.chunked import write_chunked
+from TinySense.data_processing import interpolate_mocap, preprocess_data
+from TinySense.synthetic import generate_flight
+
+
+def _measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--durations", type=float, nargs="+", default=[900, 1800, 3600],
+                        help="flight lengths in seconds")
+    parser.add_argument("--block-rows", type=int, default=10_000,
+                        help="rows per block; peak memory grows with it until a block holds a whole log")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for duration in args.durations:
+        with tempfile.TemporaryDirectory() as folder:
+            paths, rows = generate_flight(os.path.join(folder, "flight"), duration, seed=args.seed)
+            params = {"time_window": duration}
+
+            def in_memory():
+                cf_data, ts_data, mocap_data = preprocess_data(paths["cf"], paths["ts"], paths["mocap"], 1, **params)
+                return cf_data, ts_data, interpolate_mocap(mocap_data)
+
+            frames, memory_seconds, memory_peak = _measure(in_memory)
+            output = os.path.join(folder, "chunked")
+            _, chunked_seconds, chunked_peak = _measure(
+                lambda: write_chunked(paths["cf"], paths["ts"], paths["mocap"], 1, output, args.block_rows, **params))
+            error = max(np.max(np.abs(np.load(os.path.join(output, f"{name}.npy")) - frame.to_numpy()))
+                        for name, frame in zip(("cf", "ts", "mocap"), frames))
+
+        print(f"{duration:6.0f} s, {sum(rows.values()):8d} rows: in memory {memory_peak / 1e6:7.1f} MB "
+              f"{memory_seconds:6.2f} s | chunked {chunked_peak / 1e6:7.1f} MB {chunked_seconds:6.2f} s | "
+              f"max difference {error:.1e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Steady-state gain cache against a control.lqe solve on every call.
+
+Three workloads of Kalman weights are timed:
+
+* repeat: the same weights over and over, as when many flights are filtered
+* nearby: weights drifting a few percent per call, as in gradient tuning or
+  when only R is changed
+* scattered: independent log-uniform weights within a decade, as in a sweep
+
+Every gain is checked against control.lqe.  Run from the experiments folder:
+
+    python -m benchmarks.gain_cache_benchmark --calls 500
+"""
+
+import argparse
+import time
+
+import control
+import numpy as np
+
+from TinySense import gain_cache
+from TinySense.data_processing import params_to_weights, state_space_model
+from TinySense.synthetic import kalman_weight_workloads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    A, B, C, D = state_space_model()
+    rng = np.random.default_rng(args.seed)
+    for name, params in kalman_weight_workloads(args.calls, rng).items():
+        G, Q, R = params_to_weights(params)
+        start = time.perf_counter()
+        reference = [control.lqe(A, G[k], C, Q[k], R[k])[0] for k in range(len(params))]
+        lqe_seconds = time.perf_counter() - start
+
+        gain_cache.clear()
+        start = time.perf_counter()
+        cached = [gain_cache.steady_state_gain(A, G[k], C, Q[k], R[k])[0] for k in range(len(params))]
+        cache_seconds = time.perf_counter() - start
+
+        error = max(np.max(np.abs(L - L_ref)) / np.max(np.abs(L_ref)) for L, L_ref in zip(cached, reference))
+        print(f"{name:>9}: lqe {lqe_seconds / len(params) * 1e6:6.0f} us/call, "
+              f"cache {cache_seconds / len(params) * 1e6:6.0f} us/call, max relative error {error:.1e}")
+        print(f"{'':>11}{gain_cache.report()}")
+
+
+if __name__ == "__main__":
+    main()
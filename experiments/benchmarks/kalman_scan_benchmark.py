@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the sequential and associative-scan observer engines.
+
+The first flight is tiled to increasing log lengths and both engines of
+kalman_filter_from_1cm_optic are timed on it.  Run from the experiments folder:
+
+    python -m benchmarks.kalman_scan_benchmark --lengths 1000 10000 100000
+"""
+
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+
+from TinySense.data_processing import preprocess_data, interpolate_mocap, kalman_filter_from_1cm_optic
+from TinySense.synthetic import tile_flight
+
+EXPERIMENT = ('data/exp1/crazyflie/cf_first.csv',
+              'data/exp1/tinysense/ts_first.csv',
+              'data/exp1/mocap/mocap_first.csv')
+
+
+def time_engine(cf_data, ts_data, mocap_data, engine, repeat):
+    """Returns the best wall time and the estimates of one engine."""
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            q_est = kalman_filter_from_1cm_optic(cf_data, ts_data, mocap_data, engine=engine)[3]
+        best = min(best, time.perf_counter() - start)
+    return best, q_est
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--lengths", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--max-loop-length", type=int, default=100000,
+                        help="longest log to also run through the sequential loop")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        cf_data, ts_data, mocap_data = preprocess_data(*EXPERIMENT, 0)
+    mocap_data = interpolate_mocap(mocap_data)
+
+    print(f"{'samples':>10} {'loop (s)':>10} {'scan (s)':>10} {'speedup':>8} {'max |diff|':>11}")
+    for length in args.lengths:
+        ts_long = tile_flight(ts_data, length)
+        scan_time, q_scan = time_engine(cf_data, ts_long, mocap_data, "scan", args.repeat)
+        if length <= args.max_loop_length:
+            loop_time, q_loop = time_engine(cf_data, ts_long, mocap_data, "loop", 1)
+            diff = np.max(np.abs(q_loop - q_scan))
+            print(f"{length:>10} {loop_time:>10.4f} {scan_time:>10.4f} {loop_time / scan_time:>8.1f} {diff:>11.2e}")
+        else:
+            print(f"{length:>10} {'-':>10} {scan_time:>10.4f} {'-':>8} {'-':>11}")
+
+
+if __name__ == "__main__":
+    main()
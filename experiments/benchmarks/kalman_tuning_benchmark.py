@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Gradient-based Kalman tuning against a random grid sweep.
+
+Both search the Q and R parameters of the three flights jointly for the
+lowest tuning_loss (TinySense vs mocap RMS of vx, theta in degrees and z).
+The sweep samples candidates log-uniformly within a decade of the paper's
+parameters.  Run from the experiments folder:
+
+    python -m benchmarks.kalman_tuning_benchmark --candidates 5000
+"""
+
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+
+from TinySense.data_processing import DEFAULT_KALMAN_PARAMS, interpolate_mocap, preprocess_data
+from TinySense.data_processing_find_optimal import (TUNING_METRICS, prepare_sweep_data, sweep_kalman_params,
+                                                    tune_kalman_params)
+from TinySense.runner import discover_experiments
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--candidates", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    experiments = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for experiment in discover_experiments("data", skip_incomplete=True):
+            cf_data, ts_data, mocap_data = preprocess_data(experiment["cf"], experiment["ts"], experiment["mocap"],
+                                                           experiment["experiment_num"])
+            experiments.append(prepare_sweep_data(cf_data, ts_data, interpolate_mocap(mocap_data)))
+
+    start = time.perf_counter()
+    params, result = tune_kalman_params(experiments)
+    seconds = time.perf_counter() - start
+    print(f"initial loss {result.history[0]:.4f}")
+    print(f"gradient:  loss {result.fun:.4f} after {result.nfev} evaluations in {seconds:.2f} s")
+
+    rng = np.random.default_rng(args.seed)
+    candidates = np.tile(DEFAULT_KALMAN_PARAMS, (args.candidates, 1))
+    candidates[:, 3:] *= 10 ** rng.uniform(-1, 1, (args.candidates, 5))
+    start = time.perf_counter()
+    with np.errstate(over="ignore", invalid="ignore"):  # Unstable candidates diverge and score inf/NaN
+        table = sweep_kalman_params(experiments, candidates)
+    seconds = time.perf_counter() - start
+    losses = table[TUNING_METRICS].sum(axis=1)
+    print(f"sweep:     loss {losses.min():.4f} after {args.candidates} evaluations in {seconds:.2f} s")
+    print(f"gradient params: {np.array2string(params, precision=4)}")
+    print(f"sweep params:    {np.array2string(candidates[losses.idxmin()], precision=4)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Accuracy and throughput of TinySense.lk_pyramid on synthetic camera recordings.
+
+A smoothed noise texture is moved by a random motion of up to --max-shift
+pixels per frame and cropped to 160x120.  The pyramidal engine is compared
+with the single-scale firmware port (run on the 40x30 decimated frames, as
+on the device) for increasing motion.  Run from the experiments folder:
+
+    python -m benchmarks.lk_pyramid_benchmark --frames 2000 --workers 2
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from TinySense.lk_optic_flow import SKIP_FACTOR, optic_flow_sequence
+from TinySense.lk_pyramid import pyramidal_flow
+from TinySense.synthetic import synthetic_recording
+
+
+def rms(estimate, truth):
+    return np.sqrt(np.mean((estimate[1:] - truth[1:]) ** 2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--frames", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'shift (px)':>10} {'firmware RMS':>13} {'pyramid RMS':>12} {'pyramid fps':>12}")
+    for max_shift in (0.5, 2, 4, 8):
+        frames, truth = synthetic_recording(args.frames, max_shift)
+        firmware = optic_flow_sequence(frames) * SKIP_FACTOR  # Back to full-resolution pixels
+        start = time.perf_counter()
+        flows = pyramidal_flow(frames, n_workers=args.workers)
+        seconds = time.perf_counter() - start
+        print(f"{max_shift:>10} {rms(firmware, truth):>13.3f} {rms(flows, truth):>12.3f} "
+              f"{len(frames) / seconds:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
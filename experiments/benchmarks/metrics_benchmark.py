@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized error metrics against one sklearn root_mean_squared_error call per number.
+
+Scores the estimates of many candidates of one flight, as a Kalman sweep
+does: sklearn is called for each of the 9 (pair, channel) RMS values of
+every candidate, the metrics engine computes RMS, MAE, bias and max error of
+all candidates in one pass.  Rolling RMS and bootstrap intervals of one
+candidate are timed too.  Run from the experiments folder:
+
+    python -m benchmarks.metrics_benchmark --candidates 2000
+"""
+
+import argparse
+import time
+
+import numpy as np
+from sklearn.metrics import root_mean_squared_error
+
+from TinySense.metrics import bootstrap_ci, error_statistics, pair_errors, rolling_rms, source_channels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--candidates", type=int, default=2000)
+    parser.add_argument("--samples", type=int, default=400, help="Crazyflie samples of the flight")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    n = args.samples
+    cf_data = rng.normal(size=(n, 7))
+    mocap = rng.normal(size=(n, 4))
+    q = rng.normal(size=(args.candidates, n, 3))
+
+    start = time.perf_counter()
+    channels = source_channels(cf_data, mocap, q)
+    statistics = error_statistics(pair_errors(channels))
+    engine_seconds = time.perf_counter() - start
+
+    sklearn_candidates = min(args.candidates, 200)
+    start = time.perf_counter()
+    reference = np.empty((sklearn_candidates, 3, 3))
+    for k in range(sklearn_candidates):
+        sources = source_channels(cf_data, mocap, q[k])
+        for p, (a, b) in enumerate((("ts", "mocap"), ("cf", "mocap"), ("ts", "cf"))):
+            for c in range(3):
+                reference[k, p, c] = root_mean_squared_error(sources[b][c], sources[a][c])
+    sklearn_seconds = (time.perf_counter() - start) * args.candidates / sklearn_candidates
+
+    error = np.max(np.abs(statistics[:sklearn_candidates, ..., 0] - reference))
+    print(f"{args.candidates} candidates x 9 RMS values, {n} samples")
+    print(f"  sklearn: {sklearn_seconds:7.3f} s (extrapolated from {sklearn_candidates})")
+    print(f"  engine:  {engine_seconds:7.3f} s for RMS, MAE, bias and max, max RMS difference {error:.1e}")
+
+    errors = pair_errors(source_channels(cf_data, mocap, q[0]))
+    start = time.perf_counter()
+    rolling_rms(errors, 50)
+    print(f"  rolling RMS of 9 series: {(time.perf_counter() - start) * 1e3:.2f} ms")
+    start = time.perf_counter()
+    bootstrap_ci(errors, n_boot=1000, block=20, seed=args.seed)
+    print(f"  bootstrap CI of 9 series, 1000 replicates: {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
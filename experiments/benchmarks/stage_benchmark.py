@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Stage-level benchmark suite of the experiments pipeline.
+
+Every stage of main.py is timed on each flight in data/exp* and on copies of
+its raw CSVs tiled to 10x, 100x and 1000x their length:
+
+* preprocess: preprocess_data on the CSV files
+* interpolate_mocap
+* kalman_loop and kalman_scan: kalman_filter_from_1cm_optic with each engine
+* downsample: alignment of the estimates and mocap to the Crazyflie timestamps
+* rms: compute_rms
+* plot_sensors and plot_estimates: the plotting functions, drawn with Agg
+
+Scaled flights keep the whole tiled log (time_window covers it) so the
+downstream stages see the scaled length too.  Wall time is the best of
+--repeat runs; peak memory comes from one extra run under tracemalloc.  Each
+run is appended to a JSON history file and compared with the previous run
+there; stages slower or larger than --threshold are flagged.  Run from the
+experiments folder:
+
+    python -m benchmarks.stage_benchmark --scales 1 10 100
+    python -m benchmarks.stage_benchmark --stages kalman_scan rms --fail-on-regression
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from TinySense.alignment import align
+from TinySense.data_processing import preprocess_data, interpolate_mocap, kalman_filter_from_1cm_optic
+from TinySense.plotting import plot_data_all_sensors_bw, plot_estimates_all
+from TinySense.runner import compute_rms, discover_experiments
+
+STAGES = ("preprocess", "interpolate_mocap", "kalman_loop", "kalman_scan", "downsample", "rms",
+          "plot_sensors", "plot_estimates")
+DEFAULT_HISTORY = os.path.join("benchmarks", "stage_history.json")
+TIME_COLUMNS = {"cf": "timestamp", "ts": "timestamp", "mocap": "Time"}
+
+
+def tile_csv(path, scale, output):
+    """Writes a raw log repeated scale times back to back, continuing its timestamps."""
+    data = pd.read_csv(path)
+    column = TIME_COLUMNS["mocap"] if "Time" in data.columns else TIME_COLUMNS["ts"]
+    times = data[column].to_numpy(dtype="float64")
+    period = times[-1] - times[0] + np.median(np.diff(times))
+    tiled = pd.concat([data] * scale, ignore_index=True)
+    tiled[column] = np.tile(times, scale) + np.repeat(np.arange(scale) * period, len(data))
+    tiled.to_csv(output, index=False, float_format="%.17g")
+
+
+def scaled_experiment(experiment, scale, work_dir):
+    """Paths of the experiment's CSVs tiled to scale; the originals for scale 1."""
+    if scale == 1:
+        return experiment
+    scaled = dict(experiment)
+    for key in TIME_COLUMNS:
+        output = os.path.join(work_dir, f"{experiment['name']}_{key}_x{scale}.csv")
+        tile_csv(experiment[key], scale, output)
+        scaled[key] = output
+    return scaled
+
+
+def _run_preprocess(state):
+    params = {} if state["scale"] == 1 else {"time_window": np.inf}
+    experiment = state["experiment"]
+    state["cf"], state["ts"], state["mocap_raw"] = preprocess_data(
+        experiment["cf"], experiment["ts"], experiment["mocap"], experiment["experiment_num"], **params)
+    return len(state["cf"]) + len(state["ts"]) + len(state["mocap_raw"])
+
+
+def _run_interpolate(state):
+    state["mocap"] = interpolate_mocap(state["mocap_raw"])
+    return len(state["mocap"])
+
+
+def _run_kalman(engine):
+    def run(state):
+        result = kalman_filter_from_1cm_optic(state["cf"], state["ts"], state["mocap"], engine=engine)
+        state["kalman"] = result
+        return len(result[1])
+    return run
+
+
+def _run_downsample(state):
+    cf_data, ts_data, mocap_data, q_est, zero_idx, zero_idx_cf, zero_idx_mocap, K = state["kalman"]
+    query = cf_data[zero_idx_cf:, 0]
+    align(q_est[zero_idx:, 0], q_est[zero_idx:], query)
+    align(mocap_data[zero_idx_mocap:, 0], mocap_data[zero_idx_mocap:], query)
+    return len(q_est) - zero_idx + len(mocap_data) - zero_idx_mocap
+
+
+def _run_rms(state):
+    cf_data, ts_data, mocap_data, q_est, zero_idx, zero_idx_cf, zero_idx_mocap, K = state["kalman"]
+    compute_rms(cf_data, mocap_data, q_est, zero_idx, zero_idx_cf, zero_idx_mocap)
+    return len(cf_data) - zero_idx_cf
+
+
+def _run_plot_sensors(state):
+    fig, axs = plt.subplots(3, 1, squeeze=False)
+    plot_data_all_sensors_bw(state["cf"], state["ts"], state["mocap"], axs, 0, "(a)")
+    fig.canvas.draw()
+    plt.close(fig)
+    return len(state["cf"]) + len(state["ts"]) + len(state["mocap"])
+
+
+def _run_plot_estimates(state):
+    cf_data, ts_data, mocap_data, q_est, zero_idx, zero_idx_cf, zero_idx_mocap, K = state["kalman"]
+    fig, axs = plt.subplots(3, 1, squeeze=False)
+    plot_estimates_all(cf_data, ts_data, mocap_data, q_est, axs, 0, "(a)", zero_idx, zero_idx_cf, zero_idx_mocap)
+    fig.canvas.draw()
+    plt.close(fig)
+    return len(cf_data) + len(q_est) + len(mocap_data)
+
+
+RUNNERS = {"preprocess": _run_preprocess, "interpolate_mocap": _run_interpolate,
+           "kalman_loop": _run_kalman("loop"), "kalman_scan": _run_kalman("scan"),
+           "downsample": _run_downsample, "rms": _run_rms,
+           "plot_sensors": _run_plot_sensors, "plot_estimates": _run_plot_estimates}
+
+
+def measure(run, state, repeat):
+    """Best wall time over repeat runs, peak traced memory of one more run, and samples."""
+    seconds = np.inf
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            samples = int(run(state))
+            seconds = min(seconds, time.perf_counter() - start)
+        tracemalloc.start()
+        run(state)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return seconds, peak, samples
+
+
+def run_suite(experiments, scales, stages, repeat=1, max_loop_samples=200000):
+    """Benchmark records of every stage, experiment and scale."""
+    records = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for scale in scales:
+            for experiment in experiments:
+                state = {"experiment": scaled_experiment(experiment, scale, work_dir), "scale": scale}
+                # Every stage needs the outputs of the ones before it, so all of them run
+                for stage in STAGES:
+                    if stage == "kalman_loop" and (stage not in stages or len(state["ts"]) > max_loop_samples):
+                        continue  # kalman_scan produces the same estimates; the loop is too slow for long logs
+                    if stage not in stages:
+                        with contextlib.redirect_stdout(io.StringIO()):
+                            RUNNERS[stage](state)
+                        continue
+                    seconds, peak, samples = measure(RUNNERS[stage], state, repeat)
+                    records.append({"stage": stage, "experiment": experiment["name"], "scale": scale,
+                                    "samples": samples, "seconds": seconds, "peak_bytes": peak,
+                                    "samples_per_second": samples / seconds})
+                    print(f"{stage:>17} {experiment['name']:>6} x{scale:<5} {samples:>10} "
+                          f"{seconds:>9.4f} s {peak / 1e6:>9.1f} MB {samples / seconds:>12.0f} /s")
+    return records
+
+
+def find_regressions(records, previous, threshold, min_seconds=0.005):
+    """Records slower or with a larger memory peak than in the previous run by more than threshold.
+
+    Time differences under min_seconds are timer noise and never flagged.
+    """
+    before = {(r["stage"], r["experiment"], r["scale"]): r for r in previous}
+    regressions = []
+    for record in records:
+        old = before.get((record["stage"], record["experiment"], record["scale"]))
+        if old is None:
+            continue
+        for metric in ("seconds", "peak_bytes"):
+            if metric == "seconds" and record[metric] - old[metric] < min_seconds:
+                continue
+            if record[metric] > old[metric] * (1 + threshold):
+                regressions.append(dict(record, metric=metric, previous=old[metric],
+                                        ratio=record[metric] / old[metric]))
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--experiments", nargs="+", help="experiment names to run (default all)")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--max-loop-samples", type=int, default=200000,
+                        help="longest TinySense log to also run through the sequential Kalman loop")
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="JSON file the runs are appended to")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative increase flagged as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    experiments = discover_experiments(args.data_dir, skip_incomplete=True)
+    if args.experiments:
+        experiments = [e for e in experiments if e["name"] in args.experiments]
+    records = run_suite(experiments, args.scales, args.stages, args.repeat, args.max_loop_samples)
+
+    history = []
+    if os.path.exists(args.history):
+        with open(args.history) as file:
+            history = json.load(file)
+    regressions = find_regressions(records, history[-1]["records"], args.threshold) if history else []
+    history.append({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "revision": git_revision(),
+                    "python": platform.python_version(), "machine": platform.node(),
+                    "records": records})
+    with open(f"{args.history}.tmp", "w") as file:
+        json.dump(history, file, indent=1)
+    os.replace(f"{args.history}.tmp", args.history)  # A failed write keeps the old history
+
+    print(f"Appended run {len(history)} to {args.history}")
+    for r in regressions:
+        print(f"REGRESSION {r['stage']} {r['experiment']} x{r['scale']}: {r['metric']} "
+              f"{r['previous']:.4g} -> {r[r['metric']]:.4g} ({r['ratio']:.2f}x)")
+    if regressions and args.fail_on_regression:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Accuracy and speed of the cross-correlation clock alignment on long logs.
+
+A synthetic flight with sensor dropouts is preprocessed, then the TinySense
+and Crazyflie timestamps are shifted by a known offset (a fraction of a
+sample period) and stretched by a known drift.  estimate_sync has to recover
+both; it is timed for offset-only and drift estimation.  Run from the
+experiments folder:
+
+    python -m benchmarks.sync_benchmark --duration 600
+"""
+
+import argparse
+import tempfile
+import time
+
+from TinySense.data_processing import preprocess_data
+from TinySense.synthetic import generate_flight
+from TinySense.sync import estimate_sync
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--duration", type=float, default=600.0, help="flight length in seconds")
+    parser.add_argument("--offset", type=float, default=0.0137, help="injected offset in seconds")
+    parser.add_argument("--drift", type=float, default=200e-6, help="injected clock drift")
+    parser.add_argument("--dropout-rate", type=float, default=0.02, help="gaps per second in each log")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        paths, rows = generate_flight(folder, args.duration, seed=args.seed, dropout_rate=args.dropout_rate)
+        cf_data, ts_data, mocap_data = preprocess_data(paths["cf"], paths["ts"], paths["mocap"], 1,
+                                                       time_window=args.duration)
+    print(f"{args.duration:.0f} s flight, rows: {rows}")
+
+    for source, data in (("ts", ts_data), ("cf", cf_data)):
+        # The zero-offset estimate is the baseline the injected shift is measured against
+        base_offset, base_drift, _ = estimate_sync(data, source, mocap_data, drift=True)
+        shifted = data.copy()
+        shifted["timestamp"] = data["timestamp"] * (1 + args.drift) + args.offset
+        for drift in (False, True):
+            start = time.perf_counter()
+            offset, drift_rate, peak = estimate_sync(shifted, source, mocap_data, drift=drift)
+            seconds = time.perf_counter() - start
+            mode = "drift " if drift else "offset"
+            print(f"  {source} {mode}: offset {(offset - base_offset) * 1e3:7.3f} ms, "
+                  f"drift {(drift_rate - base_drift * drift) * 1e6:6.1f} ppm, correlation {peak:.2f}, "
+                  f"{seconds * 1e3:6.1f} ms")
+    print(f"  injected:     offset {args.offset * 1e3:7.3f} ms, drift {args.drift * 1e6:6.1f} ppm "
+          "(offset mode absorbs the mean drift)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput and latency benchmark of the telemetry ingestion pipeline.
+
+Replays the first flight's TinySense log through TelemetryReader into a
+RingBuffer, either in-process or through a pseudo-terminal, and reports
+records per second and the delay between a record's release by the replay
+source and the wall-clock time at which the reader made it available in the
+ring buffer.  (The record stamps are interpolated between chunk arrivals, so
+they are not used.)  Run from the experiments folder:
+
+    python -m benchmarks.telemetry_benchmark --speed 10 --repeat 20
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from TinySense.telemetry import ReplaySource, RingBuffer, TelemetryReader, replay_to_pty
+
+TS_PATH = "data/exp1/tinysense/ts_first.csv"
+
+
+def run(source, n_records, chunk_size):
+    """Reads source to the end and returns (seconds, ring buffer, arrival time of every record)."""
+    buffer = RingBuffer(n_records)
+    reader = TelemetryReader(source, buffer, chunk_size=chunk_size, record_arrivals=True)
+    start = time.perf_counter()
+    reader.start()
+    reader.join()
+    return time.perf_counter() - start, buffer, reader.arrival_times()
+
+
+def report(label, seconds, buffer, arrival_times, release_times):
+    records = buffer.latest()
+    line = f"{label:<22} {len(records):>9} records {len(records) / seconds:>12.0f} rec/s"
+    if len(arrival_times) == len(release_times) and np.isfinite(release_times).all():
+        latency = (arrival_times - release_times) * 1e3
+        line += f"   latency p50 {np.percentile(latency, 50):.3f} ms  p99 {np.percentile(latency, 99):.3f} ms"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--speed", type=float, default=10.0, help="replay rate for the paced runs")
+    parser.add_argument("--repeat", type=int, default=20, help="times the flight is replayed back to back")
+    parser.add_argument("--chunk-size", type=int, default=4096)
+    args = parser.parse_args()
+
+    for speed in (None, args.speed):
+        label = "unpaced" if speed is None else f"{speed:g}x real time"
+
+        source = ReplaySource(TS_PATH, speed=speed, repeat=args.repeat)
+        seconds, buffer, arrival_times = run(source, len(source), args.chunk_size)
+        report(f"in-process, {label}", seconds, buffer, arrival_times, source.release_times)
+
+        device, writer, source = replay_to_pty(TS_PATH, speed=speed, repeat=args.repeat)
+        with open(device, "rb", buffering=0) as port:
+            seconds, buffer, arrival_times = run(port, len(source), args.chunk_size)
+        writer.join()
+        report(f"pty, {label}", seconds, buffer, arrival_times, source.release_times)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures of the TinySense tests.
+
+Run from the experiments folder with python -m pytest.  Tests on recorded
+flights use data/exp1; longer logs are generated with TinySense.synthetic.
+"""
+
+import contextlib
+import io
+import os
+import tempfile
+
+import pytest
+
+# Keep preprocessing caches out of the working tree; read when TinySense.cache is imported
+os.environ.setdefault("TINYSENSE_CACHE_DIR", tempfile.mkdtemp(prefix="tinysense_cache_"))
+
+from TinySense.synthetic import generate_flight  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+EXPERIMENT = tuple(os.path.join(DATA_DIR, "exp1", folder, f"{key}_first.csv")
+                   for folder, key in (("crazyflie", "cf"), ("tinysense", "ts"), ("mocap", "mocap")))
+
+
+def quiet(func, *args, **kwargs):
+    """Calls func with its progress prints silenced."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+@pytest.fixture(scope="session")
+def synthetic_flight(tmp_path_factory):
+    """Paths by source key of a 120 s synthetic flight."""
+    paths, _ = generate_flight(str(tmp_path_factory.mktemp("flight")), 120.0, seed=1)
+    return paths
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Round trip of flight archives against the CSVs they were written from.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from TinySense.archive import FlightArchive, write_archive
+from TinySense.loaders import load_flight_log
+from conftest import EXPERIMENT
+
+SOURCES = dict(zip(("crazyflie", "tinysense", "mocap"), EXPERIMENT))
+
+
+@pytest.fixture(scope="module")
+def archive_path(tmp_path_factory):
+    return write_archive(str(tmp_path_factory.mktemp("archive") / "exp1.tsa"), SOURCES, chunk_rows=500)
+
+
+@pytest.mark.parametrize("source", SOURCES)
+def test_whole_log_round_trip(archive_path, source):
+    frame = pd.read_csv(SOURCES[source])
+    with FlightArchive(archive_path) as archive:
+        log = archive.read_window(source)
+        assert archive.columns(source) == list(frame.columns)
+        for name in frame.columns[1:]:
+            if frame[name].dtype == object:
+                np.testing.assert_array_equal(np.array(archive.labels(source, name))[log[name].astype(int)],
+                                              frame[name])
+            else:
+                np.testing.assert_array_equal(log[name], frame[name])
+    np.testing.assert_array_equal(log["timestamp"], frame.iloc[:, 0])
+
+
+@pytest.mark.parametrize("source", SOURCES)
+def test_loaders_read_archives_like_csvs(archive_path, source):
+    expected = load_flight_log(SOURCES[source], source)
+    log = load_flight_log(archive_path, source)
+    assert log.columns == expected.columns
+    np.testing.assert_array_equal(log.data, expected.data)
+
+
+def test_windows_match_time_masks(archive_path):
+    frame = pd.read_csv(SOURCES["mocap"])
+    times = frame["Time"].to_numpy()
+    rng = np.random.default_rng(0)
+    with FlightArchive(archive_path) as archive:
+        for t0 in rng.uniform(times[0] - 1, times[-1], 20):
+            log = archive.read_window("mocap", t0, t0 + 2.5, ["pose.position.z", "header.seq"])
+            mask = (times > t0) & (times <= t0 + 2.5)
+            assert log.columns == ("timestamp", "pose.position.z", "header.seq")
+            np.testing.assert_array_equal(log["timestamp"], times[mask])
+            np.testing.assert_array_equal(log["pose.position.z"], frame["pose.position.z"][mask])
+            np.testing.assert_array_equal(log["header.seq"], frame["header.seq"][mask])
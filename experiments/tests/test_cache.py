@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Keys and hits of the preprocessed experiment cache.
+"""
+
+import numpy as np
+import pytest
+
+from TinySense import cache
+from conftest import EXPERIMENT, quiet
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    cache.stats.update(hits=0, misses=0)
+    return str(tmp_path / "cache")
+
+
+def test_warm_load_matches_cold_load(cache_dir):
+    cold = quiet(cache.load_experiment, *EXPERIMENT, 0, cache_dir=cache_dir)
+    warm = quiet(cache.load_experiment, *EXPERIMENT, 0, cache_dir=cache_dir)
+    assert cache.stats == {"hits": 1, "misses": 1}
+    for a, b in zip(cold, warm):
+        assert a.columns == b.columns
+        np.testing.assert_array_equal(a.data, b.data)
+
+
+@pytest.mark.parametrize("module", ["TinySense.data_processing", "TinySense.loaders"])
+def test_preprocessing_edits_invalidate_entries(cache_dir, monkeypatch, module):
+    quiet(cache.load_experiment, *EXPERIMENT, 0, cache_dir=cache_dir)
+    source = cache._module_source
+    monkeypatch.setattr(cache, "_module_source", lambda name: source(name) + ("\n# edited\n" if name == module else ""))
+    quiet(cache.load_experiment, *EXPERIMENT, 0, cache_dir=cache_dir)
+    assert cache.stats == {"hits": 0, "misses": 2}
+    assert len(cache.list_entries(cache_dir)) == 2
+
+
+def test_chunked_entries_are_keyed_apart(cache_dir):
+    params = cache.preprocess_params(0)
+    assert cache.cache_key(EXPERIMENT, params) != cache.cache_key(EXPERIMENT, params, chunked=True)
+
+    quiet(cache.load_experiment, *EXPERIMENT, 0, cache_dir=cache_dir)
+    chunked = quiet(cache.load_experiment, *EXPERIMENT, 0, cache_dir=cache_dir, chunked=True, block_rows=500)
+    in_memory = quiet(cache.load_experiment, *EXPERIMENT, 0, cache_dir=cache_dir)
+    assert cache.stats == {"hits": 1, "misses": 2}
+    for a, b in zip(chunked, in_memory):
+        np.testing.assert_allclose(a.data, b.data, rtol=1e-9, atol=1e-9)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+CameraCapture stream decoding and the frame store.
+"""
+
+import numpy as np
+
+from TinySense.camera import FrameDecoder, FrameStore, decode_pixels, encode_debug, encode_frame, encode_pixels
+
+
+def test_pixels_round_trip():
+    pixels = np.arange(256, dtype=np.uint8)
+    raw = encode_pixels(pixels)
+    assert np.all(raw != 0)
+    decoded, ok = decode_pixels(raw)
+    np.testing.assert_array_equal(decoded, pixels & 0xF8)
+    assert ok.all()
+
+
+def test_parity_errors_are_flagged():
+    raw = encode_pixels(np.arange(256, dtype=np.uint8))
+    raw[::3, 0] ^= 0b00000100  # One of the bits H repeats
+    _, ok = decode_pixels(raw)
+    np.testing.assert_array_equal(ok, np.arange(256) % 3 != 0)
+
+
+def test_stream_in_arbitrary_chunks():
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 256, (5, 12, 16), dtype=np.uint8)
+    stream = b"boot text" + encode_debug("hello") + b"".join(map(encode_frame, frames))
+    # Bytes of the third frame are lost; the decoder drops it and resynchronizes
+    cut = stream.index(encode_frame(frames[2])) + 100
+    stream = stream[:cut] + stream[cut + 50:]
+
+    decoder = FrameDecoder()
+    decoded = []
+    for start in range(0, len(stream), 97):
+        decoded += decoder.feed(stream[start:start + 97], float(start))
+    assert [frame_num for frame_num, *_ in decoded] == [0, 1, 3, 4]
+    for (frame_num, _, pixels, parity_errors), expected in zip(decoded, frames[[0, 1, 3, 4]]):
+        np.testing.assert_array_equal(pixels, expected & 0xF8)
+        assert parity_errors == 0
+    assert decoder.dropped_frames == 1
+    assert [text for _, text in decoder.messages] == ["hello"]
+    assert decoder.skipped_bytes == len(b"boot text")
+
+
+def test_frame_store_windows(tmp_path):
+    store = FrameStore(str(tmp_path / "session"), width=16, height=12)
+    frames = np.arange(10 * 12 * 16, dtype=np.uint32).astype(np.uint8).reshape(10, 12, 16)
+    store.extend((k, 0.5 * k, frame, 0) for k, frame in enumerate(frames))
+    store.close()
+
+    store = FrameStore(str(tmp_path / "session"))
+    assert len(store) == 10
+    window, index = store.time_window(1.0, 3.0)
+    np.testing.assert_array_equal(window, frames[2:6])
+    np.testing.assert_array_equal(index["frame_num"], [2, 3, 4, 5])
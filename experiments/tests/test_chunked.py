@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+Equivalence of chunked and in-memory preprocessing.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from TinySense.chunked import write_chunked
+from TinySense.data_processing import interpolate_mocap, preprocess_data
+from conftest import quiet
+
+
+@pytest.mark.parametrize("block_rows", [997, 100_000])
+def test_chunked_matches_in_memory(synthetic_flight, tmp_path, block_rows):
+    paths = synthetic_flight
+    params = {"time_window": 100}
+    cf_data, ts_data, mocap_data = quiet(preprocess_data, paths["cf"], paths["ts"], paths["mocap"], 1, **params)
+    expected = {"cf": cf_data, "ts": ts_data, "mocap": interpolate_mocap(mocap_data)}
+
+    columns = quiet(write_chunked, paths["cf"], paths["ts"], paths["mocap"], 1, str(tmp_path), block_rows, **params)
+    for name, log in expected.items():  # The smoothing passes run in a different order, so equal up to rounding
+        chunked = np.load(os.path.join(tmp_path, f"{name}.npy"))
+        assert chunked.shape == log.shape
+        np.testing.assert_allclose(chunked, log.to_numpy(), rtol=1e-9, atol=1e-9, err_msg=name)
+    assert {name: list(names) for name, names in columns.items()} == \
+        {name: list(log.columns) for name, log in expected.items()}
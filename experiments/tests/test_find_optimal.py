@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Kalman tuning helpers on the logs of preprocess_data.
+"""
+
+import numpy as np
+import pytest
+
+from TinySense.data_processing import DEFAULT_KALMAN_PARAMS, interpolate_mocap, params_to_weights, preprocess_data
+from TinySense.data_processing_find_optimal import kalman_filter_optimal_pure_tinysense, prepare_sweep_data
+from TinySense.flight_log import FlightLog
+from conftest import EXPERIMENT, quiet
+
+
+@pytest.fixture(scope="module")
+def logs():
+    cf_data, ts_data, mocap_data = quiet(preprocess_data, *EXPERIMENT, 0)
+    return cf_data, ts_data, interpolate_mocap(mocap_data)
+
+
+def test_filter_accepts_flight_logs(logs):
+    assert all(isinstance(log, FlightLog) for log in logs)
+    before = logs[1].copy()
+    G, Q, R = (weights[0] for weights in params_to_weights(DEFAULT_KALMAN_PARAMS[None]))
+    from_logs = kalman_filter_optimal_pure_tinysense(*logs, G, Q, R)
+    from_frames = kalman_filter_optimal_pure_tinysense(*(log.to_frame() for log in logs), G, Q, R)
+    np.testing.assert_array_equal(from_logs[3], from_frames[3])
+    assert from_logs[4:7] == from_frames[4:7]
+    np.testing.assert_array_equal(logs[1].data, before.data)
+
+    ts_data = from_logs[1]
+    early = ts_data[:, 0] < 1.8
+    assert np.all(ts_data[early, 3] == 0.01) and np.all(ts_data[early, 1] == 0)
+
+
+def test_sweep_data_accepts_flight_logs(logs):
+    from_logs = prepare_sweep_data(*logs)
+    from_frames = prepare_sweep_data(*(log.to_frame() for log in logs))
+    assert from_logs.keys() == from_frames.keys()
+    for name in from_logs:
+        np.testing.assert_array_equal(from_logs[name], from_frames[name], err_msg=name)
+    assert from_logs["ts_data"][0, 0] == 0
+
+
+@pytest.mark.parametrize("sync", ["offset", "drift"])
+def test_synced_logs_start_at_first_sample_after_zero(sync):
+    cf_data, ts_data, mocap_data = quiet(preprocess_data, *EXPERIMENT, 0, sync=sync)
+    mocap_data = interpolate_mocap(mocap_data)
+    assert not np.any(ts_data[:, 0] == 0)  # Synced clocks leave no sample exactly at zero
+
+    G, Q, R = (weights[0] for weights in params_to_weights(DEFAULT_KALMAN_PARAMS[None]))
+    _, _, _, q_est, zero_idx_ts, zero_idx_cf, _, _ = kalman_filter_optimal_pure_tinysense(
+        cf_data, ts_data, mocap_data, G, Q, R)
+    assert ts_data[zero_idx_ts - 1, 0] < 0 <= ts_data[zero_idx_ts, 0]
+    assert cf_data[zero_idx_cf - 1, 0] < 0 <= cf_data[zero_idx_cf, 0]
+    assert np.all(np.isfinite(q_est[zero_idx_ts:]))
+
+    data = prepare_sweep_data(cf_data, ts_data, mocap_data)
+    assert data["ts_data"][0, 0] == ts_data[zero_idx_ts, 0]
+    assert data["cf_data"][0, 0] == cf_data[zero_idx_cf, 0]
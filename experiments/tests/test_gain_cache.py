@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Accuracy of the steady-state gain cache against control.lqe.
+"""
+
+import control
+import numpy as np
+import pytest
+
+from TinySense import gain_cache
+from TinySense.data_processing import params_to_weights, state_space_model
+from TinySense.synthetic import kalman_weight_workloads
+
+
+@pytest.mark.parametrize("workload", ["repeat", "nearby", "scattered"])
+def test_gains_match_lqe(workload):
+    A, B, C, D = state_space_model()
+    params = kalman_weight_workloads(40, np.random.default_rng(0))[workload]
+    G, Q, R = params_to_weights(params)
+    gain_cache.clear()
+    for k in range(len(params)):
+        L_ref, P_ref, _ = control.lqe(A, G[k], C, Q[k], R[k])
+        L, P = gain_cache.steady_state_gain(A, G[k], C, Q[k], R[k])[:2]
+        np.testing.assert_allclose(L, L_ref, rtol=1e-9, atol=1e-12 * np.abs(L_ref).max())
+        np.testing.assert_allclose(P, P_ref, rtol=1e-9, atol=1e-12 * np.abs(P_ref).max())
+
+
+def test_disk_cache_serves_other_processes(tmp_path):
+    A, B, C, D = state_space_model()
+    G, Q, R = params_to_weights(kalman_weight_workloads(1, np.random.default_rng(0))["repeat"])
+    try:
+        gain_cache.configure(cache_dir=str(tmp_path))
+        gain_cache.clear()
+        first = gain_cache.steady_state_gain(A, G[0], C, Q[0], R[0])
+        gain_cache.clear()  # Forget the memory entries, as a new worker would start
+        second = gain_cache.steady_state_gain(A, G[0], C, Q[0], R[0])
+        for a, b in zip(first, second):
+            np.testing.assert_array_equal(a, b)
+        assert "1 disk hits" in gain_cache.report()
+    finally:
+        gain_cache.configure(cache_dir=False)
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+Equivalence of the Kalman observer engines.
+"""
+
+import numpy as np
+
+from TinySense.data_processing import interpolate_mocap, kalman_filter_from_1cm_optic, preprocess_data
+from TinySense.synthetic import tile_flight
+from conftest import EXPERIMENT, quiet
+
+
+def test_scan_matches_loop():
+    cf_data, ts_data, mocap_data = quiet(preprocess_data, *EXPERIMENT, 0)
+    mocap_data = interpolate_mocap(mocap_data)
+    ts_long = tile_flight(ts_data, 5000)
+    loop = quiet(kalman_filter_from_1cm_optic, cf_data, ts_long, mocap_data, engine="loop")
+    scan = quiet(kalman_filter_from_1cm_optic, cf_data, ts_long, mocap_data, engine="scan")
+    np.testing.assert_allclose(scan[3], loop[3], rtol=0, atol=1e-9)
+    np.testing.assert_array_equal(scan[7], loop[7])
+    assert scan[4:7] == loop[4:7]
+
+
+def test_filter_leaves_its_inputs_unchanged():
+    cf_data, ts_data, mocap_data = quiet(preprocess_data, *EXPERIMENT, 0)
+    mocap_data = interpolate_mocap(mocap_data)
+    before = ts_data.copy()
+    quiet(kalman_filter_from_1cm_optic, cf_data, ts_data, mocap_data)
+    np.testing.assert_array_equal(ts_data.data, before.data)
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""
+Batched Lucas-Kanade port against a transliteration of the firmware.
+"""
+
+import numpy as np
+
+from TinySense.lk_optic_flow import OF_HEIGHT, OF_WIDTH, SKIP_FACTOR, firmware_update, optic_flow_sequence
+from TinySense.synthetic import synthetic_frames
+
+
+def test_port_matches_firmware():
+    frames = synthetic_frames(30)
+    flows = optic_flow_sequence(frames)
+
+    prev = np.zeros((OF_HEIGHT, OF_WIDTH), dtype=np.uint8)
+    reference = []
+    for data in frames[:, ::SKIP_FACTOR, ::SKIP_FACTOR]:
+        reference.append(firmware_update(prev, data))
+        prev = data
+    reference = np.array(reference, dtype=np.float32)
+    assert flows.shape == reference.shape
+    np.testing.assert_allclose(flows, reference, rtol=0, atol=1e-5 * np.abs(reference).max())
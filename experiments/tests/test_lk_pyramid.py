@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Pyramidal Lucas-Kanade flow on synthetic camera recordings.
+"""
+
+import numpy as np
+import pytest
+
+from TinySense.lk_pyramid import flow_rate_series, pair_flows, pyramidal_flow
+from TinySense.synthetic import synthetic_recording
+
+
+@pytest.fixture(scope="module")
+def recording():
+    return synthetic_recording(24, max_shift=4, seed=2)
+
+
+def test_multi_pixel_motion_is_recovered(recording):
+    frames, truth = recording
+    flows = pair_flows(frames)
+    assert flows.shape == truth.shape and flows.dtype == np.float32
+    assert np.abs(truth[1:]).max() > 3
+    np.testing.assert_array_equal(flows[0], [0, 0])
+    np.testing.assert_allclose(flows[1:], truth[1:], rtol=0, atol=0.1)
+
+
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_chunks_match_a_single_call(recording, n_workers):
+    frames, _ = recording
+    expected = pair_flows(frames)
+    np.testing.assert_array_equal(pyramidal_flow(frames, chunk_size=5, n_workers=n_workers), expected)
+
+
+def test_rates_are_radians_per_second():
+    flows = np.array([[9.0, 9.0], [2.0, -1.0], [2.0, -1.0], [4.0, 0.0]])
+    timestamps = np.array([10.0, 10.01, 10.02, 10.02])
+    rates = flow_rate_series(flows, timestamps, fov=1.0, width=40)
+    assert list(rates.columns) == ["timestamp", "optic_flow(rad/s)", "optic_flow_y(rad/s)"]
+    np.testing.assert_array_equal(rates["timestamp"], timestamps)
+    # 2 px of 1/40 rad in 0.01 s; the first frame and a repeated timestamp have no rate
+    np.testing.assert_allclose(rates["optic_flow(rad/s)"], [0, 5, 5, 0])
+    np.testing.assert_allclose(rates["optic_flow_y(rad/s)"], [0, -2.5, -2.5, 0])
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Schema loaders: column order and block joins.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from TinySense.loaders import iter_flight_csv, load_flight_csv, load_flight_log
+from conftest import EXPERIMENT
+
+SOURCES = dict(zip(("crazyflie", "tinysense", "mocap"), EXPERIMENT))
+
+
+@pytest.mark.parametrize("source", SOURCES)
+def test_blocks_join_to_the_whole_log(source):
+    expected = load_flight_csv(SOURCES[source], source)
+    log = load_flight_log(SOURCES[source], source, block_rows=997)
+    assert list(log.columns) == list(expected.columns)
+    np.testing.assert_array_equal(log.data, expected.to_numpy())
+
+
+@pytest.mark.parametrize("source", SOURCES)
+def test_reordered_columns_keep_their_labels(source, tmp_path):
+    data = pd.read_csv(SOURCES[source], dtype=str, keep_default_na=False)  # Same text, columns reversed
+    reordered = tmp_path / "reordered.csv"
+    data[data.columns[::-1]].to_csv(reordered, index=False)
+
+    expected = load_flight_log(SOURCES[source], source)
+    log = load_flight_log(str(reordered), source, block_rows=997)
+    assert log.columns == expected.columns
+    np.testing.assert_array_equal(log.data, expected.data)
+    pd.testing.assert_frame_equal(load_flight_csv(str(reordered), source), load_flight_csv(SOURCES[source], source))
+    block = next(iter_flight_csv(str(reordered), source, columns=expected.columns[:0:-1]))
+    assert list(block.columns) == list(expected.columns)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Units of the RMS table against the full error metrics.
+"""
+
+import numpy as np
+import pytest
+
+from TinySense.data_processing import interpolate_mocap, kalman_filter_from_1cm_optic, preprocess_data
+from TinySense.metrics import CHANNEL_UNITS, bootstrap_ci, error_metrics
+from TinySense.runner import RMS_COLUMNS, RMS_UNITS, downsample_to_cf, rms_errors
+from conftest import EXPERIMENT, quiet
+
+
+@pytest.fixture(scope="module")
+def downsampled():
+    cf_data, ts_data, mocap_data = quiet(preprocess_data, *EXPERIMENT, 0)
+    cf_data, _, mocap_data, q_est, *zero_idx, _ = quiet(kalman_filter_from_1cm_optic, cf_data, ts_data,
+                                                        interpolate_mocap(mocap_data))
+    return downsample_to_cf(cf_data, mocap_data, q_est, *zero_idx)
+
+
+def test_rms_columns_agree_with_error_metrics_in_their_units(downsampled):
+    rms = rms_errors(*downsampled)
+    metrics = error_metrics(*downsampled)
+    assert set(RMS_UNITS) >= set(RMS_COLUMNS)
+    for column in RMS_COLUMNS:
+        expected = metrics[column]
+        if RMS_UNITS[column] == "rad":  # error_metrics has every theta in degrees
+            expected = np.radians(expected)
+        else:
+            assert RMS_UNITS[column] == CHANNEL_UNITS[column.split("_")[2]]
+        assert rms[column] == pytest.approx(expected, rel=1e-12), column
+    assert RMS_UNITS["ts_cf_theta_RMS"] == "rad" and RMS_UNITS["ts_mocap_theta_RMS"] == "deg"
+
+
+@pytest.mark.parametrize("block", [0, -1, 11])
+def test_bootstrap_rejects_blocks_outside_the_series(block):
+    with pytest.raises(ValueError, match="block"):
+        bootstrap_ci(np.ones(10), block=block)
+
+
+def test_bootstrap_accepts_one_block_of_the_whole_series():
+    low, high = bootstrap_ci(np.arange(10.0), n_boot=20, block=10, seed=0)
+    assert low == high == pytest.approx(np.sqrt(np.mean(np.arange(10.0) ** 2)))
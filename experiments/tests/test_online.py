@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming observer against the batch Kalman filter.
+"""
+
+import numpy as np
+import pytest
+
+from TinySense.data_processing import interpolate_mocap, kalman_filter_from_1cm_optic, preprocess_data
+from TinySense.online import estimate_stream
+from conftest import quiet
+
+
+@pytest.fixture(scope="module")
+def logs(synthetic_flight):
+    cf_data, ts_data, mocap_data = quiet(preprocess_data, synthetic_flight["cf"], synthetic_flight["ts"],
+                                         synthetic_flight["mocap"], 0, time_window=200)
+    return cf_data, ts_data, interpolate_mocap(mocap_data)
+
+
+@pytest.mark.parametrize("repeat_every", [0, 37])
+def test_stream_matches_batch_filter(logs, repeat_every):
+    cf_data, ts_data, mocap_data = logs
+    ts_data = ts_data.copy()
+    if repeat_every:
+        t = ts_data["timestamp"]
+        t[repeat_every::repeat_every] = t[repeat_every - 1:-1:repeat_every]
+        t[2 * repeat_every + 1] = t[2 * repeat_every]  # A run of three equal timestamps
+    ts_sent = ts_data.copy()
+    _, ts_out, _, q_est, zero_idx_ts, _, _, _ = quiet(kalman_filter_from_1cm_optic, cf_data, ts_data, mocap_data)
+    assert ts_data["timestamp"][0] < 1.8 < ts_data["timestamp"][-1]
+
+    rows = ts_sent.data[zero_idx_ts:]
+    stream = np.array(list(estimate_stream(rows, q0=q_est[zero_idx_ts, 1:])))
+    np.testing.assert_array_equal(stream[:, 0], rows[:, 0])
+    # Repeated samples report the estimate before the deferred half step
+    distinct = ts_out[zero_idx_ts:, 0] == rows[:, 0]
+    assert distinct.sum() < len(rows) if repeat_every else distinct.all()
+    np.testing.assert_allclose(stream[distinct, 1:], q_est[zero_idx_ts:][distinct, 1:], rtol=0, atol=1e-12)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Invalidation of pipeline nodes by edits to the code they reach.
+"""
+
+import pytest
+
+from TinySense import cache, pipeline
+from TinySense.runner import discover_experiments
+from conftest import DATA_DIR, quiet
+
+
+@pytest.fixture
+def edit(monkeypatch):
+    """Makes the pipeline see an edited source of a TinySense module."""
+    source = cache._module_source
+
+    def edit(module):
+        monkeypatch.setattr(cache, "_module_source",
+                            lambda name: source(name) + ("\n# edited\n" if name == module else ""))
+    return edit
+
+
+@pytest.fixture
+def flight_pipeline(tmp_path):
+    return pipeline.experiment_pipeline(discover_experiments(DATA_DIR)[:1], cache_dir=str(tmp_path))
+
+
+def _changed(flight_pipeline, edit, module):
+    before = flight_pipeline.keys()
+    edit(module)
+    after = flight_pipeline.keys()
+    return {name.split("/")[-1] for name in before if before[name] != after[name]}
+
+
+def test_callee_edits_invalidate_downstream_nodes(flight_pipeline, edit):
+    # interpolate_mocap, preprocess_data and the filter live in data_processing
+    assert _changed(flight_pipeline, edit, "TinySense.data_processing") == \
+        {"preprocess", "interpolate", "kalman", "downsample", "metrics", "summary"}
+
+
+def test_edits_leave_upstream_nodes_cached(flight_pipeline, edit):
+    # Only the scoring reaches the metrics module
+    assert _changed(flight_pipeline, edit, "TinySense.metrics") == {"downsample", "metrics", "summary"}
+
+
+def test_edited_callee_reruns_nodes(flight_pipeline, edit):
+    quiet(flight_pipeline.run)
+    quiet(flight_pipeline.run)
+    assert set(flight_pipeline.last_run.values()) == {"cached"}
+
+    edit("TinySense.metrics")
+    quiet(flight_pipeline.run)
+    computed = {name.split("/")[-1] for name, outcome in flight_pipeline.last_run.items() if outcome == "computed"}
+    assert computed == {"downsample", "metrics", "summary"}
+
+
+def test_code_digest_follows_imported_constants(edit):
+    before = cache.code_digest(pipeline._summary)
+    edit("TinySense.runner")  # RMS_COLUMNS is assigned there
+    assert cache.code_digest(pipeline._summary) != before
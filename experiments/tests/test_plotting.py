@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+Line and title reuse of the plotting helpers.
+"""
+
+import numpy as np
+from matplotlib.figure import Figure
+
+from TinySense.plotting import FigureBatch, _line, _title
+
+
+def test_plain_axes_keep_every_line():
+    ax = Figure().subplots()
+    x = np.arange(10.0)
+    _line(ax, x, x, label="a")
+    _line(ax, x, 2 * x, label="a")
+    _title(ax, "first")
+    _title(ax, "second")
+    assert len(ax.lines) == 2
+    assert [text.get_text() for text in ax.texts] == ["first", "second"]
+
+
+def test_figure_batch_reuses_lines_and_titles():
+    batch = FigureBatch(1, 1)
+    ax = batch.axs[0, 0]
+    x = np.arange(10.0)
+    first = _line(ax, x, x, label="a")
+    second = _line(ax, x, 2 * x, label="a")
+    _title(ax, "first")
+    _title(ax, "second")
+    assert second is first and len(ax.lines) == 1
+    np.testing.assert_array_equal(first.get_ydata(), 2 * x)
+    assert [text.get_text() for text in ax.texts] == ["second"]
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Batch runner: discovery, manifests and per-flight failures.
+"""
+
+import json
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from TinySense.runner import discover_experiments, read_manifest, run_batch, write_results
+from conftest import DATA_DIR, quiet
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """A complete flight (exp1) next to folders missing a source, with two CSVs and with none."""
+    for name in ("exp1", "exp2", "exp3", "exp4"):
+        shutil.copytree(os.path.join(DATA_DIR, "exp1"), tmp_path / name)
+    shutil.rmtree(tmp_path / "exp2" / "tinysense")
+    shutil.copy(tmp_path / "exp3" / "mocap" / "mocap_first.csv", tmp_path / "exp3" / "mocap" / "mocap_second.csv")
+    os.remove(tmp_path / "exp4" / "crazyflie" / "cf_first.csv")
+    return tmp_path
+
+
+def test_incomplete_folders_are_discovered_with_errors(data_dir):
+    experiments = discover_experiments(str(data_dir))
+    assert [e["name"] for e in experiments] == ["exp1", "exp2", "exp3", "exp4"]
+    assert [e["experiment_num"] for e in experiments] == [0, 1, 2, 3]
+    assert "error" not in experiments[0]
+    assert "No tinysense folder" in experiments[1]["error"]
+    assert "found 2" in experiments[2]["error"]
+    assert "found 0" in experiments[3]["error"]
+    assert experiments[1]["ts"] is None
+
+    assert [e["name"] for e in quiet(discover_experiments, str(data_dir), skip_incomplete=True)] == ["exp1"]
+
+
+def test_incomplete_folders_are_failed_rows(data_dir, tmp_path):
+    table = quiet(run_batch, discover_experiments(str(data_dir)))
+    assert list(table["status"]) == ["ok", "error", "error", "error"]
+    assert table["error"][1].startswith("No tinysense folder")
+
+    output = str(tmp_path / "results")
+    write_results(table, output)
+    with open(f"{output}.json") as file:
+        results = json.load(file)
+    assert [row["status"] for row in results["experiments"]] == ["ok", "error", "error", "error"]
+    assert set(results["summary"]) == set(table.columns[3:12])
+    assert list(pd.read_csv(f"{output}.csv")["status"]) == ["ok", "error", "error", "error"]
+
+
+def test_manifest_records_missing_paths_fail(tmp_path):
+    exp1 = os.path.join(DATA_DIR, "exp1")
+    manifest = tmp_path / "flights.csv"
+    pd.DataFrame([{"name": "good", "cf": f"{exp1}/crazyflie/cf_first.csv", "ts": f"{exp1}/tinysense/ts_first.csv",
+                   "mocap": f"{exp1}/mocap/mocap_first.csv"},
+                  {"name": "no_mocap", "cf": f"{exp1}/crazyflie/cf_first.csv",
+                   "ts": f"{exp1}/tinysense/ts_first.csv"},
+                  {"name": "missing_file", "cf": f"{exp1}/crazyflie/cf_first.csv",
+                   "ts": f"{exp1}/tinysense/ts_none.csv", "mocap": f"{exp1}/mocap/mocap_first.csv"}]
+                 ).to_csv(manifest, index=False)
+    table = quiet(run_batch, read_manifest(str(manifest)))
+    assert list(table["status"]) == ["ok", "error", "error"]
+    assert table["error"][1] == f"No mocap path in {manifest}"
+    assert "ts_none.csv" in table["error"][2]
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Clock offset and drift recovery of the cross-correlation sync.
+"""
+
+import numpy as np
+import pytest
+
+from TinySense.data_processing import preprocess_data
+from TinySense.sync import apply_sync, estimate_sync
+from conftest import quiet
+
+OFFSET = 0.0137
+DRIFT = 300e-6
+
+
+@pytest.fixture(scope="module")
+def logs(synthetic_flight):
+    cf_data, ts_data, mocap_data = quiet(preprocess_data, synthetic_flight["cf"], synthetic_flight["ts"],
+                                         synthetic_flight["mocap"], 0, time_window=200)
+    return {"cf": cf_data, "ts": ts_data}, mocap_data
+
+
+@pytest.mark.parametrize("source", ["ts", "cf"])
+def test_offset_and_drift_are_recovered(logs, source):
+    sources, mocap_data = logs
+    data = sources[source]
+    # The residual misalignment of the unshifted log is the baseline
+    base_offset, base_drift, _ = estimate_sync(data, source, mocap_data, drift=True)
+    shifted = data.copy()
+    shifted["timestamp"] = data["timestamp"] * (1 + DRIFT) + OFFSET
+
+    offset, drift, peak = estimate_sync(shifted, source, mocap_data, drift=True)
+    assert peak > 0.5
+    assert offset - base_offset == pytest.approx(OFFSET, abs=3e-3)
+    assert drift - base_drift == pytest.approx(DRIFT, abs=60e-6)
+    np.testing.assert_allclose(apply_sync(shifted, offset, drift)["timestamp"],
+                               apply_sync(data, base_offset, base_drift)["timestamp"], rtol=0, atol=3e-3)
+
+    # Without drift the offset absorbs the mean drift over the log
+    base_offset, _, _ = estimate_sync(data, source, mocap_data)
+    offset, drift, _ = estimate_sync(shifted, source, mocap_data)
+    assert drift == 0.0
+    mean_lag = OFFSET + DRIFT * np.mean(data["timestamp"])
+    assert offset - base_offset == pytest.approx(mean_lag, abs=3e-3)
+
+
+def test_uncorrelated_signals_report_a_low_peak(logs):
+    sources, mocap_data = logs
+    noise = sources["ts"].copy()
+    rng = np.random.default_rng(0)
+    noise["gyro(d/s)"] = rng.normal(size=len(noise))
+    noise["z(m)"] = rng.normal(size=len(noise))
+    offset, drift, peak = estimate_sync(noise, "ts", mocap_data, drift=True)
+    assert peak < 0.2
+    assert drift == 0.0  # No segment reaches min_correlation
+
+
+def test_disjoint_logs_are_left_unchanged(logs):
+    sources, mocap_data = logs
+    later = sources["ts"].copy()
+    later["timestamp"] = later["timestamp"] + 1000
+    assert estimate_sync(later, "ts", mocap_data, drift=True) == (0.0, 0.0, 0.0)
+    np.testing.assert_array_equal(apply_sync(later, 0.0, 0.0)["timestamp"], later["timestamp"])
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Telemetry parsing, the ring buffer and arrival times.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+from TinySense.telemetry import (RECORD_DTYPE, WIRE_DTYPE, ReplaySource, RingBuffer, TelemetryParser, TelemetryReader,
+                                replay_to_pty)
+from conftest import DATA_DIR
+
+TS_PATH = os.path.join(DATA_DIR, "exp1", "tinysense", "ts_first.csv")
+
+
+def test_parser_carries_partial_records():
+    wire = np.zeros(5, dtype=WIRE_DTYPE)
+    wire["z"] = np.arange(5)
+    payload = wire.tobytes()
+    parser = TelemetryParser()
+    first = parser.feed(payload[:30], 1.0)
+    second = parser.feed(payload[30:], 2.0)
+    np.testing.assert_array_equal(np.concatenate([first, second])["z"], np.arange(5))
+    np.testing.assert_allclose(second["timestamp"], [4 / 3, 5 / 3, 2.0])
+
+
+def test_ring_buffer_keeps_newest_records_contiguous():
+    buffer = RingBuffer(8)
+    records = np.zeros(20, dtype=RECORD_DTYPE)
+    records["timestamp"] = np.arange(20)
+    for start in range(0, 20, 3):
+        buffer.extend(records[start:start + 3])
+    np.testing.assert_array_equal(buffer.latest()["timestamp"], np.arange(12, 20))
+    view, cursor = buffer.since(17)
+    np.testing.assert_array_equal(view["timestamp"], [17, 18, 19])
+    assert cursor == 20
+
+
+def test_arrivals_follow_releases():
+    source = ReplaySource(TS_PATH, speed=None, repeat=2)
+    buffer = RingBuffer(len(source))
+    reader = TelemetryReader(source, buffer, chunk_size=1200, record_arrivals=True)
+    reader.start()
+    reader.join()
+    arrival_times = reader.arrival_times()
+    assert len(arrival_times) == len(source) == buffer.count
+    assert np.all(arrival_times >= source.release_times)
+    assert np.all(np.diff(arrival_times) >= 0)
+
+
+def test_pty_replay_fails_clearly_without_tty(monkeypatch):
+    monkeypatch.setitem(sys.modules, "tty", None)  # As on Windows, where the module does not exist
+    with pytest.raises(RuntimeError, match="Unix"):
+        replay_to_pty(TS_PATH)